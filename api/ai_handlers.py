@@ -1,20 +1,16 @@
+import asyncio
 from datetime import datetime
-from config import SYSTEM_PROMPTS
+from config import Config, SYSTEM_PROMPTS
+from context_builder import build_context
+from intent_classifier import classify_intent
+from intent_router import match_tags, route
 from openai_manager import get_smart_response, openai_manager
+from vector_index import get_retriever
 
 
 def _get_task_type_from_subject(subject):
     """Xác định task type từ subject để chọn model phù hợp"""
-    subject_lower = subject.lower()
-    
-    if any(keyword in subject_lower for keyword in ['programming', 'lập trình', 'code', 'thuật toán', 'algorithm']):
-        return "programming"
-    elif any(keyword in subject_lower for keyword in ['math', 'toán', 'calculus', 'algebra', 'geometry']):
-        return "math"
-    elif any(keyword in subject_lower for keyword in ['document', 'tài liệu', 'analysis', 'phân tích']):
-        return "document_analysis"
-    else:
-        return "general"
+    return route(subject).task_type
 
 
 
@@ -22,48 +18,13 @@ def _get_task_type_from_subject(subject):
 
 def handle_ai_question(question):
     """Xử lý câu hỏi AI thông minh với logic detect được cải thiện"""
-    q = question.lower()
     print(f"[DEBUG] handle_ai_question called with: {question}")
     
-    # QUAN TRỌNG: Kiểm tra programming trước vì "thuật toán" chứa "toán"
-    if any(keyword in q for keyword in ['lập trình', 'programming', 'code', 'python', 'javascript', 'thuật toán', 'algorithm', 'decision tree', 'machine learning', 'ai']):
-        print(f"[DEBUG] Detected programming keywords, routing to handle_programming_questions")
-        return handle_programming_questions(question)
-    
-    # Kiểm tra math sau, nhưng loại trừ trường hợp là thuật toán
-    if any(keyword in q for keyword in ['toán', 'math', 'công thức', 'tính', 'phương trình']) and 'thuật toán' not in q and 'algorithm' not in q:
-        print(f"[DEBUG] Detected math keywords, routing to handle_math_questions")
-        return handle_math_questions(question)
-    
-    if any(keyword in q for keyword in ['vật lý', 'physics', 'lực', 'năng lượng', 'tốc độ']):
-        return handle_physics_questions(question)
-    
-    if any(keyword in q for keyword in ['hóa học', 'chemistry', 'phản ứng', 'nguyên tố']):
-        return handle_chemistry_questions(question)
-    
-    if any(keyword in q for keyword in ['lịch sử', 'history', 'việt nam', 'thế giới']):
-        return handle_history_questions(question)
-    
-    if any(keyword in q for keyword in ['tiếng anh', 'english', 'grammar', 'vocabulary']):
-        return handle_english_questions(question)
-    
-    if any(keyword in q for keyword in ['học', 'ôn thi', 'thi cử', 'kiểm tra', 'mẹo', 'phương pháp']):
-        return handle_study_questions(question)
-    
-    if any(keyword in q for keyword in ['thời gian', 'kế hoạch', 'lịch trình', 'quản lý']):
-        return handle_time_management_questions(question)
-
-    if any(keyword in q for keyword in ['đại số tuyến tính', 'linear algebra', 'ma trận', 'matrix', 'vector', 'không gian vector', 'hệ phương trình tuyến tính']):
-        print(f"[DEBUG] Detected linear algebra keywords, routing to handle_linear_algebra_questions")
-        return handle_linear_algebra_questions(question)
-
-    if any(keyword in q for keyword in ['xác suất thống kê', 'probability', 'statistics', 'phân phối', 'distribution', 'kiểm định giả thuyết', 'hypothesis testing', 'hồi quy']):
-        print(f"[DEBUG] Detected probability statistics keywords, routing to handle_probability_statistics_questions")
-        return handle_probability_statistics_questions(question)
-
-    if any(keyword in q for keyword in ['giải tích', 'calculus', 'vi phân', 'differential', 'tích phân', 'integral', 'đạo hàm', 'derivative', 'giới hạn', 'limit']):
-        print(f"[DEBUG] Detected calculus keywords, routing to handle_calculus_questions")
-        return handle_calculus_questions(question)
+    # Router đã xử lý thứ tự ưu tiên (programming trước math vì "thuật toán" chứa "toán")
+    subject = route(question).subject
+    if subject != 'general':
+        print(f"[DEBUG] Detected {subject} keywords, routing to {SUBJECT_HANDLERS[subject].__name__}")
+        return SUBJECT_HANDLERS[subject](question)
     
     # General fallback với prompt đơn giản
     try:        
@@ -505,6 +466,185 @@ def handle_calculus_questions(question):
         }
 
 
+# subject của intent router -> handler
+SUBJECT_HANDLERS = {
+    'programming': handle_programming_questions,
+    'math': handle_math_questions,
+    'physics': handle_physics_questions,
+    'chemistry': handle_chemistry_questions,
+    'history': handle_history_questions,
+    'english': handle_english_questions,
+    'study': handle_study_questions,
+    'time_management': handle_time_management_questions,
+    'linear_algebra': handle_linear_algebra_questions,
+    'probability_statistics': handle_probability_statistics_questions,
+    'calculus': handle_calculus_questions,
+}
+
+# subject của intent router -> task type cho routing model (chỉ math/programming được lên tier cao khi câu hỏi khó)
+SUBJECT_TASK_TYPES = {
+    'programming': 'programming',
+    'math': 'math',
+    'linear_algebra': 'math',
+    'probability_statistics': 'math',
+    'calculus': 'math',
+}
+
+
+def _task_type_for_question(question):
+    """Task type của câu hỏi trong chat: theo môn học, không rõ môn thì theo từ khóa task của router"""
+    routed = route(question)
+    return SUBJECT_TASK_TYPES.get(routed.subject, routed.task_type)
+
+
+def _classified_as_question(question):
+    """Classifier cục bộ chắc chắn đây là câu hỏi thường (có từ khóa lịch nhưng không cần gọi calendar parser)"""
+    prediction = classify_intent(question)
+    if prediction is None:
+        return False
+    label, confidence = prediction
+    if label == 'question' and confidence >= Config.INTENT_CLASSIFIER_SETTINGS['confidence_threshold']:
+        print(f"[DEBUG] Intent classifier: question ({confidence:.2f}), skipping calendar parser")
+        return True
+    return False
+
+
+def _handle_calendar_in_chat(question):
+    """Chuyển câu hỏi có từ khóa lịch sang CalendarIntegration, trả về None nếu cần xử lý bằng AI"""
+    if 'calendar' in route(question).tags and not _classified_as_question(question):
+        print("[DEBUG] Detected calendar request in AI handler")
+        try:
+            from calendar_integration import CalendarIntegration
+            
+            # Generate a simple user ID for calendar functionality
+            user_id = f"user_{datetime.now().strftime('%Y%m%d')}"
+            
+            calendar_integration = CalendarIntegration()
+            calendar_result = calendar_integration.process_calendar_request(user_id, question)
+            
+            # Format calendar response for chat interface
+            if calendar_result['success']:
+                return {
+                    "answer": calendar_result['message'],
+                    "suggestions": ["Xem lịch", "Tạo sự kiện khác", "Hỏi về học tập"],
+                    "ai_mode": "calendar",
+                    "calendar_data": calendar_result.get('data'),
+                    "calendar_action": calendar_result.get('action')
+                }
+            else:
+                # If calendar fails, provide helpful response
+                print(f"[DEBUG] Calendar processing failed: {calendar_result['message']}")
+                if calendar_result.get('action') == 'auth_required':
+                    return {
+                        "answer": f"{calendar_result['message']}\n\n💡 **Hoặc bạn có thể hỏi tôi về:**\n• Phương pháp quản lý thời gian hiệu quả\n• Cách lập kế hoạch học tập\n• Mẹo tổ chức công việc",
+                        "suggestions": ["Quản lý thời gian", "Lập kế hoạch học", "Hỏi khác"],
+                        "ai_mode": "calendar_suggestion",
+                        "calendar_data": calendar_result.get('data')
+                    }
+                elif calendar_result.get('action') == 'none':
+                    # Continue to normal AI processing for non-calendar questions
+                    return None
+                else:
+                    return {
+                        "answer": f"{calendar_result['message']}\n\n💡 **Trong khi đó, tôi có thể giúp bạn:**\n• Lời khuyên về quản lý thời gian\n• Phương pháp lập kế hoạch học tập\n• Kỹ thuật tổ chức công việc hiệu quả",
+                        "suggestions": ["Mẹo quản lý thời gian", "Lập kế hoạch học", "Hỏi khác"],
+                        "ai_mode": "calendar_fallback"
+                    }
+                
+        except ImportError:
+            print("[DEBUG] Calendar integration not available")
+            # Add helpful response about time management
+            if 'planning' in route(question).tags:
+                return {
+                    "answer": """📅 **Về quản lý thời gian và lịch trình:**\n\nTôi hiểu bạn quan tâm đến việc quản lý thời gian! Dù chức năng calendar chưa khả dụng, tôi có thể chia sẻ các mẹo hữu ích:\n\n**🎯 Nguyên tắc ưu tiên:**\n• Ma trận Eisenhower: Quan trọng vs Gấp\n• Quy tắc 80/20: Tập trung vào 20% công việc quan trọng\n\n**⏰ Kỹ thuật Pomodoro:**\n• Làm việc 25 phút, nghỉ 5 phút\n• Tăng tập trung và hiệu suất\n\n**📝 Lập kế hoạch:**\n• Viết ra mục tiêu cụ thể\n• Chia nhỏ công việc lớn\n• Đặt deadline thực tế\n\nBạn muốn tôi giải thích chi tiết về phương pháp nào?""",
+                    "suggestions": ["Ma trận Eisenhower", "Kỹ thuật Pomodoro", "Lập kế hoạch học tập", "Mẹo tăng hiệu suất"],
+                    "ai_mode": "time_management"
+                }
+        except Exception as calendar_error:
+            print(f"[DEBUG] Calendar integration error: {calendar_error}")
+            # Continue to normal AI processing
+    
+    return None
+
+
+def _retrieve_grounding(question):
+    """Passage liên quan từ vector index (rỗng nếu index chưa được build)"""
+    retriever = get_retriever()
+    if not retriever:
+        return []
+    passages = retriever.retrieve(question)
+    if passages:
+        print(f"[DEBUG] Retrieved {len(passages)} grounding passages (best score {passages[0]['score']:.3f})")
+    return passages
+
+
+def _build_context_messages(question, context_messages=None, grounding=None, task_type=None):
+    """
+    Tạo danh sách messages (system prompt + tài liệu tham khảo + context + câu hỏi) cho context-aware AI.
+    Context được cắt theo ngân sách token của model, trả về (messages, prompt_tokens, model)
+    """
+    # Prepare messages with context
+    messages = []
+    
+    # Add system prompt
+    messages.append({
+        "role": "system", 
+        "content": """Bạn là trợ lý học tập thông minh. Trả lời câu hỏi một cách chính xác và hữu ích.
+        Sử dụng HTML formatting cho câu trả lời đẹp mắt. Hãy duy trì ngữ cảnh cuộc trò chuyện.
+        
+        KHI NGƯỜI DÙNG HỎI VỀ THỜI GIAN/LỊCH TRÌNH:
+        - Đưa ra lời khuyên thực tế về quản lý thời gian
+        - Gợi ý các phương pháp lập kế hoạch hiệu quả
+        - Chia sẻ kỹ thuật tổ chức công việc
+        """
+    })
+    
+    # Add retrieved passages as grounding
+    if grounding:
+        references = "\n\n".join(
+            f"[{i}] Hỏi: {p['question']}\nĐáp: {p['answer']}" for i, p in enumerate(grounding, 1)
+        )
+        messages.append({
+            "role": "system",
+            "content": f"Tài liệu tham khảo (chỉ dùng nếu liên quan đến câu hỏi):\n\n{references}"
+        })
+    
+    # Add context messages (mới nhất trước) và câu hỏi hiện tại trong ngân sách token
+    return _route_and_build(messages, context_messages, question, task_type or _task_type_for_question(question))
+
+
+def _route_and_build(system_messages, context_messages, question, task_type):
+    """
+    Chọn model một lần trên prompt thật (system messages + context + câu hỏi) rồi cắt context theo ngân sách
+    của chính model đó; caller truyền model này cho chat_completion để không route lại. Trả về (messages, prompt_tokens, model)
+    """
+    model = openai_manager.get_model_for_task(
+        task_type, system_messages + list(context_messages or []) + [{"role": "user", "content": question}]
+    )
+    messages, prompt_tokens = build_context(system_messages, context_messages, question, model)
+    return messages, prompt_tokens, model
+
+
+def _build_subject_messages(system_prompt, question, context_messages, task_type):
+    """Messages cho handler theo môn học: system prompt + context vừa ngân sách token + câu hỏi"""
+    messages, prompt_tokens, model = _route_and_build(
+        [{"role": "system", "content": system_prompt}], context_messages, question, task_type
+    )
+    print(f"[DEBUG] Prompt tokens: {prompt_tokens} ({len(messages) - 2} context messages)")
+    return messages, prompt_tokens, model
+
+
+def _context_aware_suggestions(question, ai_response):
+    """Gợi ý tiếp theo cho câu trả lời context-aware"""
+    # Include calendar/time management suggestions
+    suggestions = ["Hỏi thêm", "Làm rõ", "Ví dụ", "Chuyển chủ đề"]
+    
+    if 'time_management_hint' in route(question).tags or 'time_management_hint' in match_tags(ai_response):
+        suggestions = ["Mẹo quản lý thời gian", "Kỹ thuật Pomodoro", "Lập kế hoạch học"] + suggestions[:1]
+    
+    return suggestions
+
+
 # Context-aware handlers (for conversation continuity)
 def handle_ai_question_with_context(question, context_messages=None):
     """Xử lý câu hỏi AI với context từ cuộc trò chuyện trước"""
@@ -514,123 +654,34 @@ def handle_ai_question_with_context(question, context_messages=None):
     
     try:
         # PRIORITY 1: Check for calendar requests first
-        calendar_keywords = [
-            'lịch', 'deadline', 'hẹn', 'cuộc họp', 'sự kiện', 'nhắc nhở', 
-            'meeting', 'event', 'reminder', 'schedule', 'appointment',
-            'tạo lịch', 'đặt lịch', 'thêm lịch', 'lên lịch'
-        ]
-        
-        if any(keyword in question.lower() for keyword in calendar_keywords):
-            print(f"[DEBUG] Detected calendar request in AI handler")
-            try:
-                from calendar_integration import CalendarIntegration
-                
-                # Generate a simple user ID for calendar functionality
-                user_id = f"user_{datetime.now().strftime('%Y%m%d')}"
-                
-                calendar_integration = CalendarIntegration()
-                calendar_result = calendar_integration.process_calendar_request(user_id, question)
-                
-                # Format calendar response for chat interface
-                if calendar_result['success']:
-                    return {
-                        "answer": calendar_result['message'],
-                        "suggestions": ["Xem lịch", "Tạo sự kiện khác", "Hỏi về học tập"],
-                        "ai_mode": "calendar",
-                        "calendar_data": calendar_result.get('data'),
-                        "calendar_action": calendar_result.get('action')
-                    }
-                else:
-                    # If calendar fails, provide helpful response
-                    print(f"[DEBUG] Calendar processing failed: {calendar_result['message']}")
-                    if calendar_result.get('action') == 'auth_required':
-                        return {
-                            "answer": f"{calendar_result['message']}\n\n💡 **Hoặc bạn có thể hỏi tôi về:**\n• Phương pháp quản lý thời gian hiệu quả\n• Cách lập kế hoạch học tập\n• Mẹo tổ chức công việc",
-                            "suggestions": ["Quản lý thời gian", "Lập kế hoạch học", "Hỏi khác"],
-                            "ai_mode": "calendar_suggestion",
-                            "calendar_data": calendar_result.get('data')
-                        }
-                    elif calendar_result.get('action') == 'none':
-                        # Continue to normal AI processing for non-calendar questions
-                        pass
-                    else:
-                        return {
-                            "answer": f"{calendar_result['message']}\n\n💡 **Trong khi đó, tôi có thể giúp bạn:**\n• Lời khuyên về quản lý thời gian\n• Phương pháp lập kế hoạch học tập\n• Kỹ thuật tổ chức công việc hiệu quả",
-                            "suggestions": ["Mẹo quản lý thời gian", "Lập kế hoạch học", "Hỏi khác"],
-                            "ai_mode": "calendar_fallback"
-                        }
-                    
-            except ImportError:
-                print("[DEBUG] Calendar integration not available")
-                # Add helpful response about time management
-                if any(word in question.lower() for word in ['lịch', 'deadline', 'kế hoạch', 'thời gian']):
-                    return {
-                        "answer": """📅 **Về quản lý thời gian và lịch trình:**\n\nTôi hiểu bạn quan tâm đến việc quản lý thời gian! Dù chức năng calendar chưa khả dụng, tôi có thể chia sẻ các mẹo hữu ích:\n\n**🎯 Nguyên tắc ưu tiên:**\n• Ma trận Eisenhower: Quan trọng vs Gấp\n• Quy tắc 80/20: Tập trung vào 20% công việc quan trọng\n\n**⏰ Kỹ thuật Pomodoro:**\n• Làm việc 25 phút, nghỉ 5 phút\n• Tăng tập trung và hiệu suất\n\n**📝 Lập kế hoạch:**\n• Viết ra mục tiêu cụ thể\n• Chia nhỏ công việc lớn\n• Đặt deadline thực tế\n\nBạn muốn tôi giải thích chi tiết về phương pháp nào?""",
-                        "suggestions": ["Ma trận Eisenhower", "Kỹ thuật Pomodoro", "Lập kế hoạch học tập", "Mẹo tăng hiệu suất"],
-                        "ai_mode": "time_management"
-                    }
-            except Exception as calendar_error:
-                print(f"[DEBUG] Calendar integration error: {calendar_error}")
-                # Continue to normal AI processing
+        calendar_response = _handle_calendar_in_chat(question)
+        if calendar_response:
+            return calendar_response
         
         # PRIORITY 2: Normal AI processing
-        # Prepare messages with context
-        messages = []
-        
-        # Add system prompt
-        messages.append({
-            "role": "system", 
-            "content": """Bạn là trợ lý học tập thông minh. Trả lời câu hỏi một cách chính xác và hữu ích.
-            Sử dụng HTML formatting cho câu trả lời đẹp mắt. Hãy duy trì ngữ cảnh cuộc trò chuyện.
-            
-            KHI NGƯỜI DÙNG HỎI VỀ THỜI GIAN/LỊCH TRÌNH:
-            - Đưa ra lời khuyên thực tế về quản lý thời gian
-            - Gợi ý các phương pháp lập kế hoạch hiệu quả
-            - Chia sẻ kỹ thuật tổ chức công việc
-            """
-        })
-        
-        # Add context messages if available
-        if context_messages:
-            for msg in context_messages[-6:]:  # Keep last 6 messages for context
-                if msg.get('role') and msg.get('content'):
-                    messages.append({
-                        "role": msg['role'],
-                        "content": msg['content']
-                    })
-        
-        # Add current question
-        messages.append({"role": "user", "content": question})
+        task_type = _task_type_for_question(question)
+        messages, prompt_tokens, model = _build_context_messages(
+            question, context_messages, _retrieve_grounding(question), task_type
+        )
+        print(f"[DEBUG] Prompt tokens: {prompt_tokens}")
         
         # Use OpenAI manager for response
         result = openai_manager.chat_completion(
             messages=messages,
-            task_type="general",
-            temperature=0.3
+            task_type=task_type,
+            temperature=0.3,
+            model=model
         )
         
         if result["success"]:
             ai_response = result["response"].choices[0].message.content.strip()
             
-            # Check if response should include calendar/time management suggestions
-            response_lower = ai_response.lower()
-            question_lower = question.lower()
-            
-            calendar_trigger_words = [
-                'thời gian', 'lịch trình', 'deadline', 'kế hoạch', 'nhắc nhở',
-                'tổ chức', 'quản lý', 'ưu tiên'
-            ]
-            
-            suggestions = ["Hỏi thêm", "Làm rõ", "Ví dụ", "Chuyển chủ đề"]
-            
-            if any(word in question_lower or word in response_lower for word in calendar_trigger_words):
-                suggestions = ["Mẹo quản lý thời gian", "Kỹ thuật Pomodoro", "Lập kế hoạch học"] + suggestions[:1]
-            
             return {
                 "answer": ai_response,
-                "suggestions": suggestions,
+                "suggestions": _context_aware_suggestions(question, ai_response),
                 "ai_mode": "context_aware",
-                "model_used": result["model_used"]
+                "model_used": result["model_used"],
+                "prompt_tokens": prompt_tokens
             }
         else:
             return {
@@ -648,37 +699,128 @@ def handle_ai_question_with_context(question, context_messages=None):
         }
 
 
+async def ahandle_ai_question_with_context(question, context_messages=None):
+    """Bản async của handle_ai_question_with_context cho serving mode ASGI"""
+    print("[DEBUG] ahandle_ai_question_with_context called")
+    print(f"[DEBUG] Context messages: {len(context_messages) if context_messages else 0}")
+    
+    try:
+        # Calendar dùng Google API client sync: chạy trong thread pool
+        calendar_response = await asyncio.to_thread(_handle_calendar_in_chat, question)
+        if calendar_response:
+            return calendar_response
+        
+        grounding = await asyncio.to_thread(_retrieve_grounding, question)
+        task_type = _task_type_for_question(question)
+        messages, prompt_tokens, model = _build_context_messages(question, context_messages, grounding, task_type)
+        print(f"[DEBUG] Prompt tokens: {prompt_tokens}")
+        result = await openai_manager.achat_completion(
+            messages=messages,
+            task_type=task_type,
+            temperature=0.3,
+            model=model
+        )
+        
+        if result["success"]:
+            ai_response = result["response"].choices[0].message.content.strip()
+            return {
+                "answer": ai_response,
+                "suggestions": _context_aware_suggestions(question, ai_response),
+                "ai_mode": "context_aware",
+                "model_used": result["model_used"],
+                "prompt_tokens": prompt_tokens
+            }
+        else:
+            return {
+                "answer": f"Xin lỗi, có lỗi xảy ra: {result.get('error', 'Unknown error')}",
+                "suggestions": ["Thử lại", "Hỏi khác", "Đơn giản hóa câu hỏi"],
+                "ai_mode": "error"
+            }
+    
+    except Exception as e:
+        print(f"[ERROR] Context-aware AI error: {e}")
+        return {
+            "answer": f"Xin lỗi, có lỗi xảy ra khi xử lý câu hỏi: {str(e)}",
+            "suggestions": ["Thử lại", "Hỏi đơn giản hơn"],
+            "ai_mode": "error"
+        }
+
+
+def stream_ai_question_with_context(question, context_messages=None):
+    """
+    Phiên bản streaming của handle_ai_question_with_context.
+    Yield {"content": ...} cho từng đoạn câu trả lời, cuối cùng yield {"done": True, "response": {...}}
+    với response cùng format như bản không stream.
+    """
+    print("[DEBUG] stream_ai_question_with_context called")
+    print(f"[DEBUG] Context messages: {len(context_messages) if context_messages else 0}")
+    
+    calendar_response = _handle_calendar_in_chat(question)
+    if calendar_response:
+        yield {"done": True, "response": calendar_response}
+        return
+    
+    task_type = _task_type_for_question(question)
+    messages, prompt_tokens, model = _build_context_messages(
+        question, context_messages, _retrieve_grounding(question), task_type
+    )
+    print(f"[DEBUG] Prompt tokens: {prompt_tokens}")
+    chunks = []
+    model_used = None
+    try:
+        for event in openai_manager.chat_completion_stream(messages=messages, task_type=task_type, temperature=0.3,
+                                                           model=model):
+            if event.get("done"):
+                model_used = event["model_used"]
+            else:
+                chunks.append(event["content"])
+                yield event
+    except Exception as e:
+        print(f"[ERROR] Streaming AI error: {e}")
+        if not chunks:
+            yield {"done": True, "response": {
+                "answer": f"Xin lỗi, có lỗi xảy ra khi xử lý câu hỏi: {str(e)}",
+                "suggestions": ["Thử lại", "Hỏi đơn giản hơn"],
+                "ai_mode": "error"
+            }}
+            return
+        # Client đã nhận một phần câu trả lời: giữ phần đó thay vì thay bằng thông báo lỗi
+    
+    ai_response = "".join(chunks).strip()
+    yield {"done": True, "response": {
+        "answer": ai_response,
+        "suggestions": _context_aware_suggestions(question, ai_response),
+        "ai_mode": "context_aware",
+        "model_used": model_used,
+        "prompt_tokens": prompt_tokens
+    }}
+
+
 # Additional context-aware handlers for specific subjects
 def handle_math_questions_with_context(question, context_messages=None):
     """Xử lý câu hỏi Toán với context"""
-    messages = [{"role": "system", "content": SYSTEM_PROMPTS['math']}]
-    if context_messages:
-        messages.extend(context_messages[-4:])
-    messages.append({"role": "user", "content": question})
-    
-    result = openai_manager.chat_completion(messages=messages, task_type="math", temperature=0.3)
+    messages, prompt_tokens, model = _build_subject_messages(SYSTEM_PROMPTS['math'], question, context_messages, "math")
+    result = openai_manager.chat_completion(messages=messages, task_type="math", temperature=0.3, model=model)
     if result["success"]:
         return {
             "answer": result["response"].choices[0].message.content.strip(),
             "suggestions": ["Bài tập thêm", "Giải thích chi tiết", "Ví dụ khác"],
-            "ai_mode": "math_context"
+            "ai_mode": "math_context",
+            "prompt_tokens": prompt_tokens
         }
     return {"answer": "Lỗi xử lý câu hỏi Toán.", "suggestions": ["Thử lại"]}
 
 
 def handle_programming_questions_with_context(question, context_messages=None):
     """Xử lý câu hỏi Lập trình với context"""
-    messages = [{"role": "system", "content": SYSTEM_PROMPTS['programming']}]
-    if context_messages:
-        messages.extend(context_messages[-4:])
-    messages.append({"role": "user", "content": question})
-    
-    result = openai_manager.chat_completion(messages=messages, task_type="programming", temperature=0.2)
+    messages, prompt_tokens, model = _build_subject_messages(SYSTEM_PROMPTS['programming'], question, context_messages, "programming")
+    result = openai_manager.chat_completion(messages=messages, task_type="programming", temperature=0.2, model=model)
     if result["success"]:
         return {
             "answer": result["response"].choices[0].message.content.strip(),
             "suggestions": ["Code example", "Best practices", "Debug help"],
-            "ai_mode": "programming_context"
+            "ai_mode": "programming_context",
+            "prompt_tokens": prompt_tokens
         }
     return {"answer": "Lỗi xử lý câu hỏi Lập trình.", "suggestions": ["Thử lại"]}
 
@@ -686,89 +828,64 @@ def handle_programming_questions_with_context(question, context_messages=None):
 # Additional subject handlers with context
 def handle_physics_questions_with_context(question, context_messages=None):
     """Xử lý câu hỏi Vật lý với context"""
-    messages = [{"role": "system", "content": SYSTEM_PROMPTS['physics']}]
-    if context_messages:
-        messages.extend(context_messages[-4:])
-    messages.append({"role": "user", "content": question})
-    
-    result = openai_manager.chat_completion(messages=messages, task_type="general", temperature=0.3)
-    return _format_response_with_fallback(result, "physics_context", ["Thí nghiệm", "Ứng dụng", "Công thức"])
+    messages, prompt_tokens, model = _build_subject_messages(SYSTEM_PROMPTS['physics'], question, context_messages, "general")
+    result = openai_manager.chat_completion(messages=messages, task_type="general", temperature=0.3, model=model)
+    return _format_response_with_fallback(result, "physics_context", ["Thí nghiệm", "Ứng dụng", "Công thức"], prompt_tokens)
 
 
 def handle_chemistry_questions_with_context(question, context_messages=None):
     """Xử lý câu hỏi Hóa học với context"""
-    messages = [{"role": "system", "content": SYSTEM_PROMPTS['chemistry']}]
-    if context_messages:
-        messages.extend(context_messages[-4:])
-    messages.append({"role": "user", "content": question})
-    
-    result = openai_manager.chat_completion(messages=messages, task_type="general", temperature=0.3)
-    return _format_response_with_fallback(result, "chemistry_context", ["Phản ứng", "Thí nghiệm", "Cơ chế"])
+    messages, prompt_tokens, model = _build_subject_messages(SYSTEM_PROMPTS['chemistry'], question, context_messages, "general")
+    result = openai_manager.chat_completion(messages=messages, task_type="general", temperature=0.3, model=model)
+    return _format_response_with_fallback(result, "chemistry_context", ["Phản ứng", "Thí nghiệm", "Cơ chế"], prompt_tokens)
 
 
 def handle_history_questions_with_context(question, context_messages=None):
     """Xử lý câu hỏi Lịch sử với context"""
-    messages = [{"role": "system", "content": SYSTEM_PROMPTS['history']}]
-    if context_messages:
-        messages.extend(context_messages[-4:])
-    messages.append({"role": "user", "content": question})
-    
-    result = openai_manager.chat_completion(messages=messages, task_type="general", temperature=0.3)
-    return _format_response_with_fallback(result, "history_context", ["Nhân vật", "Sự kiện", "Ý nghĩa"])
+    messages, prompt_tokens, model = _build_subject_messages(SYSTEM_PROMPTS['history'], question, context_messages, "general")
+    result = openai_manager.chat_completion(messages=messages, task_type="general", temperature=0.3, model=model)
+    return _format_response_with_fallback(result, "history_context", ["Nhân vật", "Sự kiện", "Ý nghĩa"], prompt_tokens)
 
 
 def handle_english_questions_with_context(question, context_messages=None):
     """Xử lý câu hỏi Tiếng Anh với context"""
-    messages = [{"role": "system", "content": SYSTEM_PROMPTS['english']}]
-    if context_messages:
-        messages.extend(context_messages[-4:])
-    messages.append({"role": "user", "content": question})
-    
-    result = openai_manager.chat_completion(messages=messages, task_type="general", temperature=0.3)
-    return _format_response_with_fallback(result, "english_context", ["Grammar", "Vocabulary", "Practice"])
+    messages, prompt_tokens, model = _build_subject_messages(SYSTEM_PROMPTS['english'], question, context_messages, "general")
+    result = openai_manager.chat_completion(messages=messages, task_type="general", temperature=0.3, model=model)
+    return _format_response_with_fallback(result, "english_context", ["Grammar", "Vocabulary", "Practice"], prompt_tokens)
 
 
 def handle_study_questions_with_context(question, context_messages=None):
     """Xử lý câu hỏi Học tập với context"""
-    messages = [{"role": "system", "content": SYSTEM_PROMPTS['study']}]
-    if context_messages:
-        messages.extend(context_messages[-4:])
-    messages.append({"role": "user", "content": question})
-    
-    result = openai_manager.chat_completion(messages=messages, task_type="general", temperature=0.3)
-    return _format_response_with_fallback(result, "study_context", ["Kế hoạch", "Phương pháp", "Động lực"])
+    messages, prompt_tokens, model = _build_subject_messages(SYSTEM_PROMPTS['study'], question, context_messages, "general")
+    result = openai_manager.chat_completion(messages=messages, task_type="general", temperature=0.3, model=model)
+    return _format_response_with_fallback(result, "study_context", ["Kế hoạch", "Phương pháp", "Động lực"], prompt_tokens)
 
 
 def handle_time_management_questions_with_context(question, context_messages=None):
     """Xử lý câu hỏi Quản lý thời gian với context"""
-    messages = [{"role": "system", "content": SYSTEM_PROMPTS['time_management']}]
-    if context_messages:
-        messages.extend(context_messages[-4:])
-    messages.append({"role": "user", "content": question})
-    
-    result = openai_manager.chat_completion(messages=messages, task_type="general", temperature=0.3)
-    return _format_response_with_fallback(result, "time_management_context", ["Lập kế hoạch", "Ưu tiên", "Cân bằng"])
+    messages, prompt_tokens, model = _build_subject_messages(SYSTEM_PROMPTS['time_management'], question, context_messages, "general")
+    result = openai_manager.chat_completion(messages=messages, task_type="general", temperature=0.3, model=model)
+    return _format_response_with_fallback(result, "time_management_context", ["Lập kế hoạch", "Ưu tiên", "Cân bằng"], prompt_tokens)
 
 
 def handle_general_questions_with_context(question, context_messages=None):
     """Xử lý câu hỏi chung với context"""
-    messages = [{"role": "system", "content": "Bạn là trợ lý học tập thông minh. Trả lời một cách hữu ích và chính xác."}]
-    if context_messages:
-        messages.extend(context_messages[-4:])
-    messages.append({"role": "user", "content": question})
-    
-    result = openai_manager.chat_completion(messages=messages, task_type="general", temperature=0.3)
-    return _format_response_with_fallback(result, "general_context", ["Hỏi thêm", "Làm rõ", "Chuyển chủ đề"])
+    messages, prompt_tokens, model = _build_subject_messages("Bạn là trợ lý học tập thông minh. Trả lời một cách hữu ích và chính xác.", question, context_messages, "general")
+    result = openai_manager.chat_completion(messages=messages, task_type="general", temperature=0.3, model=model)
+    return _format_response_with_fallback(result, "general_context", ["Hỏi thêm", "Làm rõ", "Chuyển chủ đề"], prompt_tokens)
 
 
-def _format_response_with_fallback(result, ai_mode, suggestions):
+def _format_response_with_fallback(result, ai_mode, suggestions, prompt_tokens=None):
     """Helper function để format response với fallback"""
     if result["success"]:
-        return {
+        response = {
             "answer": result["response"].choices[0].message.content.strip(),
             "suggestions": suggestions,
             "ai_mode": ai_mode
         }
+        if prompt_tokens is not None:
+            response["prompt_tokens"] = prompt_tokens
+        return response
     else:
         return {
             "answer": f"Lỗi xử lý câu hỏi: {result.get('error', 'Unknown error')}",
@@ -0,0 +1,124 @@
+"""
+ASGI entrypoint cho serving mode async
+
+Chạy trong thư mục api:
+    uvicorn asgi:application --host 0.0.0.0 --port 5000
+
+View async của Flask app (chat, calendar, conversations) được chạy trực tiếp trên event loop của
+server, nên một process giữ được hàng trăm request đang chờ OpenAI/Google cùng lúc thay vì mỗi
+request một thread. Các view sync còn lại (static files, OAuth, export, /chat/stream) được chuyển
+qua WsgiToAsgi và chạy trong thread pool như trước.
+"""
+import inspect
+import sys
+from io import BytesIO
+
+from asgiref.wsgi import WsgiToAsgi
+from flask import request
+from werkzeug.exceptions import HTTPException
+
+from main import app
+
+wsgi_application = WsgiToAsgi(app)
+
+
+def _is_async_view(scope) -> bool:
+    """Route của request có trỏ tới view async không"""
+    adapter = app.url_map.bind('localhost')
+    try:
+        endpoint, _ = adapter.match(scope['path'], method=scope['method'])
+    except HTTPException:
+        return False
+    return inspect.iscoroutinefunction(app.view_functions.get(endpoint))
+
+
+async def _read_body(receive) -> bytes:
+    """Đọc toàn bộ request body từ ASGI receive"""
+    body = b''
+    more_body = True
+    while more_body:
+        message = await receive()
+        body += message.get('body', b'')
+        more_body = message.get('more_body', False)
+    return body
+
+
+def _build_environ(scope, body: bytes) -> dict:
+    """Tạo WSGI environ từ ASGI scope để Flask dựng request context"""
+    server_name, server_port = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf8').decode('latin1'),
+        'PATH_INFO': scope['path'].encode('utf8').decode('latin1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin1'),
+        'SERVER_NAME': server_name,
+        'SERVER_PORT': str(server_port),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': (scope.get('client') or ('', 0))[0],
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for raw_name, raw_value in scope.get('headers', []):
+        name = raw_name.decode('latin1').upper().replace('-', '_')
+        value = raw_value.decode('latin1')
+        if name == 'CONTENT_TYPE':
+            environ['CONTENT_TYPE'] = value
+        elif name != 'CONTENT_LENGTH':
+            key = f'HTTP_{name}'
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+async def _dispatch_async_view(environ):
+    """Chạy view async trong request context của Flask (giống full_dispatch_request)"""
+    ctx = app.request_context(environ)
+    ctx.push()
+    try:
+        try:
+            rv = app.preprocess_request()
+            if rv is None:
+                view = app.view_functions[request.url_rule.endpoint]
+                rv = await view(**request.view_args)
+        except Exception as e:
+            rv = app.handle_user_exception(e)
+        # finalize_request lưu session (Set-Cookie) như request WSGI bình thường
+        return app.finalize_request(rv)
+    except Exception as e:
+        return app.handle_exception(e)
+    finally:
+        ctx.pop()
+
+
+async def application(scope, receive, send):
+    """ASGI app: view async chạy trên event loop, còn lại chuyển cho Flask qua WsgiToAsgi"""
+    if scope['type'] == 'lifespan':
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    if scope['type'] != 'http' or not _is_async_view(scope):
+        await wsgi_application(scope, receive, send)
+        return
+
+    body = await _read_body(receive)
+    response = await _dispatch_async_view(_build_environ(scope, body))
+
+    await send({
+        'type': 'http.response.start',
+        'status': response.status_code,
+        'headers': [
+            (name.lower().encode('latin1'), value.encode('latin1'))
+            for name, value in response.headers.items()
+        ]
+    })
+    await send({'type': 'http.response.body', 'body': response.get_data()})
@@ -1,17 +1,89 @@
+import os
 import re
-from datetime import datetime, timedelta
+import threading
+import time
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
 from typing import Dict, List, Optional, Tuple
+from zoneinfo import ZoneInfo
 import openai
+from calendar_grammar import extract_title, parse_datetime
 from config import Config
+from intent_router import route
+from response_cache import normalize_prompt
+
+WEEKDAY_NAMES = ['Thứ Hai', 'Thứ Ba', 'Thứ Tư', 'Thứ Năm', 'Thứ Sáu', 'Thứ Bảy', 'Chủ Nhật']
+
+CALENDAR_TIMEZONE = ZoneInfo(Config.GOOGLE_CALENDAR_CONFIG['timezone'])
+
+
+def calendar_now() -> datetime:
+    """Thời điểm hiện tại theo CALENDAR_TIMEZONE (naive), mốc cho 'hôm nay', 'ngày mai', 'thứ 5'..."""
+    return datetime.now(CALENDAR_TIMEZONE).replace(tzinfo=None)
+
+
+class ParseCache:
+    """
+    LRU cho kết quả parse, key = câu đã chuẩn hóa. Ngày tương đối ("ngày mai", "thứ 5") đã được resolve
+    theo ngày tham chiếu, nên toàn bộ entry hết hạn khi sang ngày mới theo CALENDAR_TIMEZONE
+    """
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Dict]" = OrderedDict()
+        self._day: Optional[date] = None
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0}
+
+    def _roll_over(self, today: date):
+        """Sang ngày mới thì bỏ toàn bộ entry của ngày cũ (gọi khi đang giữ lock)"""
+        if self._day is None or today > self._day:
+            self.stats['expirations'] += len(self._entries)
+            self._entries.clear()
+            self._day = today
+
+    def get(self, message: str, today: date) -> Optional[Dict]:
+        """Bản sao kết quả đã cache, None nếu miss"""
+        key = normalize_prompt(message)
+        with self._lock:
+            self._roll_over(today)
+            result = self._entries.get(key) if today == self._day else None
+            if result is None:
+                self.stats['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats['hits'] += 1
+            return dict(result)
+
+    def put(self, message: str, today: date, result: Dict):
+        key = normalize_prompt(message)
+        with self._lock:
+            self._roll_over(today)
+            if today != self._day:
+                # request bắt đầu trước nửa đêm, kết quả resolve theo ngày cũ
+                return
+            self._entries[key] = dict(result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats['evictions'] += 1
+
+
+# dùng chung cho mọi CalendarAIParser (mỗi request tạo một CalendarIntegration mới)
+parse_cache = ParseCache(Config.CALENDAR_SETTINGS['parse_cache_size'])
+
 
 class CalendarAIParser:
     """AI parser for natural language calendar requests"""
     def __init__(self):
         openai.api_key = Config.OPENAI_API_KEY
+        self.cache = parse_cache
         
-    def parse_calendar_request(self, user_message: str) -> Dict:
+    def parse_calendar_request(self, user_message: str, now: Optional[datetime] = None) -> Dict:
         """
         Parse user message to extract calendar-related information
+        Tầng rule (calendar_grammar) chạy trước, LLM chỉ được gọi khi confidence của rule < parser_llm_threshold.
+        Kết quả được cache theo câu đã chuẩn hóa + ngày hôm nay (CALENDAR_TIMEZONE); list_events không gọi LLM
         Returns: {
             'action': 'create_event' | 'create_deadline' | 'list_events' | 'delete_event' | 'none',
             'title': str,
@@ -20,19 +92,37 @@ class CalendarAIParser:
             'description': str,
             'duration': int (minutes),
             'reminder': int (minutes before),
-            'confidence': float (0-1)
+            'confidence': float (0-1),
+            'parser': 'rules' | 'llm'
         }
         """
         
         # Quick keyword detection first
-        calendar_keywords = [
-            'lịch', 'deadline', 'hẹn', 'cuộc họp', 'sự kiện', 'nhắc nhở', 
-            'meeting', 'event', 'reminder', 'schedule', 'appointment',
-            'tạo lịch', 'đặt lịch', 'thêm lịch', 'lên lịch'
-        ]
-        
-        if not any(keyword in user_message.lower() for keyword in calendar_keywords):
+        if 'calendar' not in route(user_message).tags:
             return {'action': 'none', 'confidence': 0.0}
+        
+        now = now or calendar_now()
+        cached = self.cache.get(user_message, now.date())
+        if cached is not None:
+            return cached
+        
+        rule_result = self._fallback_rule_based_parsing(user_message, now)
+        # xem lịch chỉ cần action, khoảng thời gian do calendar_integration xử lý
+        if (rule_result['action'] == 'list_events'
+                or rule_result['confidence'] >= Config.CALENDAR_SETTINGS['parser_llm_threshold']):
+            self.cache.put(user_message, now.date(), rule_result)
+            return rule_result
+        
+        print(f"[DEBUG] Calendar rules confidence {rule_result['confidence']:.2f}, escalating to LLM")
+        llm_result = self._parse_with_llm(user_message, now)
+        if llm_result is None:
+            # LLM lỗi: dùng kết quả rule nhưng không cache để lần sau thử lại
+            return rule_result
+        self.cache.put(user_message, now.date(), llm_result)
+        return llm_result
+    
+    def _parse_with_llm(self, user_message: str, now: datetime) -> Optional[Dict]:
+        """Parse bằng gpt-4o-mini, None nếu gọi API hoặc đọc JSON thất bại"""
         try:
             # Use AI to parse the request
             prompt = f"""
@@ -48,6 +138,7 @@ Phân tích tin nhắn người dùng và trích xuất thông tin lịch. Trả
     "confidence": 0.0-1.0
 }}
 
+Hôm nay là {WEEKDAY_NAMES[now.weekday()]}, {now.strftime('%Y-%m-%d')}.
 Tin nhắn: "{user_message}"
 
 Lưu ý:
@@ -82,19 +173,19 @@ Lưu ý:
                     parsed_data = json.loads(ai_response)
                 
                 # Validate and enhance the parsed data
-                result = self._validate_and_enhance_parsed_data(parsed_data, user_message)
+                result = self._validate_and_enhance_parsed_data(parsed_data, user_message, now)
+                result['parser'] = 'llm'
                 return result
                 
             except json.JSONDecodeError:
-                # Fallback to rule-based parsing
-                return self._fallback_rule_based_parsing(user_message)
+                return None
                 
         except Exception as e:
             print(f"AI parsing error: {e}")
-            # Fallback to rule-based parsing
-            return self._fallback_rule_based_parsing(user_message)
+            return None
     
-    def _validate_and_enhance_parsed_data(self, parsed_data: Dict, original_message: str) -> Dict:
+    def _validate_and_enhance_parsed_data(self, parsed_data: Dict, original_message: str,
+                                          now: Optional[datetime] = None) -> Dict:
         """Validate and enhance AI parsed data"""
         
         # Default values
@@ -119,24 +210,16 @@ Lưu ý:
         
         # Auto-detect action if not specified correctly
         if result['action'] == 'none':
-            message_lower = original_message.lower()
-            if any(word in message_lower for word in ['tạo', 'đặt', 'thêm', 'lên lịch', 'create']):
-                if 'deadline' in message_lower:
-                    result['action'] = 'create_deadline'
-                else:
-                    result['action'] = 'create_event'
-            elif any(word in message_lower for word in ['xem', 'hiện', 'list', 'show']):
-                result['action'] = 'list_events'
-            elif any(word in message_lower for word in ['xóa', 'hủy', 'delete', 'cancel']):
-                result['action'] = 'delete_event'
+            result['action'] = route(original_message).calendar_action
         
         # Validate and fix date
+        now = now or calendar_now()
         if result['date']:
-            result['date'] = self._normalize_date(result['date'], original_message)
+            result['date'] = self._normalize_date(result['date'], original_message, now)
         else:
             # Default to tomorrow if creating event
             if result['action'] in ['create_event', 'create_deadline']:
-                tomorrow = datetime.now() + timedelta(days=1)
+                tomorrow = now + timedelta(days=1)
                 result['date'] = tomorrow.strftime('%Y-%m-%d')
         
         # Validate time format
@@ -145,7 +228,7 @@ Lưu ý:
         
         # Generate title if missing
         if not result['title'] and result['action'] in ['create_event', 'create_deadline']:
-            result['title'] = self._extract_title_from_message(original_message)
+            result['title'] = self._extract_title_from_message(original_message, now)
         
         # Adjust confidence based on completeness
         if result['action'] != 'none':
@@ -159,173 +242,64 @@ Lưu ý:
         
         return result
     
-    def _fallback_rule_based_parsing(self, user_message: str) -> Dict:
-        """Fallback rule-based parsing when AI fails"""
-        
-        message_lower = user_message.lower()
+    def _fallback_rule_based_parsing(self, user_message: str, now: Optional[datetime] = None) -> Dict:
+        """Rule-based parsing (action từ intent router, ngày giờ từ calendar_grammar) kèm confidence"""
+        now = now or calendar_now()
+        action = route(user_message).calendar_action
+        parsed = parse_datetime(user_message, now.date())
+        title = extract_title(user_message, parsed)
         
-        # Detect action
-        action = 'none'
-        if any(word in message_lower for word in ['tạo', 'đặt', 'thêm', 'lên lịch', 'create', 'add']):
-            if 'deadline' in message_lower:
-                action = 'create_deadline'
-            else:
-                action = 'create_event'
-        elif any(word in message_lower for word in ['xem', 'hiện', 'list', 'show']):
-            action = 'list_events'
-        elif any(word in message_lower for word in ['xóa', 'hủy', 'delete', 'cancel']):
-            action = 'delete_event'
+        # Confidence: action rõ ràng, rồi đến mức đầy đủ của ngày / giờ / tên sự kiện
+        confidence = 0.0
+        if action in ('create_event', 'create_deadline'):
+            confidence = 0.4
+            if parsed['date']: confidence += 0.3
+            # deadline không có giờ là sự kiện cả ngày
+            if parsed['exact_time'] or action == 'create_deadline': confidence += 0.2
+            elif parsed['time']: confidence += 0.1
+            if title: confidence += 0.1
+        elif action == 'list_events':
+            confidence = 0.9
+        elif action == 'delete_event':
+            confidence = 0.8
+        if action != 'none':
+            # biểu thức mâu thuẫn hoặc số kèm đơn vị thời gian chưa hiểu được -> để LLM quyết định
+            if parsed['conflicts']: confidence -= 0.3
+            if parsed['unparsed']: confidence -= 0.2
+            if parsed['ambiguous_day']: confidence -= 0.3
         
-        # Extract basic information
-        title = self._extract_title_from_message(user_message)
-        date = self._extract_date_from_message(user_message)
-        time = self._extract_time_from_message(user_message)
+        event_date = parsed['date'] or (now + timedelta(days=1)).date()
+        event_time = parsed['time'] or (9, 0)
         
         return {
             'action': action,
-            'title': title,
-            'date': date,
-            'time': time or '09:00',
+            'title': title or 'Sự kiện mới',
+            'date': event_date.strftime('%Y-%m-%d'),
+            'time': f"{event_time[0]:02d}:{event_time[1]:02d}",
             'description': user_message[:200],  # Use message as description
-            'duration': 60,
-            'reminder': 15,
-            'confidence': 0.6 if action != 'none' else 0.0
+            'duration': parsed['duration'] or 60,
+            'reminder': parsed['reminder'] if parsed['reminder'] is not None else 15,
+            'confidence': round(max(confidence, 0.0), 2),
+            'parser': 'rules'
         }
     
-    def _extract_title_from_message(self, message: str) -> str:
+    def _extract_title_from_message(self, message: str, now: Optional[datetime] = None) -> str:
         """Extract event title from message"""
-        # Remove common calendar keywords and get the main content
-        keywords_to_remove = [
-            'tạo lịch', 'đặt lịch', 'thêm lịch', 'lên lịch', 'nhắc nhở',
-            'create', 'schedule', 'add', 'meeting', 'event', 'deadline'
-        ]
-        
-        cleaned_message = message
-        for keyword in keywords_to_remove:
-            cleaned_message = re.sub(keyword, '', cleaned_message, flags=re.IGNORECASE)
-        
-        # Remove date/time patterns
-        date_patterns = [
-            r'\d{1,2}/\d{1,2}/\d{4}',
-            r'\d{1,2}-\d{1,2}-\d{4}',
-            r'\d{1,2}:\d{2}',
-            r'ngày mai', r'hôm nay', r'tuần sau'
-        ]
-        
-        for pattern in date_patterns:
-            cleaned_message = re.sub(pattern, '', cleaned_message, flags=re.IGNORECASE)
-        
-        # Clean and extract meaningful words
-        title = re.sub(r'[^\w\s]', ' ', cleaned_message).strip()
-        title = re.sub(r'\s+', ' ', title)
-        
-        if len(title) > 50:
-            title = title[:50] + '...'
-        
-        return title or 'Sự kiện mới'
+        now = now or calendar_now()
+        return extract_title(message, parse_datetime(message, now.date())) or 'Sự kiện mới'
     
-    def _extract_date_from_message(self, message: str) -> str:
-        """Extract date from message"""
-        try:
-            message_lower = message.lower()
-            today = datetime.now()
-            
-            # Check for relative dates
-            if any(word in message_lower for word in ['hôm nay', 'today']):
-                return today.strftime('%Y-%m-%d')
-            elif any(word in message_lower for word in ['ngày mai', 'tomorrow']):
-                return (today + timedelta(days=1)).strftime('%Y-%m-%d')
-            elif any(word in message_lower for word in ['ngày kia', 'day after tomorrow']):
-                return (today + timedelta(days=2)).strftime('%Y-%m-%d')
-            elif 'tuần sau' in message_lower or 'next week' in message_lower:
-                return (today + timedelta(days=7)).strftime('%Y-%m-%d')
-            
-            # Check for specific dates (DD/MM or DD-MM)
-            import re
-            date_pattern = r'(\d{1,2})[/-](\d{1,2})'
-            match = re.search(date_pattern, message)
-            if match:
-                day, month = match.groups()
-                year = today.year
-                try:
-                    date_obj = datetime(year, int(month), int(day))
-                    return date_obj.strftime('%Y-%m-%d')
-                except ValueError:
-                    pass
-            
-            # Check for day names (thứ hai, thứ ba,...)
-            day_mapping = {
-                'chủ nhật': 6, 'sunday': 6,
-                'thứ hai': 0, 'monday': 0,
-                'thứ ba': 1, 'tuesday': 1,
-                'thứ tư': 2, 'wednesday': 2,
-                'thứ năm': 3, 'thursday': 3,
-                'thứ sáu': 4, 'friday': 4,
-                'thứ bảy': 5, 'saturday': 5
-            }
-            
-            for day_name, weekday in day_mapping.items():
-                if day_name in message_lower:
-                    days_ahead = weekday - today.weekday()
-                    if days_ahead <= 0:
-                        days_ahead += 7
-                    target_date = today + timedelta(days=days_ahead)
-                    return target_date.strftime('%Y-%m-%d')
-            
-            # mặc định là ngày mai nếu không tìm thấy ngày cụ thể
-            return (today + timedelta(days=1)).strftime('%Y-%m-%d')
-            
-        except Exception:
-            return (datetime.now() + timedelta(days=1)).strftime('%Y-%m-%d')
+    def _extract_date_from_message(self, message: str, now: Optional[datetime] = None) -> str:
+        """Extract date from message (mặc định là ngày mai)"""
+        now = now or calendar_now()
+        parsed_date = parse_datetime(message, now.date())['date'] or (now + timedelta(days=1)).date()
+        return parsed_date.strftime('%Y-%m-%d')
 
     def _extract_time_from_message(self, message: str) -> str:
-        """Extract time from message"""
-        try:
-            import re
-            
-            # Pattern for time like 9h, 14h30, 9:30, etc.
-            time_patterns = [
-                r'(\d{1,2})h(\d{2})',  # 9h30
-                r'(\d{1,2})h',         # 9h
-                r'(\d{1,2}):(\d{2})',  # 9:30
-                r'(\d{1,2})\s*giờ\s*(\d{2})',  # 9 giờ 30
-                r'(\d{1,2})\s*giờ',    # 9 giờ
-            ]
-            
-            for pattern in time_patterns:
-                match = re.search(pattern, message)
-                if match:
-                    groups = match.groups()
-                    hour = int(groups[0])
-                    minute = int(groups[1]) if len(groups) > 1 and groups[1] else 0
-                    
-                    # Handle AM/PM
-                    if 'pm' in message.lower() or 'chiều' in message.lower() or 'tối' in message.lower():
-                        if hour < 12:
-                            hour += 12
-                    elif 'am' in message.lower() or 'sáng' in message.lower():
-                        if hour == 12:
-                            hour = 0
-                    
-                    return f"{hour:02d}:{minute:02d}"
-            
-            # Look for common time expressions
-            if 'sáng' in message.lower():
-                return "09:00"
-            elif 'trưa' in message.lower():
-                return "12:00"
-            elif 'chiều' in message.lower():
-                return "14:00"
-            elif 'tối' in message.lower():
-                return "19:00"
-            
-            # Default time
-            return "09:00"
-            
-        except Exception:
-            return "09:00"
+        """Extract time from message (mặc định 09:00)"""
+        hour, minute = parse_datetime(message, calendar_now().date())['time'] or (9, 0)
+        return f"{hour:02d}:{minute:02d}"
 
-    def _normalize_date(self, date_str: str, original_message: str) -> str:
+    def _normalize_date(self, date_str: str, original_message: str, now: Optional[datetime] = None) -> str:
         """Normalize date string to YYYY-MM-DD format"""
         if not date_str:
             return ''
@@ -345,7 +319,7 @@ Lưu ý:
                 continue
         
         # If parsing fails, try to extract from original message
-        return self._extract_date_from_message(original_message)
+        return self._extract_date_from_message(original_message, now)
     
     def _normalize_time(self, time_str: str) -> str:
         """Normalize time string to HH:MM format"""
@@ -374,3 +348,62 @@ Lưu ý:
                 return f"{hour:02d}:00"
         
         return '09:00'  # Default fallback
+
+
+CORPUS_PATH = os.path.join(os.path.dirname(__file__), '..', 'data', 'calendar_parse_corpus.json')
+
+
+def benchmark(use_llm: bool = False, path: str = CORPUS_PATH):
+    """Độ chính xác và latency của tầng rule (và LLM nếu use_llm) trên corpus có nhãn"""
+    import json
+    
+    with open(path, 'r', encoding='utf-8') as f:
+        corpus = json.load(f)
+    now = datetime.fromisoformat(corpus['now'])
+    cases = corpus['cases']
+    parser = CalendarAIParser()
+    threshold = Config.CALENDAR_SETTINGS['parser_llm_threshold']
+    
+    def correct(case, result, name):
+        # 'confident': false -> câu mơ hồ, tầng rule phải để LLM quyết định
+        if name == 'rules' and case.get('confident') is False and result.get('confidence', 0) >= threshold:
+            return False
+        return all(result.get(field) == case[field] for field in ('action', 'date', 'time') if field in case)
+    
+    tiers = [('rules', lambda message: parser._fallback_rule_based_parsing(message, now))]
+    if use_llm:
+        tiers.append(('llm', lambda message: parser._parse_with_llm(message, now) or {}))
+    
+    for name, parse in tiers:
+        right, confident, confident_right, elapsed = 0, 0, 0, 0.0
+        failures = []
+        for case in cases:
+            start = time.perf_counter()
+            result = parse(case['message'])
+            elapsed += time.perf_counter() - start
+            ok = correct(case, result, name)
+            right += ok
+            if name == 'rules' and result.get('confidence', 0) >= threshold:
+                confident += 1
+                confident_right += ok
+                if not ok:
+                    failures.append((case, result))
+            elif name == 'llm' and not ok:
+                failures.append((case, result))
+        
+        print(f"[INFO] {name}: {right}/{len(cases)} correct, {elapsed / len(cases) * 1000:.2f} ms/message")
+        if name == 'rules':
+            print(f"[INFO] rules confident (>= {threshold}): {confident}/{len(cases)} "
+                  f"({confident / len(cases):.0%} không cần LLM), đúng {confident_right}/{confident}")
+        for case, result in failures:
+            print(f"  {case['message']!r}: expected {[case.get(k) for k in ('action', 'date', 'time')]}, "
+                  f"got {[result.get(k) for k in ('action', 'date', 'time')]} ({result.get('confidence')})")
+
+
+if __name__ == "__main__":
+    import argparse
+    
+    arg_parser = argparse.ArgumentParser(description="Benchmark calendar parser trên data/calendar_parse_corpus.json")
+    arg_parser.add_argument('--llm', action='store_true', help="chạy cả tầng LLM (gọi OpenAI API cho mọi câu)")
+    args = arg_parser.parse_args()
+    benchmark(args.llm)
@@ -0,0 +1,379 @@
+"""
+Grammar ngày giờ tiếng Việt cho calendar parser (tầng rule, chạy trước LLM)
+
+Hiểu được:
+- ngày: hôm nay / (ngày) mai / ngày kia, thứ 2..7 / t2..t7 / thứ năm / chủ nhật (kèm "tuần sau", "này"),
+  dd/mm(/yyyy), "ngày 15 (tháng 12)", cuối tuần, đầu/giữa/cuối tháng (sau), "3 ngày nữa", tuần sau
+- giờ: 9h, 9h30, 9:30, 9 giờ rưỡi, 9 giờ kém 15, 9am/9pm, "lúc 9", kèm buổi sáng/trưa/chiều/tối/đêm
+- thời lượng: "từ 9h đến 11h", "trong 2 tiếng", "90 phút"; nhắc: "nhắc trước 30 phút"
+
+Pattern được viết có dấu. Câu có dấu phải khớp đúng dấu (không nhầm "tối"/"tôi", "sáng"/"dời sang"), câu gõ
+không dấu được khớp với bản bỏ dấu của pattern (xem _Pattern).
+"""
+import re
+import unicodedata
+from datetime import date, timedelta
+from typing import Dict, List, Optional, Tuple
+
+
+def _base_char(ch: str) -> str:
+    base = ''.join(c for c in unicodedata.normalize('NFD', ch) if unicodedata.category(c) != 'Mn')
+    return 'd' if ch == 'đ' else base
+
+
+def _fold(text: str) -> str:
+    return ''.join(_base_char(ch) for ch in text)
+
+
+class _Pattern:
+    """
+    Pattern viết có dấu, compile hai bản: strict cho câu có dấu, loose (dấu tuỳ chọn) cho câu gõ không dấu.
+    Câu có dấu phải khớp đúng dấu, nếu không "sang" (dời sang) sẽ khớp "sáng", "tôi" khớp "tối".
+    """
+
+    def __init__(self, pattern: str):
+        self.strict = re.compile(pattern)
+        loose = []
+        for ch in pattern:
+            base = _base_char(ch)
+            loose.append(f"[{ch}{base}]" if base != ch and len(base) == 1 else ch)
+        self.loose = re.compile(''.join(loose))
+
+
+WEEKDAY_NUMBERS = {'2': 0, '3': 1, '4': 2, '5': 3, '6': 4, '7': 5}
+WEEKDAY_WORDS = {'hai': 0, 'ba': 1, 'tư': 2, 'năm': 3, 'sáu': 4, 'bảy': 5, 'bẩy': 5}
+ENGLISH_WEEKDAYS = {
+    'monday': 0, 'tuesday': 1, 'wednesday': 2, 'thursday': 3, 'friday': 4, 'saturday': 5, 'sunday': 6
+}
+PERIODS = {'sáng': 'morning', 'trưa': 'noon', 'chiều': 'afternoon', 'tối': 'evening', 'đêm': 'night'}
+# giờ mặc định khi chỉ có buổi mà không có giờ cụ thể
+PERIOD_DEFAULT_TIMES = {'morning': (9, 0), 'noon': (12, 0), 'afternoon': (14, 0), 'evening': (19, 0), 'night': (21, 0)}
+
+_PERIOD = r'(?:buổi\s+)?(sáng|trưa|chiều|tối|đêm)'
+# group: giờ, rưỡi, kém (phút), phút
+_TIME = (
+    r'(?:(?:lúc|vào|từ)\s+)?(?<!trong\s)(\d{1,2})\s*(?:(?:giờ|h)\s*(rưỡi)|(?:giờ|h)\s*kém\s*(\d{1,2})(?:\s*phút)?'
+    r'|(?:giờ|h|g|:)(?![^\W\d])\s*(\d{2})?(?:\s*phút)?)(?![\d/])'
+)
+
+_REMINDER = _Pattern(r'\bnhắc(?:\s+nhở)?(?:\s+(?:tôi|mình|em))?\s+trước\s+(\d+)\s*(phút|tiếng|giờ|ngày|p\b|h\b)')
+_DURATION_EXPLICIT = _Pattern(r'\b(?:trong|kéo dài)\s+(\d+(?:[.,]5)?)\s*(tiếng|giờ|phút)\b')
+_TIME_RANGE = _Pattern(r'\b' + _TIME + r'\s*(?:-|–|~|đến|tới)\s*' + _TIME + r'(?:\s+' + _PERIOD + r')?')
+_AMPM = _Pattern(r'(?:(?:lúc|vào)\s+)?\b(\d{1,2})(?::(\d{2}))?\s*(am|pm)\b')
+_TIME_WITH_PERIOD = _Pattern(r'\b' + _TIME + r'(?:\s+' + _PERIOD + r')?')
+_AT_HOUR = _Pattern(r'\blúc\s+(\d{1,2})\b(?!\s*[/\-]\d)(?:\s+' + _PERIOD + r')?')
+_DURATION = _Pattern(r'\b(\d+(?:[.,]5)?)\s*(tiếng|phút)\b')
+_PERIOD_BEFORE_DATE = _Pattern(_PERIOD + r'(?=\s+(?:nay|mai|thứ|t[2-7]\b|chủ nhật|cn\b|ngày))')
+_PERIOD_ALONE = _Pattern(r'\bbuổi\s+(sáng|trưa|chiều|tối|đêm)\b')
+
+_ABSOLUTE_DATE = _Pattern(r'(?:\bngày\s+)?\b(\d{1,2})[/\-](\d{1,2})(?:[/\-](\d{2,4}))?\b')
+_DAY_MONTH_WORDS = _Pattern(r'\bngày\s+(\d{1,2})(?:\s+tháng\s+(\d{1,2})(?:\s+năm\s+(\d{4}))?)?\b|\b(\d{1,2})\s+tháng\s+(\d{1,2})\b')
+_MONTH_EDGE = _Pattern(r'\b(đầu|giữa|cuối)\s+tháng(?:\s+(sau|tới|này|(\d{1,2})))?\b')
+_WEEKEND = _Pattern(r'\bcuối\s+tuần(?:\s+(sau|tới|này))?\b')
+_WEEKDAY = _Pattern(
+    r'\b(?:thứ\s*([2-7])|t([2-7])|thứ\s+(hai|ba|tư|năm|sáu|bảy|bẩy)|(chủ\s*nhật|cn)'
+    r'|(monday|tuesday|wednesday|thursday|friday|saturday|sunday))\b'
+    r'(?:\s+(tuần\s+(?:sau|tới)|tuần\s+này|này|next week))?'
+)
+_IN_DAYS = _Pattern(r'\b(?:sau\s+)?(\d+)\s+(ngày|tuần)\s+(?:nữa|tới)\b|\bsau\s+(\d+)\s+(ngày|tuần)\b|\bin\s+(\d+)\s+(days?|weeks?)\b')
+_DAY_AFTER_TOMORROW = _Pattern(r'\bngày\s+(?:kia|mốt)\b|\bday after tomorrow\b')
+_TOMORROW = _Pattern(r'\b(?:ngày\s+)?mai\b|\btomorrow\b')
+_TODAY = _Pattern(r'\b(?:hôm\s+)?nay\b|\btoday\b|\btonight\b')
+_NEXT_WEEK = _Pattern(r'\btuần\s+(?:sau|tới)\b|\bnext week\b')
+# số kèm đơn vị ngày giờ còn sót lại sau khi quét: có biểu thức grammar chưa hiểu
+_UNPARSED = _Pattern(r'\d\s*(?:h|g|giờ|phút|tiếng|:|/|-|tháng|ngày|am|pm|kém|rưỡi)(?![^\W\d])')
+
+
+def _period_of(word: Optional[str]) -> Optional[str]:
+    if not word:
+        return None
+    for vietnamese, period in PERIODS.items():
+        if word == vietnamese or word == _fold(vietnamese):
+            return period
+    return None
+
+
+def _apply_period(hour: int, period: Optional[str]) -> int:
+    """Đổi giờ 12h sang 24h theo buổi (2h chiều -> 14, 11h đêm -> 23, 12h sáng / 12h đêm -> 0)"""
+    if period in ('afternoon', 'evening') and hour < 12:
+        return hour + 12
+    if period == 'night' and 6 <= hour < 12:
+        return hour + 12
+    if period in ('morning', 'evening', 'night') and hour == 12:
+        return 0
+    return hour
+
+
+def _after_midnight(hour: int, period: Optional[str]) -> bool:
+    """Giờ thuộc đêm của ngày được nói tới nhưng rơi vào ngày hôm sau (12h đêm nay, 1h đêm thứ 6)"""
+    return (period == 'night' and (hour == 12 or hour < 5)) or (period == 'evening' and hour == 12)
+
+
+def _end_of_month(year: int, month: int) -> date:
+    first_next = date(year + month // 12, month % 12 + 1, 1)
+    return first_next - timedelta(days=1)
+
+
+def _add_months(day: date, months: int) -> date:
+    month = day.month - 1 + months
+    return date(day.year + month // 12, month % 12 + 1, 1)
+
+
+class _Scan:
+    """Text đang quét + các span đã dùng (một đoạn text chỉ thuộc về một biểu thức)"""
+
+    def __init__(self, text: str):
+        self.text = text
+        # câu gõ không dấu -> dùng pattern loose
+        self.loose = _fold(text) == text
+        self.spans: List[Tuple[int, int]] = []
+
+    def finditer(self, pattern: _Pattern):
+        for match in (pattern.loose if self.loose else pattern.strict).finditer(self.text):
+            start, end = match.span()
+            if any(start < e and s < end for s, e in self.spans):
+                continue
+            self.spans.append((start, end))
+            yield match
+
+    def leftover(self) -> str:
+        """Text còn lại sau khi bỏ các span đã dùng"""
+        chars = list(self.text)
+        for start, end in self.spans:
+            chars[start:end] = [' '] * (end - start)
+        return ''.join(chars)
+
+
+def _time_from_match(groups) -> Optional[Tuple[int, int]]:
+    """(giờ, phút) từ các group của _TIME"""
+    hour, half, minus, minute = groups
+    hour = int(hour)
+    minute = 30 if half else int(minute) if minute else 0
+    if minus:
+        hour, minute = hour - 1, 60 - int(minus)
+    if not (0 <= hour <= 23 and 0 <= minute <= 59):
+        return None
+    return hour, minute
+
+
+def _duration_minutes(amount: str, unit: str) -> int:
+    amount = float(amount.replace(',', '.'))
+    return int(amount if _base_char(unit[0]) == 'p' else amount * 60)
+
+
+def parse_datetime(message: str, today: date) -> Dict:
+    """
+    Trích ngày, giờ, thời lượng, nhắc nhở từ tin nhắn
+    Returns: {'date': date|None, 'time': (h, m)|None, 'exact_time': bool, 'period': str|None,
+              'duration': int|None, 'reminder': int|None, 'conflicts': bool, 'unparsed': bool,
+              'ambiguous_day': bool (giờ sau nửa đêm của một ngày khác hôm nay, vd. "12h đêm thứ 6"),
+              'spans': [(start, end)] của các biểu thức đã hiểu, 'leftover': phần text còn lại}
+    """
+    scan = _Scan(unicodedata.normalize('NFC', message).lower())
+    result = {'date': None, 'time': None, 'period': None, 'duration': None, 'reminder': None, 'conflicts': False,
+              'ambiguous_day': False}
+
+    for match in scan.finditer(_REMINDER):
+        amount, unit = int(match.group(1)), match.group(2)
+        unit = _base_char(unit[0])
+        result['reminder'] = amount * (1440 if unit == 'n' else 60 if unit in ('t', 'g', 'h') else 1)
+
+    for match in scan.finditer(_DURATION_EXPLICIT):
+        result['duration'] = _duration_minutes(match.group(1), match.group(2))
+
+    # ---- giờ ----
+    times: List[Tuple[int, int]] = []
+    for match in scan.finditer(_TIME_RANGE):
+        start, end = _time_from_match(match.groups()[:4]), _time_from_match(match.groups()[4:8])
+        if start and end:
+            times.append(start)
+            minutes = (end[0] * 60 + end[1]) - (start[0] * 60 + start[1])
+            if minutes <= 0 and start[0] < 12:
+                # "từ 10h đến 2h" -> 2h chiều
+                minutes += 12 * 60
+            result['duration'] = minutes if minutes > 0 else None
+            result['period'] = _period_of(match.group(9))
+    for match in scan.finditer(_AMPM):
+        hour, minute = int(match.group(1)), int(match.group(2) or 0)
+        if 1 <= hour <= 12:
+            times.append(((hour % 12) + (12 if match.group(3) == 'pm' else 0), minute))
+    for match in scan.finditer(_TIME_WITH_PERIOD):
+        parsed = _time_from_match(match.groups()[:4])
+        if parsed:
+            times.append(parsed)
+            result['period'] = result['period'] or _period_of(match.group(5))
+    for match in scan.finditer(_AT_HOUR):
+        hour = int(match.group(1))
+        if hour <= 23:
+            times.append((hour, 0))
+            result['period'] = result['period'] or _period_of(match.group(2))
+    for pattern in (_PERIOD_BEFORE_DATE, _PERIOD_ALONE):
+        for match in scan.finditer(pattern):
+            result['period'] = result['period'] or _period_of(match.group(1))
+
+    result['exact_time'] = bool(times)
+    next_day = False
+    if times:
+        hour, minute = times[0]
+        next_day = _after_midnight(hour, result['period'])
+        result['time'] = (_apply_period(hour, result['period']), minute)
+        result['conflicts'] |= len(set(times)) > 1 and result['duration'] is None
+    elif result['period']:
+        result['time'] = PERIOD_DEFAULT_TIMES[result['period']]
+
+    if result['duration'] is None:
+        for match in scan.finditer(_DURATION):
+            result['duration'] = _duration_minutes(match.group(1), match.group(2))
+
+    # ---- ngày: biểu thức cụ thể hơn được ưu tiên ----
+    candidates: List[Tuple[int, date]] = []
+
+    def add(priority: int, year: int, month: int, day: int, roll: str = None):
+        try:
+            value = date(year, month, day)
+        except ValueError:
+            result['conflicts'] = True
+            return
+        if value < today and roll == 'year':
+            value = value.replace(year=value.year + 1)
+        elif value < today and roll == 'month':
+            next_month = _add_months(value, 1)
+            try:
+                value = next_month.replace(day=day)
+            except ValueError:
+                result['conflicts'] = True
+                return
+        candidates.append((priority, value))
+
+    for match in scan.finditer(_ABSOLUTE_DATE):
+        day, month, year = match.groups()
+        if year:
+            year = int(year) + (2000 if len(year) == 2 else 0)
+            add(4, year, int(month), int(day))
+        else:
+            add(4, today.year, int(month), int(day), roll='year')
+    for match in scan.finditer(_DAY_MONTH_WORDS):
+        day, month, year, day2, month2 = match.groups()
+        if day2:
+            add(4, today.year, int(month2), int(day2), roll='year')
+        elif month:
+            add(4, int(year) if year else today.year, int(month), int(day), roll=None if year else 'year')
+        else:
+            add(3, today.year, today.month, int(day), roll='month')
+    for match in scan.finditer(_MONTH_EDGE):
+        edge, modifier, month_number = match.group(1), match.group(2), match.group(3)
+        if month_number:
+            first = date(today.year, int(month_number), 1) if 1 <= int(month_number) <= 12 else None
+            if first is None:
+                result['conflicts'] = True
+                continue
+            if _end_of_month(first.year, first.month) < today:
+                first = first.replace(year=first.year + 1)
+        else:
+            first = _add_months(today, 1 if modifier and _base_char(modifier[0]) in ('s', 't') else 0)
+        edge = _base_char(edge[0])
+        value = (first if edge == 'd' else first.replace(day=15) if edge == 'g'
+                 else _end_of_month(first.year, first.month))
+        if value < today and not modifier:
+            # "đầu/giữa tháng" khi đã qua -> của tháng sau
+            value = _add_months(today, 1).replace(day=value.day)
+        candidates.append((3, value))
+    for match in scan.finditer(_WEEKEND):
+        days_ahead = (5 - today.weekday()) % 7
+        if match.group(1) and _base_char(match.group(1)[0]) in ('s', 't'):
+            days_ahead = 5 - today.weekday() + 7
+        candidates.append((2, today + timedelta(days=days_ahead)))
+    for match in scan.finditer(_WEEKDAY):
+        number, short, word, sunday, english, modifier = match.groups()
+        if number or short:
+            weekday = WEEKDAY_NUMBERS[number or short]
+        elif word:
+            weekday = next(v for k, v in WEEKDAY_WORDS.items()
+                           if word == k or word == _fold(k))
+        elif sunday:
+            weekday = 6
+        else:
+            weekday = ENGLISH_WEEKDAYS[english]
+        if modifier and (modifier == 'next week' or _base_char(modifier.split()[-1][0]) in ('s', 't')):
+            monday = today - timedelta(days=today.weekday()) + timedelta(days=7)
+            value = monday + timedelta(days=weekday)
+        elif modifier:
+            # "thứ 5 này" -> trong tuần hiện tại (hoặc hôm nay)
+            value = today + timedelta(days=(weekday - today.weekday()) % 7)
+        else:
+            days_ahead = weekday - today.weekday()
+            value = today + timedelta(days=days_ahead if days_ahead > 0 else days_ahead + 7)
+        candidates.append((2, value))
+    for match in scan.finditer(_IN_DAYS):
+        amount = next(g for g in (match.group(1), match.group(3), match.group(5)) if g)
+        unit = next(g for g in (match.group(2), match.group(4), match.group(6)) if g)
+        weeks = _base_char(unit[0]) in ('t', 'w')
+        candidates.append((2, today + timedelta(days=int(amount) * (7 if weeks else 1))))
+    for match in scan.finditer(_DAY_AFTER_TOMORROW):
+        candidates.append((1, today + timedelta(days=2)))
+    for match in scan.finditer(_TOMORROW):
+        candidates.append((1, today + timedelta(days=1)))
+    for match in scan.finditer(_TODAY):
+        candidates.append((1, today))
+    for match in scan.finditer(_NEXT_WEEK):
+        candidates.append((0, today + timedelta(days=7)))
+
+    if candidates:
+        best = max(priority for priority, _ in candidates)
+        values = {value for priority, value in candidates if priority == best}
+        result['date'] = min(values)
+        result['conflicts'] |= len(values) > 1
+
+    if next_day:
+        # "12h đêm nay" là 00:00 ngày mai; với ngày khác hôm nay ("12h đêm thứ 6") người dùng có thể
+        # muốn nói đầu ngày đó -> vẫn lấy đêm của ngày đó nhưng đánh dấu để parser hỏi LLM
+        result['ambiguous_day'] = result['date'] is not None and result['date'] != today
+        result['date'] = (result['date'] or today) + timedelta(days=1)
+
+    result['spans'] = sorted(scan.spans)
+    result['leftover'] = scan.leftover()
+    result['unparsed'] = (_UNPARSED.loose if scan.loose else _UNPARSED.strict).search(result['leftover']) is not None
+    return result
+
+
+# Cụm từ ở đầu/cuối phần còn lại không thuộc về tên sự kiện
+_TITLE_PREFIX = _Pattern(
+    r'^(?:(?:tôi|mình|em|t|m)\s+)?(?:(?:muốn|cần|định|sẽ|phải)\s+)?(?:(?:hãy|làm ơn|giúp|cho)\s+(?:(?:tôi|mình|em)\s+)?)?'
+    r'(?:(?:tạo|đặt|thêm|lên|ghi|xem|hiện|xóa|hủy|dời|đổi|nhắc(?:\s+nhở)?|create|add|schedule|set)'
+    r'(?:\s+(?:tôi|mình|em))?(?:\s+(?:một|1|a|an))?'
+    r'(?:\s+(?:lịch|sự kiện|deadline|hạn nộp|lời nhắc|event))?|lịch|deadline)\b'
+)
+_TITLE_EDGE_WORDS = _Pattern(
+    r'^(?:là|về|cho|:|-)\s+|\s+(?:lúc|vào|ngày|từ|đến|trong|nhé|nha|nhá|với|buổi|cho tôi|giúp tôi|đi|at|on)$'
+)
+
+
+def extract_title(message: str, parsed: Dict, max_length: int = 50) -> str:
+    """Tên sự kiện: phần tin nhắn còn lại sau khi bỏ ngày giờ, động từ lệnh và hư từ ở hai đầu"""
+    original = unicodedata.normalize('NFC', message)
+    text = parsed['leftover']
+    if len(original) == len(text):
+        # giữ chữ hoa/thường của tin nhắn gốc
+        chars = list(original)
+        for start, end in parsed['spans']:
+            chars[start:end] = [' '] * (end - start)
+        text = ''.join(chars)
+
+    title = ' '.join(re.sub(r'[^\w\s/-]', ' ', text).split())
+    loose = _fold(title.lower()) == title.lower()
+    while True:
+        # khớp trên chữ thường, cắt trên title gốc (lower() không đổi độ dài với tiếng Việt)
+        lowered = title.lower()
+        match = None
+        for pattern in (_TITLE_PREFIX, _TITLE_EDGE_WORDS):
+            match = (pattern.loose if loose else pattern.strict).search(lowered)
+            if match and match.end() > match.start():
+                break
+            match = None
+        if match is None or len(lowered) != len(title):
+            break
+        title = (title[:match.start()] + ' ' + title[match.end():]).strip()
+
+    if len(title) > max_length:
+        title = title[:max_length] + '...'
+    return title[:1].upper() + title[1:]
@@ -222,7 +222,7 @@ class CalendarIntegration:
             else:
                 return {
                     'success': False,
-                    'message': f"Không thể tạo deadline: {result['error']}",
+                    'message': f"Không thể tạo deadline: {result.get('message', 'Unknown error')}",
                     'data': None,
                     'action': 'create_deadline_failed'
                 }
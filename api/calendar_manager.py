@@ -1,18 +1,202 @@
+import json
 import os
 import pickle
+import threading
+import time
+from collections import OrderedDict
+import google_auth_httplib2
+import httplib2
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
+from googleapiclient.discovery import DISCOVERY_URI, build_from_document
+from googleapiclient.http import HttpRequest
 from datetime import datetime, timedelta
-from typing import Dict
+from typing import Dict, List, Optional, Tuple
+from zoneinfo import ZoneInfo
 import logging
+from calendar_sync import get_calendar_mirror
 from config import Config
 
+_discovery_document = None
+_discovery_lock = threading.Lock()
+
+
+def get_discovery_document() -> Dict:
+    """Discovery document của Calendar API v3, đọc và parse một lần cho cả process"""
+    global _discovery_document
+    if _discovery_document is None:
+        with _discovery_lock:
+            if _discovery_document is None:
+                try:
+                    from googleapiclient.discovery_cache import get_static_doc
+                    content = get_static_doc('calendar', 'v3')
+                except ImportError:
+                    content = None
+                if content is None:
+                    _, content = httplib2.Http().request(DISCOVERY_URI.format(api='calendar', apiVersion='v3'))
+                _discovery_document = json.loads(content)
+    return _discovery_document
+
+
+_thread_http = threading.local()
+
+
+def _build_request(credentials):
+    """
+    requestBuilder cho service dùng chung giữa các thread: httplib2.Http không thread-safe,
+    nên mỗi thread có một Http riêng (giữ connection keep-alive) bọc credentials của user
+    """
+    def build_request(http, *args, **kwargs):
+        if not hasattr(_thread_http, 'http'):
+            _thread_http.http = httplib2.Http()
+        return HttpRequest(google_auth_httplib2.AuthorizedHttp(credentials, http=_thread_http.http), *args, **kwargs)
+    return build_request
+
+
+class CalendarServiceCache:
+    """
+    Cache service Calendar API theo user: token file chỉ được unpickle một lần, service chỉ build một lần.
+    Access token được refresh (và lưu lại) trước khi hết hạn; khi đầy, entry có token đã hết hạn bị bỏ trước, sau đó đến LRU
+    """
+
+    def __init__(self, max_entries: int = 256, refresh_margin: int = 300):
+        self.max_entries = max_entries
+        self.refresh_margin = timedelta(seconds=refresh_margin)
+        self._lock = threading.Lock()
+        self._user_locks: Dict[str, threading.Lock] = {}
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()  # user_id -> (credentials, service)
+        self.stats = {'hits': 0, 'builds': 0, 'refreshes': 0, 'evictions': 0}
+
+    def _user_lock(self, user_id: str) -> threading.Lock:
+        with self._lock:
+            return self._user_locks.setdefault(user_id, threading.Lock())
+
+    def _needs_refresh(self, creds) -> bool:
+        if not creds.valid:
+            return True
+        # google-auth lưu expiry dạng UTC naive
+        return creds.expiry is not None and creds.expiry - datetime.utcnow() < self.refresh_margin
+
+    def get_credentials(self, user_id: str):
+        """Credentials đang cache của user (không đọc file), None nếu chưa có"""
+        with self._lock:
+            entry = self._entries.get(user_id)
+        return entry[0] if entry else None
+
+    def get_service(self, user_id: str, token_file: str, logger: logging.Logger):
+        """Service đã xác thực của user, None nếu cần authorize lại"""
+        with self._user_lock(user_id):
+            with self._lock:
+                entry = self._entries.get(user_id)
+                if entry is not None:
+                    self._entries.move_to_end(user_id)
+            
+            if entry is not None:
+                creds, service = entry
+            else:
+                if not os.path.exists(token_file):
+                    return None
+                with open(token_file, 'rb') as token:
+                    creds = pickle.load(token)
+                service = None
+            
+            if not creds:
+                return None
+            if self._needs_refresh(creds):
+                if not creds.refresh_token:
+                    self.invalidate(user_id)
+                    return None
+                try:
+                    creds.refresh(Request())
+                    # Save refreshed token
+                    with open(token_file, 'wb') as token:
+                        pickle.dump(creds, token)
+                    self.stats['refreshes'] += 1
+                    logger.info(f"Refreshed token for user {user_id}")
+                except Exception as e:
+                    logger.error(f"Error refreshing token: {e}")
+                    self.invalidate(user_id)
+                    return None
+            
+            if service is None:
+                service = build_from_document(get_discovery_document(), credentials=creds,
+                                              requestBuilder=_build_request(creds))
+                self.stats['builds'] += 1
+            else:
+                self.stats['hits'] += 1
+            self.put(user_id, creds, service)
+            return service
+
+    def put(self, user_id: str, creds, service=None):
+        with self._lock:
+            self._entries[user_id] = (creds, service)
+            self._entries.move_to_end(user_id)
+            if len(self._entries) <= self.max_entries:
+                return
+            expired = [uid for uid, (c, _) in self._entries.items() if uid != user_id and not c.valid]
+            victims = expired or [next(iter(self._entries))]
+            for uid in victims[:len(self._entries) - self.max_entries]:
+                del self._entries[uid]
+                self.stats['evictions'] += 1
+
+    def invalidate(self, user_id: str):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+
+class FreeBusyCache:
+    """Free/busy view theo user: các khoảng bận của một cửa sổ thời gian, hết hạn sau ttl giây"""
+
+    def __init__(self, ttl: int = 60):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._views: Dict[str, tuple] = {}  # user_id -> (fetched_at, window_start, window_end, busy)
+
+    def get(self, user_id: str, start_time: datetime, end_time: datetime) -> Optional[List[Tuple]]:
+        """Các khoảng bận nếu view còn hạn và phủ [start_time, end_time), None nếu cần query"""
+        with self._lock:
+            view = self._views.get(user_id)
+            if view is None:
+                return None
+            fetched_at, window_start, window_end, busy = view
+            if time.monotonic() - fetched_at > self.ttl or start_time < window_start or end_time > window_end:
+                return None
+            return list(busy)
+
+    def put(self, user_id: str, window_start: datetime, window_end: datetime, busy: List[Tuple]):
+        with self._lock:
+            self._views[user_id] = (time.monotonic(), window_start, window_end, list(busy))
+
+    def add(self, user_id: str, start_time: datetime, end_time: datetime):
+        """Sự kiện vừa tạo: thêm vào view hiện tại để lần kiểm tra sau không cần query lại"""
+        with self._lock:
+            view = self._views.get(user_id)
+            if view is not None:
+                view[3].append((start_time, end_time))
+
+    def invalidate(self, user_id: str):
+        with self._lock:
+            self._views.pop(user_id, None)
+
+
+_service_cache = CalendarServiceCache(
+    Config.CALENDAR_SETTINGS['service_cache_size'],
+    Config.CALENDAR_SETTINGS['token_refresh_margin']
+)
+_busy_cache = FreeBusyCache(Config.CALENDAR_SETTINGS['freebusy_ttl'])
+
+
 class GoogleCalendarManager:
+    # số request tối đa trong một batch HTTP request của Calendar API
+    BATCH_SIZE = 50
+    
     def __init__(self):
         self.service = None
+        self.service_cache = _service_cache
+        self.busy_cache = _busy_cache
         self.config = Config()
+        self.timezone = ZoneInfo(self.config.GOOGLE_CALENDAR_CONFIG['timezone'])
         self.credentials_file = self.config.CALENDAR_SETTINGS['credentials_file']
         self.tokens_dir = self.config.CALENDAR_SETTINGS['tokens_dir']
         self.scopes = self.config.GOOGLE_CALENDAR_CONFIG['scopes']
@@ -27,12 +211,15 @@ class GoogleCalendarManager:
     
     def check_auth_status(self, user_id: str) -> Dict:
         """Kiểm tra trạng thái authentication của user"""
-        token_file = os.path.join(self.tokens_dir, f'token_{user_id}.pickle')
+        token_file = self._token_file(user_id)
+        cached_creds = self.service_cache.get_credentials(user_id)
         
-        if os.path.exists(token_file):
+        if cached_creds is not None or os.path.exists(token_file):
             try:
-                with open(token_file, 'rb') as token:
-                    creds = pickle.load(token)
+                creds = cached_creds
+                if creds is None:
+                    with open(token_file, 'rb') as token:
+                        creds = pickle.load(token)
                     
                 if creds and creds.valid:
                     return {
@@ -117,10 +304,12 @@ class GoogleCalendarManager:
             creds = flow.credentials
             
             # Lưu token cho user cụ thể
-            token_file = os.path.join(self.tokens_dir, f'token_{user_id}.pickle')
+            token_file = self._token_file(user_id)
             
             with open(token_file, 'wb') as token:
                 pickle.dump(creds, token)
+            # service cũ (nếu có) dùng token đã bị thay thế
+            self.service_cache.put(user_id, creds)
             
             self.logger.info(f"Successfully saved credentials for user {user_id}")
             
@@ -136,153 +325,254 @@ class GoogleCalendarManager:
                 'message': f'Lỗi xử lý callback: {str(e)}'
             }
     
-    def authenticate_user(self, user_id: str) -> bool:
-        """Authenticate specific user và setup service"""
-        token_file = os.path.join(self.tokens_dir, f'token_{user_id}.pickle')
-        creds = None
-        
-        if os.path.exists(token_file):
-            with open(token_file, 'rb') as token:
-                creds = pickle.load(token)
-        
-        if not creds or not creds.valid:
-            if creds and creds.expired and creds.refresh_token:
-                try:
-                    creds.refresh(Request())
-                    # Save refreshed token
-                    with open(token_file, 'wb') as token:
-                        pickle.dump(creds, token)
-                    self.logger.info(f"Refreshed token for user {user_id}")
-                except Exception as e:
-                    self.logger.error(f"Error refreshing token: {e}")
-                    return False
-            else:
-                return False  # Need new authorization
-        
+    @property
+    def mirror(self):
+        """Bản sao lịch cục bộ (calendar_sync), None nếu bị tắt"""
+        return get_calendar_mirror()
+    
+    def _token_file(self, user_id: str) -> str:
+        return os.path.join(self.tokens_dir, f'token_{user_id}.pickle')
+    
+    def get_service(self, user_id: str):
+        """Service Calendar API của user (dùng lại giữa các request), None nếu cần xác thực"""
         try:
-            self.service = build('calendar', 'v3', credentials=creds)
-            return True
+            return self.service_cache.get_service(user_id, self._token_file(user_id), self.logger)
         except Exception as e:
             self.logger.error(f"Error building calendar service: {e}")
-            return False
+            return None
+    
+    def authenticate_user(self, user_id: str) -> bool:
+        """Authenticate specific user và setup service"""
+        self.service = self.get_service(user_id)
+        return self.service is not None
+    
+    def _aware(self, value: datetime) -> datetime:
+        """Giờ naive được hiểu theo CALENDAR_TIMEZONE"""
+        return value if value.tzinfo else value.replace(tzinfo=self.timezone)
+    
+    def _busy_intervals(self, service, user_id: str, start_time: datetime, end_time: datetime) -> List[Tuple]:
+        """
+        Các khoảng bận của lịch primary giao với [start_time, end_time): trả lời từ bản sao lịch cục bộ,
+        hoặc free/busy view đã cache nếu còn hạn và phủ khoảng này, nếu không thì một lượt freebusy.query
+        cho các ngày liên quan
+        """
+        busy = self.mirror.busy_intervals(user_id, start_time, end_time) if self.mirror else None
+        if busy is not None:
+            return busy
+        busy = self.busy_cache.get(user_id, start_time, end_time)
+        if busy is None:
+            # lấy trọn các ngày để các lần kiểm tra tiếp theo trong ngày trả lời từ cache
+            window_start = start_time.replace(hour=0, minute=0, second=0, microsecond=0)
+            window_end = end_time.replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
+            response = service.freebusy().query(body={
+                'timeMin': window_start.isoformat(),
+                'timeMax': window_end.isoformat(),
+                'timeZone': self.timezone.key,
+                'items': [{'id': 'primary'}]
+            }).execute()
+            busy = [
+                (datetime.fromisoformat(period['start']), datetime.fromisoformat(period['end']))
+                for period in response.get('calendars', {}).get('primary', {}).get('busy', [])
+            ]
+            self.busy_cache.put(user_id, window_start, window_end, busy)
+        return [(start, end) for start, end in busy if start < end_time and end > start_time]
     
     def is_time_conflict(self, user_id: str, start_time: datetime, end_time: datetime) -> bool:
         """Kiểm tra có sự kiện nào trùng thời gian không (phát hiện mọi trường hợp overlap)"""
-        if not self.authenticate_user(user_id):
+        service = self.get_service(user_id)
+        if service is None:
             return False
-        events_result = self.service.events().list(
-            calendarId='primary',
-            timeMin=(start_time - timedelta(days=1)).isoformat() + 'Z',  # buffer to ensure all-day events are included
-            timeMax=(end_time + timedelta(days=1)).isoformat() + 'Z',
-            singleEvents=True,
-            orderBy='startTime',
-            maxResults=100
-        ).execute()
-        events = events_result.get('items', [])
-        for event in events:
-            # Skip cancelled events
-            if event.get('status') == 'cancelled':
-                continue
-            # Parse event start/end
-            ev_start = event['start'].get('dateTime') or event['start'].get('date')
-            ev_end = event['end'].get('dateTime') or event['end'].get('date')
-            # Convert to datetime
-            try:
-                if 'T' in ev_start:
-                    ev_start_dt = datetime.fromisoformat(ev_start.replace('Z', '+00:00'))
-                else:
-                    ev_start_dt = datetime.fromisoformat(ev_start)
-                if 'T' in ev_end:
-                    ev_end_dt = datetime.fromisoformat(ev_end.replace('Z', '+00:00'))
-                else:
-                    ev_end_dt = datetime.fromisoformat(ev_end)
-            except Exception:
-                continue
-            # Check overlap: (A < D) and (B > C)
-            if ev_start_dt < end_time and ev_end_dt > start_time:
-                return True
-        return False
-
-    def create_event(self, user_id: str, title: str, start_time: datetime, end_time: datetime, 
-                    description: str = "", location: str = "") -> Dict:
-        """Create a calendar event (có kiểm tra trùng lịch)"""
+        return bool(self._busy_intervals(service, user_id, self._aware(start_time), self._aware(end_time)))
+    
+    def _event_body(self, spec: Dict) -> Dict:
+        """Body của events.insert cho một sự kiện có giờ hoặc một deadline (sự kiện cả ngày)"""
+        if spec.get('all_day'):
+            day = spec['start'].date() if isinstance(spec['start'], datetime) else spec['start']
+            return {
+                'summary': spec['title'],
+                'description': spec.get('description', ''),
+                'start': {'date': day.isoformat()},
+                'end': {'date': (day + timedelta(days=1)).isoformat()},
+                # deadline không chiếm thời gian trong free/busy
+                'transparency': 'transparent',
+                'extendedProperties': {'private': {'kind': 'deadline'}},
+                'reminders': {
+                    'useDefault': False,
+                    'overrides': [{'method': 'popup', 'minutes': spec.get('reminder_minutes', 60)}],
+                },
+            }
+        return {
+            'summary': spec['title'],
+            'location': spec.get('location', ''),
+            'description': spec.get('description', ''),
+            'start': {
+                'dateTime': spec['start'].isoformat(),
+                'timeZone': self.timezone.key,
+            },
+            'end': {
+                'dateTime': spec['end'].isoformat(),
+                'timeZone': self.timezone.key,
+            },
+            'reminders': {
+                'useDefault': False,
+                'overrides': [
+                    {'method': 'email', 'minutes': 24 * 60},  # 1 day before
+                    {'method': 'popup', 'minutes': 30},       # 30 min before
+                ],
+            },
+        }
+    
+    def create_events(self, user_id: str, specs: List[Dict]) -> List[Dict]:
+        """
+        Tạo nhiều sự kiện: xác thực một lần, kiểm tra trùng lịch bằng một lượt freebusy cho cả nhóm,
+        các lượt insert được gửi chung trong batch HTTP request (tối đa BATCH_SIZE mỗi request).
+        spec: {'title', 'start', 'end', 'description', 'location'} hoặc {'title', 'start', 'all_day': True, 'reminder_minutes'}.
+        Trả về kết quả theo đúng thứ tự specs
+        """
+        service = self.get_service(user_id)
+        if service is None:
+            return [{
+                'success': False,
+                'message': 'Cần xác thực Google Calendar trước khi tạo sự kiện'
+            } for _ in specs]
+        
+        specs = list(specs)
+        results: List[Optional[Dict]] = [None] * len(specs)
+        timed = [i for i, spec in enumerate(specs) if not spec.get('all_day')]
+        for i in timed:
+            specs[i] = {**specs[i], 'start': self._aware(specs[i]['start']), 'end': self._aware(specs[i]['end'])}
+        
+        # Kiểm tra trùng lịch (cả với các sự kiện khác trong cùng nhóm)
         try:
-            if not self.authenticate_user(user_id):
-                return {
+            busy = self._busy_intervals(
+                service, user_id,
+                min(specs[i]['start'] for i in timed),
+                max(specs[i]['end'] for i in timed)
+            ) if timed else []
+        except Exception as e:
+            # không tạo sự kiện có giờ khi chưa kiểm tra được trùng lịch (deadline cả ngày không chiếm free/busy)
+            self.logger.error(f"Error querying free/busy: {e}")
+            for i in timed:
+                results[i] = {
                     'success': False,
-                    'message': 'Cần xác thực Google Calendar trước khi tạo sự kiện'
+                    'message': f'Lỗi kiểm tra trùng lịch, chưa tạo sự kiện: {str(e)}',
+                    'conflict_check_failed': True
                 }
-            # Kiểm tra trùng lịch
-            if self.is_time_conflict(user_id, start_time, end_time):
-                return {
+            timed, busy = [], []
+        for i in timed:
+            start_time, end_time = specs[i]['start'], specs[i]['end']
+            if any(start < end_time and end > start_time for start, end in busy):
+                results[i] = {
                     'success': False,
                     'message': '❗ Thời gian này đã có sự kiện khác trong lịch. Vui lòng chọn thời gian khác!',
                     'conflict': True
                 }
-            event = {
-                'summary': title,
-                'location': location,
-                'description': description,
-                'start': {
-                    'dateTime': start_time.isoformat(),
-                    'timeZone': 'Asia/Ho_Chi_Minh',
-                },
-                'end': {
-                    'dateTime': end_time.isoformat(),
-                    'timeZone': 'Asia/Ho_Chi_Minh',
-                },
-                'reminders': {
-                    'useDefault': False,
-                    'overrides': [
-                        {'method': 'email', 'minutes': 24 * 60},  # 1 day before
-                        {'method': 'popup', 'minutes': 30},       # 30 min before
-                    ],
-                },
-            }
-            
-            created_event = self.service.events().insert(
-                calendarId='primary', body=event).execute()
-            
+            else:
+                busy.append((start_time, end_time))
+        
+        created_events = []
+        
+        def on_inserted(request_id, created_event, exception):
+            i = int(request_id)
+            spec = specs[i]
+            if exception is not None:
+                self.logger.error(f"Error creating event: {exception}")
+                results[i] = {
+                    'success': False,
+                    'message': f'Lỗi tạo sự kiện: {str(exception)}'
+                }
+                return
             self.logger.info(f"Created event {created_event['id']} for user {user_id}")
-            
-            return {
+            created_events.append(created_event)
+            results[i] = {
                 'success': True,
                 'event_id': created_event['id'],
                 'event_link': created_event.get('htmlLink'),
-                'message': f'Đã tạo sự kiện: {title}',
-                'start_time': start_time.isoformat(),
-                'end_time': end_time.isoformat()
-            }
-            
-        except Exception as e:
-            self.logger.error(f"Error creating event: {e}")
-            return {
-                'success': False,
-                'message': f'Lỗi tạo sự kiện: {str(e)}'
+                'message': f"Đã tạo sự kiện: {spec['title']}",
+                'start_time': spec['start'].isoformat(),
+                'end_time': spec['end'].isoformat() if 'end' in spec else None
             }
+            if not spec.get('all_day'):
+                self.busy_cache.add(user_id, spec['start'], spec['end'])
+        
+        pending = [i for i in range(len(specs)) if results[i] is None]
+        for offset in range(0, len(pending), self.BATCH_SIZE):
+            chunk = pending[offset:offset + self.BATCH_SIZE]
+            try:
+                if len(chunk) == 1:
+                    # một sự kiện: gọi thẳng, không cần bọc batch
+                    i = chunk[0]
+                    created_event = service.events().insert(calendarId='primary', body=self._event_body(specs[i])).execute()
+                    on_inserted(str(i), created_event, None)
+                    continue
+                batch = service.new_batch_http_request(callback=on_inserted)
+                for i in chunk:
+                    batch.add(service.events().insert(calendarId='primary', body=self._event_body(specs[i])),
+                              request_id=str(i))
+                batch.execute()
+            except Exception as e:
+                for i in chunk:
+                    if results[i] is None:
+                        on_inserted(str(i), None, e)
+        
+        if created_events and self.mirror:
+            try:
+                self.mirror.record_created(user_id, created_events)
+            except Exception as e:
+                self.logger.error(f"Error updating calendar mirror: {e}")
+        return results
+    
+    def create_event(self, user_id: str, title: str, start_time: datetime, end_time: datetime, 
+                    description: str = "", location: str = "") -> Dict:
+        """Create a calendar event (có kiểm tra trùng lịch)"""
+        return self.create_events(user_id, [{
+            'title': title,
+            'start': start_time,
+            'end': end_time,
+            'description': description,
+            'location': location
+        }])[0]
+    
+    def create_deadline(self, user_id: str, deadline_data: Dict) -> Dict:
+        """Tạo deadline (sự kiện cả ngày, không kiểm tra trùng lịch)"""
+        return self.create_deadlines(user_id, [deadline_data])[0]
     
-    def get_upcoming_events(self, user_id: str, days_ahead: int = 7) -> Dict:
-        """Lấy danh sách sự kiện sắp tới"""
+    def create_deadlines(self, user_id: str, deadlines: List[Dict]) -> List[Dict]:
+        """Tạo nhiều deadline trong một batch request (vd. import danh sách deadline)"""
+        return self.create_events(user_id, [{
+            'title': deadline['title'],
+            'start': datetime.strptime(deadline['date'], '%Y-%m-%d').date(),
+            'description': deadline.get('description', ''),
+            'reminder_minutes': deadline.get('reminder_minutes', 60),
+            'all_day': True
+        } for deadline in deadlines])
+    
+    def get_upcoming_events(self, user_id: str, days_ahead: int = 7, deadlines_only: bool = False) -> Dict:
+        """Lấy danh sách sự kiện sắp tới (từ bản sao lịch cục bộ nếu có, nếu không thì gọi API)"""
         try:
-            if not self.authenticate_user(user_id):
-                return {
-                    'success': False,
-                    'message': 'Cần xác thực Google Calendar'
-                }
-            
-            now = datetime.now()
+            now = datetime.now(self.timezone)
             time_max = now + timedelta(days=days_ahead)
             
-            events_result = self.service.events().list(
-                calendarId='primary',
-                timeMin=now.isoformat() + 'Z',
-                timeMax=time_max.isoformat() + 'Z',
-                maxResults=50,
-                singleEvents=True,
-                orderBy='startTime'
-            ).execute()
-            
-            events = events_result.get('items', [])
+            events = self.mirror.list_events(user_id, now, time_max, 50, deadlines_only) if self.mirror else None
+            if events is None:
+                service = self.get_service(user_id)
+                if service is None:
+                    return {
+                        'success': False,
+                        'message': 'Cần xác thực Google Calendar'
+                    }
+                
+                events_result = service.events().list(
+                    calendarId='primary',
+                    timeMin=now.isoformat(),
+                    timeMax=time_max.isoformat(),
+                    maxResults=50,
+                    singleEvents=True,
+                    orderBy='startTime',
+                    **({'privateExtendedProperty': 'kind=deadline'} if deadlines_only else {})
+                ).execute()
+                
+                events = events_result.get('items', [])
             
             return {
                 'success': True,
@@ -298,5 +588,9 @@ class GoogleCalendarManager:
                 'message': f'Lỗi lấy danh sách sự kiện: {str(e)}'
             }
     
+    def get_upcoming_deadlines(self, user_id: str, days_ahead: int = 7) -> Dict:
+        """Deadline trong days_ahead ngày tới (dùng cho nhắc deadline)"""
+        return self.get_upcoming_events(user_id, days_ahead, deadlines_only=True)
+    
 # Global instance
 calendar_manager = GoogleCalendarManager()
@@ -0,0 +1,227 @@
+"""
+Bản sao cục bộ lịch Google Calendar của từng user (bảng calendar_events trong chatbot.db)
+
+- Lần đầu: full sync, lưu nextSyncToken; các lần sau chỉ tải thay đổi bằng syncToken
+  (token hết hạn -> 410 Gone -> full sync lại)
+- Danh sách sự kiện, kiểm tra trùng lịch và deadline sắp tới là query có index trên SQLite
+- Mọi lượt đồng bộ chạy ở thread nền: user chưa có bản sao được trả lời bằng API trực tiếp cho tới khi
+  full sync đầu tiên xong (full sync tải mọi instance của sự kiện lặp nên không chạy trên request path)
+- Bản sao cũ hơn refresh_interval vẫn được dùng ngay, thread nền đồng bộ lại (và định kỳ đồng bộ
+  các user vừa mở lịch trong active_window)
+"""
+import json
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional, Tuple
+from zoneinfo import ZoneInfo
+
+from googleapiclient.errors import HttpError
+
+
+def _utc_text(value: datetime) -> str:
+    """Giờ UTC dạng 'YYYY-MM-DDTHH:MM:SS' (cột start_at/end_at)"""
+    return value.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S')
+
+
+def _event_bound(bound: Dict, tz: ZoneInfo) -> Tuple[datetime, bool]:
+    """(thời điểm, là ngày cả ngày) của start/end trong resource event"""
+    if 'dateTime' in bound:
+        return datetime.fromisoformat(bound['dateTime'].replace('Z', '+00:00')), False
+    return datetime.fromisoformat(bound['date']).replace(tzinfo=tz), True
+
+
+def is_deadline_event(event: Dict) -> bool:
+    """Deadline do chatbot tạo (create_deadline) hoặc sự kiện có tiền tố DEADLINE"""
+    private = event.get('extendedProperties', {}).get('private', {})
+    return private.get('kind') == 'deadline' or 'DEADLINE' in event.get('summary', '').upper()
+
+
+def event_row(event: Dict, tz: ZoneInfo) -> Dict:
+    """Row của bảng calendar_events cho một resource event"""
+    start, all_day = _event_bound(event['start'], tz)
+    end, _ = _event_bound(event['end'], tz)
+    return {
+        'event_id': event['id'],
+        'summary': event.get('summary', ''),
+        'start_at': _utc_text(start),
+        'end_at': _utc_text(end),
+        'all_day': int(all_day),
+        'transparent': int(event.get('transparency') == 'transparent'),
+        'is_deadline': int(is_deadline_event(event)),
+        'event': json.dumps(event, ensure_ascii=False)
+    }
+
+
+class CalendarMirror:
+    """Đồng bộ tăng dần lịch primary của user vào SQLite và trả lời các truy vấn lịch từ bản sao"""
+
+    def __init__(self, db, get_service: Callable, tz: ZoneInfo,
+                 refresh_interval: int = 120, active_window: int = 3600):
+        self.db = db
+        self._get_service = get_service
+        self.tz = tz
+        self.refresh_interval = refresh_interval
+        self.active_window = active_window
+        self._lock = threading.Lock()
+        self._user_locks: Dict[str, threading.Lock] = {}
+        self._active: Dict[str, float] = {}  # user_id -> lần cuối mở lịch (monotonic)
+        self._queued = set()
+        self._queue: "queue.Queue" = queue.Queue()
+        self.stats = {'full_syncs': 0, 'incremental_syncs': 0, 'changes': 0, 'errors': 0}
+        self._thread = threading.Thread(target=self._run, name='calendar-sync', daemon=True)
+        self._thread.start()
+
+    def _user_lock(self, user_id: str) -> threading.Lock:
+        with self._lock:
+            return self._user_locks.setdefault(user_id, threading.Lock())
+
+    def _fetch(self, service, sync_token: Optional[str]) -> Tuple[List[Dict], Optional[str]]:
+        """Mọi trang events.list (thay đổi kể từ sync_token, hoặc toàn bộ nếu None) và nextSyncToken"""
+        items = []
+        page_token = None
+        while True:
+            params = {'calendarId': 'primary', 'singleEvents': True, 'maxResults': 2500}
+            if sync_token:
+                params['syncToken'] = sync_token
+            if page_token:
+                params['pageToken'] = page_token
+            response = service.events().list(**params).execute()
+            items.extend(response.get('items', []))
+            page_token = response.get('nextPageToken')
+            if not page_token:
+                return items, response.get('nextSyncToken')
+
+    def sync(self, user_id: str, service=None) -> bool:
+        """Đồng bộ bản sao của user với Google Calendar, False nếu user chưa xác thực"""
+        service = service or self._get_service(user_id)
+        if service is None:
+            return False
+
+        with self._user_lock(user_id):
+            state = self.db.get_calendar_sync_state(user_id)
+            sync_token = state['sync_token'] if state else None
+            try:
+                items, next_token = self._fetch(service, sync_token)
+            except HttpError as e:
+                if sync_token is None or e.resp.status != 410:
+                    raise
+                print(f"[INFO] Calendar sync token expired for user {user_id}, running full sync")
+                sync_token = None
+                items, next_token = self._fetch(service, None)
+
+            rows, deleted = [], []
+            for event in items:
+                if event.get('status') == 'cancelled':
+                    deleted.append(event['id'])
+                    continue
+                try:
+                    rows.append(event_row(event, self.tz))
+                except (KeyError, ValueError) as e:
+                    print(f"[WARNING] Skipping calendar event {event.get('id')}: {e}")
+            self.db.apply_calendar_sync(user_id, rows, deleted, next_token, full=sync_token is None)
+
+        with self._lock:
+            self.stats['incremental_syncs' if sync_token else 'full_syncs'] += 1
+            self.stats['changes'] += len(items)
+        return True
+
+    def _ready(self, user_id: str) -> bool:
+        """
+        Bản sao của user dùng được chưa: lần đầu thì xếp full sync vào thread nền và trả về False
+        (caller gọi API trực tiếp), nếu đã cũ thì vẫn dùng và xếp lịch đồng bộ lại ở thread nền
+        """
+        with self._lock:
+            self._active[user_id] = time.monotonic()
+        state = self.db.get_calendar_sync_state(user_id)
+        if state is None or time.time() - state['synced_at'] > self.refresh_interval:
+            self.request_refresh(user_id)
+        return state is not None
+
+    def _stale(self, user_id: str) -> bool:
+        state = self.db.get_calendar_sync_state(user_id)
+        return state is None or time.time() - state['synced_at'] > self.refresh_interval
+
+    def request_refresh(self, user_id: str):
+        """Xếp user vào hàng đợi đồng bộ nền (bỏ qua nếu đã có trong hàng đợi)"""
+        with self._lock:
+            if user_id in self._queued:
+                return
+            self._queued.add(user_id)
+        self._queue.put(user_id)
+
+    def list_events(self, user_id: str, start_time: datetime, end_time: datetime,
+                    limit: int = 50, deadlines_only: bool = False) -> Optional[List[Dict]]:
+        """Sự kiện trong khoảng thời gian từ bản sao, None nếu chưa có bản sao (cần gọi API trực tiếp)"""
+        if not self._ready(user_id):
+            return None
+        return self.db.get_calendar_events(user_id, _utc_text(start_time), _utc_text(end_time),
+                                           limit, deadlines_only)
+
+    def busy_intervals(self, user_id: str, start_time: datetime, end_time: datetime) -> Optional[List[Tuple]]:
+        """Các khoảng bận (datetime UTC) giao với [start_time, end_time), None nếu chưa có bản sao"""
+        if not self._ready(user_id):
+            return None
+        return [
+            (datetime.fromisoformat(start).replace(tzinfo=timezone.utc),
+             datetime.fromisoformat(end).replace(tzinfo=timezone.utc))
+            for start, end in self.db.get_calendar_busy(user_id, _utc_text(start_time), _utc_text(end_time))
+        ]
+
+    def record_created(self, user_id: str, events: List[Dict]):
+        """Sự kiện vừa tạo qua API: ghi ngay vào bản sao (lượt đồng bộ sau nhận lại chúng, upsert không đổi gì)"""
+        if self.db.get_calendar_sync_state(user_id) is None:
+            return
+        self.db.upsert_calendar_events(user_id, [event_row(event, self.tz) for event in events])
+
+    def _run(self):
+        while True:
+            try:
+                user_ids = [self._queue.get(timeout=self.refresh_interval)]
+            except queue.Empty:
+                # định kỳ: đồng bộ các user vừa mở lịch gần đây
+                now = time.monotonic()
+                with self._lock:
+                    for user_id, last_seen in list(self._active.items()):
+                        if now - last_seen > self.active_window:
+                            del self._active[user_id]
+                    user_ids = list(self._active)
+                user_ids = [user_id for user_id in user_ids if self._stale(user_id)]
+
+            for user_id in user_ids:
+                with self._lock:
+                    self._queued.discard(user_id)
+                try:
+                    self.sync(user_id)
+                except Exception as e:
+                    print(f"[ERROR] Background calendar sync failed for user {user_id}: {e}")
+                    with self._lock:
+                        self.stats['errors'] += 1
+
+
+_calendar_mirror = None
+_mirror_lock = threading.Lock()
+
+
+def get_calendar_mirror() -> Optional[CalendarMirror]:
+    """Bản sao lịch dùng chung, None nếu bị tắt (CALENDAR_MIRROR_ENABLED=false)"""
+    global _calendar_mirror
+    from config import Config
+    settings = Config.CALENDAR_SETTINGS
+    if not settings['mirror_enabled']:
+        return None
+    if _calendar_mirror is None:
+        with _mirror_lock:
+            if _calendar_mirror is None:
+                from calendar_manager import GoogleCalendarManager
+                from database import get_db
+                manager = GoogleCalendarManager()
+                _calendar_mirror = CalendarMirror(
+                    get_db(),
+                    manager.get_service,
+                    manager.timezone,
+                    refresh_interval=settings['mirror_refresh_interval'],
+                    active_window=settings['mirror_active_window']
+                )
+    return _calendar_mirror
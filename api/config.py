@@ -30,10 +30,129 @@ class Config:
     CALENDAR_SETTINGS = {
         'max_events': int(os.getenv('CALENDAR_MAX_EVENTS', 50)),
         'default_reminder': int(os.getenv('CALENDAR_DEFAULT_REMINDER', 15)),
+        # calendar parser: rule trước, chỉ gọi LLM khi confidence của rule thấp hơn ngưỡng này
+        'parser_llm_threshold': float(os.getenv('CALENDAR_PARSER_LLM_THRESHOLD', 0.8)),
+        # số kết quả parse được cache (LRU, hết hạn lúc nửa đêm theo CALENDAR_TIMEZONE)
+        'parse_cache_size': int(os.getenv('CALENDAR_PARSE_CACHE_SIZE', 1024)),
+        # service Google Calendar được cache theo user; access token được refresh trước khi hết hạn (giây)
+        'service_cache_size': int(os.getenv('CALENDAR_SERVICE_CACHE_SIZE', 256)),
+        'token_refresh_margin': int(os.getenv('CALENDAR_TOKEN_REFRESH_MARGIN', 300)),
+        # free/busy view dùng cho kiểm tra trùng lịch được cache trong bao lâu (giây)
+        'freebusy_ttl': int(os.getenv('CALENDAR_FREEBUSY_TTL', 60)),
+        # bản sao lịch trong chatbot.db (syncToken): đồng bộ lại khi cũ hơn refresh_interval giây,
+        # thread nền giữ bản sao mới cho các user mở lịch trong active_window giây gần nhất
+        'mirror_enabled': os.getenv('CALENDAR_MIRROR_ENABLED', 'true').lower() == 'true',
+        'mirror_refresh_interval': int(os.getenv('CALENDAR_MIRROR_REFRESH_INTERVAL', 120)),
+        'mirror_active_window': int(os.getenv('CALENDAR_MIRROR_ACTIVE_WINDOW', 3600)),
         'tokens_dir': os.path.join(os.path.dirname(__file__), '..', 'data', 'calendar_tokens'),
         'credentials_file': os.path.join(os.path.dirname(__file__), '..', 'data', 'credentials.json')
     }
 
+    # Database Settings
+    DATABASE_SETTINGS = {
+        'pool_size': int(os.getenv('DB_POOL_SIZE', 16)),
+        'connect_timeout': float(os.getenv('DB_CONNECT_TIMEOUT', 30)),
+        'health_check_interval': int(os.getenv('DB_HEALTH_CHECK_INTERVAL', 60)),
+        # Storage profile (journal_mode=WAL được bật trong init_database)
+        'pragmas': {
+            'synchronous': os.getenv('DB_SYNCHRONOUS', 'NORMAL'),
+            'mmap_size': int(os.getenv('DB_MMAP_SIZE', 268435456)),
+            'cache_size': int(os.getenv('DB_CACHE_SIZE', -16000)),
+            'busy_timeout': int(os.getenv('DB_BUSY_TIMEOUT', 5000))
+        },
+        'write_batch_size': int(os.getenv('DB_WRITE_BATCH_SIZE', 64)),
+        'write_batch_wait': float(os.getenv('DB_WRITE_BATCH_WAIT', 0.0))
+    }
+
+    # Context hội thoại: đọc tối đa max_turns lượt gần nhất, cắt theo ngân sách token của model
+    # (min(context_window - max_tokens, max_prompt_tokens))
+    CONTEXT_SETTINGS = {
+        'max_turns': int(os.getenv('CONTEXT_MAX_TURNS', 20)),
+        'max_prompt_tokens': int(os.getenv('CONTEXT_MAX_PROMPT_TOKENS', 6000))
+    }
+
+    # Summary cuộc hội thoại: cập nhật nền sau mỗi every_messages tin nhắn, prompt = summary + keep_recent lượt mới nhất
+    SUMMARY_SETTINGS = {
+        'enabled': os.getenv('SUMMARY_ENABLED', 'true').lower() == 'true',
+        'every_messages': int(os.getenv('SUMMARY_EVERY_MESSAGES', 6)),
+        'keep_recent': int(os.getenv('SUMMARY_KEEP_RECENT', 4)),
+        'max_tokens': int(os.getenv('SUMMARY_MAX_TOKENS', 400))
+    }
+
+    # Routing model theo task: câu hỏi thường dùng tier BASIC, chỉ câu hỏi toán/lập trình khó mới lên tier cao hơn;
+    # chọn theo chi phí tối đa của request (prompt + max_tokens, <= max_cost_per_request USD), latency p50 và tỉ lệ lỗi
+    # gần đây của model; expected_completion_tokens: phần context window tối thiểu phải còn lại cho câu trả lời
+    ROUTER_SETTINGS = {
+        'enabled': os.getenv('MODEL_ROUTER_ENABLED', 'true').lower() == 'true',
+        'max_cost_per_request': float(os.getenv('MODEL_ROUTER_MAX_COST', 0.1)),
+        'hard_question_tokens': int(os.getenv('MODEL_ROUTER_HARD_TOKENS', 40)),
+        'expected_completion_tokens': int(os.getenv('MODEL_ROUTER_COMPLETION_TOKENS', 500)),
+        'latency_target': float(os.getenv('MODEL_ROUTER_LATENCY_TARGET', 5))
+    }
+
+    # Admission control cho OpenAI API: token bucket RPM/TPM theo model, request chờ tối đa queue_timeout giây
+    # OPENAI_RATE_LIMITS ghi đè giới hạn mặc định của model, dạng "gpt-4o-mini=500:200000,gpt-4=500:10000"
+    RATE_LIMIT_SETTINGS = {
+        'enabled': os.getenv('RATE_LIMIT_ENABLED', 'true').lower() == 'true',
+        'limits': os.getenv('OPENAI_RATE_LIMITS', ''),
+        'burst_seconds': float(os.getenv('RATE_LIMIT_BURST_SECONDS', 10)),
+        'queue_timeout': float(os.getenv('RATE_LIMIT_QUEUE_TIMEOUT', 20)),
+        'max_retries': int(os.getenv('RATE_LIMIT_MAX_RETRIES', 2)),
+        'backoff_base': float(os.getenv('RATE_LIMIT_BACKOFF_BASE', 1)),
+        'backoff_max': float(os.getenv('RATE_LIMIT_BACKOFF_MAX', 60))
+    }
+
+    # Hedged request: model chính chậm hơn p95 latency của nó -> gửi thêm tới model kế tiếp trong fallback chain,
+    # giới hạn tỉ lệ request được hedge và chi phí thừa (USD) mỗi giờ. Chỉ áp dụng cho achat_completion (/chat):
+    # request sync không huỷ được bên thua, /chat/stream chưa hedge
+    HEDGE_SETTINGS = {
+        'enabled': os.getenv('HEDGE_ENABLED', 'false').lower() == 'true',
+        'percentile': float(os.getenv('HEDGE_PERCENTILE', 0.95)),
+        'min_samples': int(os.getenv('HEDGE_MIN_SAMPLES', 20)),
+        'default_delay': float(os.getenv('HEDGE_DEFAULT_DELAY', 8)),
+        'min_delay': float(os.getenv('HEDGE_MIN_DELAY', 1)),
+        'max_ratio': float(os.getenv('HEDGE_MAX_RATIO', 0.1)),
+        'cost_cap_per_hour': float(os.getenv('HEDGE_COST_CAP_PER_HOUR', 0.5))
+    }
+
+    # Response cache cho câu hỏi không phụ thuộc context
+    RESPONSE_CACHE_SETTINGS = {
+        'enabled': os.getenv('RESPONSE_CACHE_ENABLED', 'true').lower() == 'true',
+        'max_entries': int(os.getenv('RESPONSE_CACHE_MAX_ENTRIES', 2048)),
+        'ttl': int(os.getenv('RESPONSE_CACHE_TTL', 86400)),
+        'semantic_enabled': os.getenv('RESPONSE_CACHE_SEMANTIC', 'true').lower() == 'true',
+        'semantic_threshold': float(os.getenv('RESPONSE_CACHE_SEMANTIC_THRESHOLD', 0.95))
+    }
+
+    # Embedding: gộp request thành batch, vector float16 cache trên đĩa theo hash nội dung
+    EMBEDDING_SETTINGS = {
+        'model': os.getenv('EMBEDDING_MODEL', 'text-embedding-3-small'),
+        'max_batch_size': int(os.getenv('EMBEDDING_MAX_BATCH_SIZE', 64)),
+        'max_wait': float(os.getenv('EMBEDDING_MAX_WAIT', 0.01)),
+        # số embedding câu hỏi lúc query giữ trong bộ nhớ (không ghi vào data/embeddings)
+        'query_cache_size': int(os.getenv('EMBEDDING_QUERY_CACHE_SIZE', 4096)),
+        'cache_dir': os.path.join(os.path.dirname(__file__), '..', 'data', 'embeddings')
+    }
+
+    # FAQ stage: trả lời trực tiếp từ data/faq.json khi đủ chắc chắn
+    FAQ_SETTINGS = {
+        'enabled': os.getenv('FAQ_ENABLED', 'true').lower() == 'true',
+        'confidence_threshold': float(os.getenv('FAQ_CONFIDENCE_THRESHOLD', 0.75))
+    }
+
+    # Intent classifier cục bộ: bỏ qua LLM calendar parser khi chắc chắn tin nhắn không phải yêu cầu lịch
+    INTENT_CLASSIFIER_SETTINGS = {
+        'enabled': os.getenv('INTENT_CLASSIFIER_ENABLED', 'true').lower() == 'true',
+        'confidence_threshold': float(os.getenv('INTENT_CLASSIFIER_THRESHOLD', 0.9))
+    }
+
+    # Vector retrieval: passage từ models/vector_index.* làm grounding cho AI
+    VECTOR_INDEX_SETTINGS = {
+        'enabled': os.getenv('VECTOR_INDEX_ENABLED', 'true').lower() == 'true',
+        'top_k': int(os.getenv('VECTOR_INDEX_TOP_K', 3)),
+        'min_score': float(os.getenv('VECTOR_INDEX_MIN_SCORE', 0.45))
+    }
+
 # System prompts cho từng môn học - ĐƠN GIẢN VÀ TẬP TRUNG
 SYSTEM_PROMPTS = {
     'math': """Bạn là giáo viên Toán học chuyên nghiệp. Trả lời câu hỏi toán học một cách chính xác, rõ ràng và dễ hiểu. 
@@ -0,0 +1,123 @@
+"""
+Ghép context hội thoại theo ngân sách token thay vì theo số tin nhắn
+
+- Token được đếm local bằng tiktoken (encoding đúng theo model); số token của từng nội dung được cache,
+  nên mỗi tin nhắn cũ chỉ được encode một lần dù xuất hiện trong nhiều lượt hỏi
+- Không có tiktoken (hoặc không tải được file BPE khi offline): ước lượng bảo thủ theo số byte UTF-8
+- Ngân sách prompt của model = min(context_window - max_tokens của câu trả lời, CONTEXT_MAX_PROMPT_TOKENS);
+  system prompt (+ summary hội thoại) + câu hỏi luôn được giữ, các lượt hội thoại được thêm từ mới nhất đến khi hết ngân sách
+"""
+import threading
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+from config import Config
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+
+# overhead định dạng chat của OpenAI: mỗi message ~3 token, câu trả lời được mồi thêm 3 token
+TOKENS_PER_MESSAGE = 3
+TOKENS_PER_REPLY = 3
+
+_encodings: Dict[str, object] = {}
+_encodings_lock = threading.Lock()
+
+
+def _encoding_name(model: str) -> str:
+    """Tên encoding của model (o200k_base cho gpt-4o*, cl100k_base cho gpt-4 / gpt-3.5)"""
+    if tiktoken is not None:
+        try:
+            return tiktoken.encoding_name_for_model(model)
+        except KeyError:
+            pass
+    return 'o200k_base' if model.startswith('gpt-4o') else 'cl100k_base'
+
+
+def _get_encoding(name: str):
+    """Encoding tiktoken (load một lần), None nếu không dùng được -> ước lượng"""
+    if tiktoken is None:
+        return None
+    if name not in _encodings:
+        with _encodings_lock:
+            if name not in _encodings:
+                try:
+                    _encodings[name] = tiktoken.get_encoding(name)
+                except Exception as e:
+                    # tiktoken tải file BPE ở lần dùng đầu tiên, có thể lỗi khi không có mạng
+                    print(f"[WARNING] tiktoken encoding {name} unavailable, estimating token counts: {e}")
+                    _encodings[name] = None
+    return _encodings[name]
+
+
+@lru_cache(maxsize=16384)
+def _count(encoding_name: str, text: str) -> int:
+    encoding = _get_encoding(encoding_name)
+    if encoding is None:
+        # tiếng Việt có dấu ~2-3 byte/ký tự; chia 3 cho kết quả lớn hơn số token thật (an toàn cho ngân sách)
+        return (len(text.encode('utf-8')) + 2) // 3
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def count_tokens(text: str, model: str) -> int:
+    """Số token của một đoạn text với tokenizer của model (có cache)"""
+    return _count(_encoding_name(model), text) if text else 0
+
+
+def count_message_tokens(message: Dict[str, str], model: str) -> int:
+    """Số token của một message trong prompt (nội dung + role + overhead)"""
+    return TOKENS_PER_MESSAGE + count_tokens(message.get('content') or '', model) + count_tokens(message['role'], model)
+
+
+def count_prompt_tokens(messages: List[Dict[str, str]], model: str) -> int:
+    """Số token của cả prompt như OpenAI tính (prompt_tokens)"""
+    return sum(count_message_tokens(message, model) for message in messages) + TOKENS_PER_REPLY
+
+
+def prompt_budget(model: str, max_tokens: Optional[int] = None) -> int:
+    """Số token tối đa cho prompt của model, chừa max_tokens cho câu trả lời"""
+    from openai_manager import OpenAIModelManager
+    model_config = OpenAIModelManager.AVAILABLE_MODELS[model]
+    if max_tokens is None:
+        max_tokens = min(model_config.max_tokens, 4096)
+    return min(model_config.context_window - max_tokens, Config.CONTEXT_SETTINGS['max_prompt_tokens'])
+
+
+def build_context(
+    system_messages: List[Dict[str, str]],
+    context_messages: Optional[List[Dict[str, str]]],
+    question: str,
+    model: str,
+    max_tokens: Optional[int] = None
+) -> Tuple[List[Dict[str, str]], int]:
+    """
+    Messages cho chat completion: system messages + các lượt hội thoại mới nhất vừa ngân sách + câu hỏi.
+    Trả về (messages, số prompt token đã gửi)
+    """
+    # system message trong context (summary của hội thoại) luôn được giữ như system prompt
+    pinned = [m for m in context_messages or [] if m.get('role') == 'system' and m.get('content')]
+    context_messages = [m for m in context_messages or [] if m.get('role') != 'system']
+    system_messages = system_messages + pinned
+
+    question_message = {"role": "user", "content": question}
+    used = count_prompt_tokens(system_messages + [question_message], model)
+    budget = prompt_budget(model, max_tokens)
+
+    history = []
+    for message in reversed(context_messages):
+        if not message.get('role') or not message.get('content'):
+            continue
+        tokens = count_message_tokens(message, model)
+        if used + tokens > budget:
+            break
+        history.append({"role": message['role'], "content": message['content']})
+        used += tokens
+    history.reverse()
+    # lượt hội thoại bị cắt giữa chừng: bỏ câu trả lời không còn câu hỏi đi kèm
+    if history and history[0]['role'] == 'assistant':
+        used -= count_message_tokens(history.pop(0), model)
+
+    return system_messages + history + [question_message], used
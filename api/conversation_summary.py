@@ -0,0 +1,225 @@
+"""
+Summary cuộc hội thoại cập nhật dần (cột conversations.summary)
+
+- Sau mỗi SUMMARY_EVERY_MESSAGES tin nhắn, thread nền gộp các tin nhắn chưa được tóm tắt
+  (trừ SUMMARY_KEEP_RECENT lượt mới nhất) vào summary cũ bằng một lần gọi LLM nhỏ
+- Prompt của chat = summary + các lượt chưa được tóm tắt, nên kích thước prompt gần như không đổi
+  dù hội thoại dài bao nhiêu
+- Lỗi khi tóm tắt không ảnh hưởng tới chat: summarized_count giữ nguyên, lượt sau sẽ gộp bù
+"""
+import queue
+import threading
+from typing import Dict, List, Optional
+
+from config import Config
+from response_cache import SUMMARY_PREFIX
+
+
+SUMMARY_PROMPT = (
+    "Bạn tóm tắt cuộc hội thoại giữa sinh viên và trợ lý học tập. "
+    "Cập nhật bản tóm tắt hiện có với các lượt hội thoại mới: giữ lại thông tin về sinh viên, "
+    "các chủ đề, câu hỏi, kết luận và việc còn dang dở cần cho các câu trả lời tiếp theo; bỏ chi tiết thừa. "
+    "Chỉ trả về bản tóm tắt, tối đa khoảng 200 từ."
+)
+
+# số tin nhắn tối đa mỗi lần gọi LLM (hội thoại cũ chưa có summary được gộp dần từng phần)
+CHUNK_MESSAGES = 20
+# câu trả lời dài chỉ cần phần đầu để tóm tắt
+MAX_ANSWER_CHARS = 1000
+
+
+def summary_message(summary: str) -> Dict[str, str]:
+    """System message đưa summary vào context của chat"""
+    return {"role": "system", "content": f"{SUMMARY_PREFIX} {summary}"}
+
+
+def context_messages(db, conversation: Optional[Dict], max_turns: int) -> List[Dict[str, str]]:
+    """
+    Context cho AI của một hội thoại (metadata từ get_current_conversation): summary dưới dạng system message
+    (nếu có) + tối đa max_turns cặp hỏi/đáp gần nhất chưa được tóm tắt
+    """
+    messages = []
+    if not conversation:
+        return messages
+    turns = max_turns
+    if conversation.get('summary'):
+        messages.append(summary_message(conversation['summary']))
+        unsummarized = conversation['message_count'] - (conversation.get('summarized_count') or 0)
+        turns = min(turns, max(unsummarized, 0))
+    for msg in db.get_recent_messages(conversation['id'], turns) if turns else []:
+        messages.extend([
+            {"role": "user", "content": msg.get('question', '')},
+            {"role": "assistant", "content": msg.get('answer', '')}
+        ])
+    return messages
+
+
+class ConversationSummarizer:
+    """Nhận tín hiệu từ DatabaseManager.add_message và cập nhật summary ở thread nền"""
+
+    def __init__(self, db, every_messages: int = 6, keep_recent: int = 4, max_tokens: int = 400):
+        self.db = db
+        self.every_messages = max(1, every_messages)
+        self.keep_recent = keep_recent
+        self.max_tokens = max_tokens
+        self._lock = threading.Lock()
+        self._queued = set()
+        self._queue: "queue.Queue" = queue.Queue()
+        self.stats = {'summaries': 0, 'messages_summarized': 0, 'errors': 0}
+        self._thread = threading.Thread(target=self._run, name='conversation-summary', daemon=True)
+        self._thread.start()
+
+    def on_message(self, conversation_id: str, message_count: int):
+        """Listener của add_message: xếp hội thoại vào hàng đợi sau mỗi every_messages tin nhắn"""
+        if message_count % self.every_messages == 0:
+            self.request_summary(conversation_id)
+
+    def request_summary(self, conversation_id: str):
+        """Xếp hội thoại vào hàng đợi tóm tắt (bỏ qua nếu đã có trong hàng đợi)"""
+        with self._lock:
+            if conversation_id in self._queued:
+                return
+            self._queued.add(conversation_id)
+        self._queue.put(conversation_id)
+
+    def _summarize(self, summary: str, messages: List[Dict]) -> Optional[str]:
+        """Summary mới = summary cũ + messages, None nếu gọi LLM lỗi"""
+        from openai_manager import openai_manager
+
+        turns = []
+        for msg in messages:
+            answer = msg.get('answer') or ''
+            if len(answer) > MAX_ANSWER_CHARS:
+                answer = answer[:MAX_ANSWER_CHARS] + "..."
+            turns.append(f"Sinh viên: {msg.get('question') or ''}\nTrợ lý: {answer}")
+        content = (
+            f"Bản tóm tắt hiện có:\n{summary or '(chưa có)'}\n\n"
+            "Các lượt hội thoại mới:\n" + "\n\n".join(turns)
+        )
+        result = openai_manager.chat_completion(
+            [{"role": "system", "content": SUMMARY_PROMPT}, {"role": "user", "content": content}],
+            task_type="summarization",
+            temperature=0.2,
+            max_tokens=self.max_tokens,
+            # transcript riêng của từng hội thoại: không được cache/khớp semantic với hội thoại khác
+            use_cache=False
+        )
+        if not result['success']:
+            print(f"[WARNING] Conversation summary failed: {result.get('error')}")
+            return None
+        return result['response'].choices[0].message.content.strip()
+
+    def update(self, conversation_id: str) -> bool:
+        """Gộp các tin nhắn chưa tóm tắt (trừ keep_recent lượt cuối) vào summary, False nếu lỗi"""
+        state = self.db.get_conversation_summary(conversation_id)
+        if state is None:
+            return False
+        summary = state['summary'] or ''
+        summarized = state['summarized_count'] or 0
+        target = state['message_count'] - self.keep_recent
+
+        while summarized < target:
+            limit = min(CHUNK_MESSAGES, target - summarized)
+            messages = self.db.get_messages_range(conversation_id, summarized, limit)
+            if not messages:
+                break
+            new_summary = self._summarize(summary, messages)
+            if new_summary is None:
+                with self._lock:
+                    self.stats['errors'] += 1
+                return False
+            summary = new_summary
+            summarized += len(messages)
+            self.db.update_conversation_summary(conversation_id, summary, summarized)
+            with self._lock:
+                self.stats['summaries'] += 1
+                self.stats['messages_summarized'] += len(messages)
+        return True
+
+    def _run(self):
+        while True:
+            conversation_id = self._queue.get()
+            with self._lock:
+                self._queued.discard(conversation_id)
+            try:
+                self.update(conversation_id)
+            except Exception as e:
+                print(f"[ERROR] Conversation summary failed for {conversation_id}: {e}")
+                with self._lock:
+                    self.stats['errors'] += 1
+
+
+_summarizer = None
+_summarizer_lock = threading.Lock()
+
+
+def get_summarizer() -> Optional[ConversationSummarizer]:
+    """Summarizer dùng chung (đăng ký listener với database), None nếu bị tắt (SUMMARY_ENABLED=false)"""
+    global _summarizer
+    settings = Config.SUMMARY_SETTINGS
+    if not settings['enabled']:
+        return None
+    if _summarizer is None:
+        with _summarizer_lock:
+            if _summarizer is None:
+                from database import get_db
+                db = get_db()
+                _summarizer = ConversationSummarizer(
+                    db,
+                    every_messages=settings['every_messages'],
+                    keep_recent=settings['keep_recent'],
+                    max_tokens=settings['max_tokens']
+                )
+                db.message_listeners.append(_summarizer.on_message)
+    return _summarizer
+
+
+def check_summary_context() -> List[str]:
+    """
+    Kiểm tra trên database tạm: hội thoại đã có summary phải cho context = system message summary
+    + đúng các lượt chưa được tóm tắt. Trả về danh sách lỗi
+    """
+    import os
+    import tempfile
+    from database import DatabaseManager
+
+    errors = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db = DatabaseManager(os.path.join(tmp_dir, 'summary_check.db'))
+        try:
+            user_id = db.get_or_create_user('summary-check-session')
+            conversation = db.create_conversation(user_id, 'Summary check')
+            db.switch_conversation(conversation['id'], user_id)
+            for i in range(8):
+                db.add_message(conversation['id'], user_id, f'question {i}', f'answer {i}')
+            db.update_conversation_summary(conversation['id'], 'summary of questions 0-4', 5)
+
+            current = db.get_current_conversation(user_id, include_messages=False)
+            messages = context_messages(db, current, max_turns=20)
+            expected = [summary_message('summary of questions 0-4')]
+            for i in range(5, 8):
+                expected.extend([{"role": "user", "content": f'question {i}'},
+                                 {"role": "assistant", "content": f'answer {i}'}])
+            if messages != expected:
+                errors.append(f"context with summary: expected {expected}, got {messages}")
+
+            other = db.create_conversation(user_id, 'No summary')
+            db.switch_conversation(other['id'], user_id)
+            db.add_message(other['id'], user_id, 'question', 'answer')
+            messages = context_messages(db, db.get_current_conversation(user_id, include_messages=False), max_turns=20)
+            if messages != [{"role": "user", "content": 'question'}, {"role": "assistant", "content": 'answer'}]:
+                errors.append(f"context without summary: expected only the turn, got {messages}")
+        finally:
+            db.close()
+    return errors
+
+
+if __name__ == "__main__":
+    # python conversation_summary.py --check: exit code 1 nếu summary không được đưa vào context
+    import sys
+    if '--check' in sys.argv:
+        problems = check_summary_context()
+        for problem in problems:
+            print(f"[CHECK] {problem}")
+        print(f"{len(problems)} summary context problem(s)")
+        sys.exit(1 if problems else 0)
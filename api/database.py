@@ -1,80 +1,301 @@
 import sqlite3
 import json
+import asyncio
+import functools
+import re
 from datetime import datetime
 import uuid
 import os
-from typing import Dict, List, Optional, Any
+import time
+import atexit
+import queue
+import threading
+from concurrent.futures import Future
+from typing import Dict, List, Optional, Any, Callable
+
+from migrations import apply_migrations
+
+
+# Storage profile mặc định cho chatbot.db
+DEFAULT_PRAGMAS = {
+    'synchronous': 'NORMAL',   # an toàn với WAL, fsync ít hơn FULL
+    'mmap_size': 268435456,    # 256MB memory-mapped I/O
+    'cache_size': -16000,      # ~16MB page cache mỗi connection
+    'busy_timeout': 5000       # ms chờ lock trước khi báo "database is locked"
+}
+
+
+def uuid7() -> str:
+    """UUID version 7 (RFC 9562): 48-bit Unix ms timestamp + random, tăng dần theo thời gian"""
+    timestamp_ms = time.time_ns() // 1_000_000
+    rand_a = int.from_bytes(os.urandom(2), 'big') & 0xFFF
+    rand_b = int.from_bytes(os.urandom(8), 'big') & 0x3FFFFFFFFFFFFFFF
+    value = ((timestamp_ms & 0xFFFFFFFFFFFF) << 80) | (0x7 << 76) | (rand_a << 64) | (0b10 << 62) | rand_b
+    return str(uuid.UUID(int=value))
+
+
+class ConnectionPool:
+    """Pool connection SQLite theo thread - mỗi thread dùng lại một connection riêng"""
+    
+    def __init__(self, db_path: str, max_size: int = 16, timeout: float = 30.0,
+                 health_check_interval: int = 60, pragmas: Optional[Dict[str, Any]] = None):
+        self.db_path = db_path
+        self.pragmas = DEFAULT_PRAGMAS if pragmas is None else pragmas
+        self.max_size = max_size
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections: Dict[int, sqlite3.Connection] = {}  # thread ident -> connection
+        self._closed = False
+        self.trace_callback: Optional[Callable[[str], None]] = None  # dùng cho check_query_plans
+    
+    def _connect(self) -> sqlite3.Connection:
+        """Mở connection mới với cấu hình chuẩn"""
+        # check_same_thread=False để thread khác có thể đóng connection khi shutdown
+        conn = sqlite3.connect(self.db_path, timeout=self.timeout, check_same_thread=False)
+        conn.row_factory = sqlite3.Row  # enable dict-like access
+        for name, value in self.pragmas.items():
+            conn.execute(f"PRAGMA {name} = {value}")
+        if self.trace_callback is not None:
+            conn.set_trace_callback(self.trace_callback)
+        return conn
+    
+    @staticmethod
+    def _close_quietly(conn: sqlite3.Connection):
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+    
+    @staticmethod
+    def _is_healthy(conn: sqlite3.Connection) -> bool:
+        """Health check đơn giản: connection còn chạy được truy vấn không"""
+        try:
+            conn.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+    
+    def _prune_dead_threads(self):
+        """Đóng connection của các thread đã kết thúc (gọi khi đang giữ lock)"""
+        alive = {thread.ident for thread in threading.enumerate()}
+        for ident in [ident for ident in self._connections if ident not in alive]:
+            self._close_quietly(self._connections.pop(ident))
+    
+    def _discard_local(self):
+        """Bỏ connection hỏng của thread hiện tại"""
+        conn = getattr(self._local, 'conn', None)
+        self._local.conn = None
+        if conn is not None:
+            with self._lock:
+                if self._connections.get(threading.get_ident()) is conn:
+                    del self._connections[threading.get_ident()]
+            self._close_quietly(conn)
+    
+    def get(self) -> sqlite3.Connection:
+        """Lấy connection của thread hiện tại, tạo mới nếu chưa có hoặc đã hỏng"""
+        if self._closed:
+            raise sqlite3.ProgrammingError("Connection pool has been closed")
+        
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            now = time.monotonic()
+            if now - self._local.last_checked < self.health_check_interval:
+                return conn
+            if self._is_healthy(conn):
+                self._local.last_checked = now
+                return conn
+            print("[WARNING] Discarding unhealthy database connection")
+            self._discard_local()
+        
+        conn = self._connect()
+        ident = threading.get_ident()
+        with self._lock:
+            # ident có thể được tái sử dụng bởi thread mới
+            stale = self._connections.pop(ident, None)
+            if stale is not None:
+                self._close_quietly(stale)
+            if len(self._connections) >= self.max_size:
+                self._prune_dead_threads()
+            pooled = len(self._connections) < self.max_size
+            if pooled:
+                self._connections[ident] = conn
+        
+        if pooled:
+            self._local.conn = conn
+            self._local.last_checked = time.monotonic()
+        else:
+            # Pool đầy: trả về connection tạm, không giữ lại cho thread này
+            print(f"[WARNING] Connection pool full ({self.max_size}), using unpooled connection")
+        return conn
+    
+    def close_all(self):
+        """Đóng toàn bộ connection - dùng khi shutdown"""
+        with self._lock:
+            self._closed = True
+            connections = list(self._connections.values())
+            self._connections.clear()
+        for conn in connections:
+            self._close_quietly(conn)
+    
+    def get_status(self) -> Dict[str, Any]:
+        """Thống kê pool hiện tại"""
+        with self._lock:
+            return {
+                'size': len(self._connections),
+                'max_size': self.max_size,
+                'closed': self._closed
+            }
+
+
+class WriteQueue:
+    """Thread ghi duy nhất: tuần tự hóa mọi thao tác ghi và gộp chúng vào chung một commit"""
+    
+    def __init__(self, connect: Callable[[], sqlite3.Connection], max_batch: int = 64,
+                 max_wait: float = 0.0):
+        self._connect = connect
+        self.max_batch = max_batch
+        self.max_wait = max_wait  # thời gian chờ thêm thao tác để gộp batch (giây)
+        self._queue: "queue.Queue" = queue.Queue()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._closed = False
+        self.stats = {'batches': 0, 'writes': 0, 'errors': 0}
+        self._thread = threading.Thread(target=self._run, name='sqlite-writer', daemon=True)
+        self._thread.start()
+    
+    def submit(self, operation: Callable[[sqlite3.Connection], Any]) -> Any:
+        """Đưa thao tác ghi vào hàng đợi và chờ tới khi đã commit, trả về kết quả của thao tác"""
+        # Thao tác ghi lồng nhau chạy luôn trong transaction hiện tại
+        if threading.current_thread() is self._thread:
+            return operation(self._conn)
+        if self._closed:
+            raise sqlite3.ProgrammingError("Write queue has been closed")
+        
+        future = Future()
+        self._queue.put((operation, future))
+        return future.result()
+    
+    def _collect_batch(self, first) -> tuple:
+        """Gom các thao tác đang chờ thành một batch, trả về (batch, stop)"""
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    item = self._queue.get(timeout=remaining)
+                else:
+                    item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                return batch, True
+            batch.append(item)
+        return batch, False
+    
+    def _execute_batch(self, batch: List[tuple]):
+        """Chạy cả batch trong một transaction, mỗi thao tác có savepoint riêng"""
+        conn = self._conn
+        outcomes = []
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for operation, future in batch:
+                conn.execute("SAVEPOINT write_op")
+                try:
+                    outcomes.append((future, operation(conn), None))
+                    conn.execute("RELEASE write_op")
+                except Exception as e:
+                    # chỉ rollback thao tác lỗi, các thao tác khác trong batch vẫn được commit
+                    conn.execute("ROLLBACK TO write_op")
+                    conn.execute("RELEASE write_op")
+                    outcomes.append((future, None, e))
+            conn.execute("COMMIT")
+        except Exception as e:
+            print(f"[ERROR] Write batch failed: {e}")
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            self.stats['errors'] += len(batch)
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        
+        self.stats['batches'] += 1
+        self.stats['writes'] += len(batch)
+        for future, result, error in outcomes:
+            if error is not None:
+                self.stats['errors'] += 1
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+    
+    def _run(self):
+        self._conn = self._connect()
+        self._conn.isolation_level = None  # tự quản lý BEGIN/COMMIT
+        try:
+            while True:
+                item = self._queue.get()
+                if item is None:
+                    break
+                batch, stop = self._collect_batch(item)
+                self._execute_batch(batch)
+                if stop:
+                    break
+        finally:
+            self._conn.close()
+    
+    def close(self):
+        """Xử lý nốt các thao tác đang chờ rồi dừng thread ghi"""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join()
 
 
 class DatabaseManager:
-    def __init__(self, db_path: str = "chatbot.db"):
+    def __init__(self, db_path: str = "chatbot.db", pool_size: int = 16,
+                 connect_timeout: float = 30.0, health_check_interval: int = 60,
+                 pragmas: Optional[Dict[str, Any]] = None, write_batch_size: int = 64,
+                 write_batch_wait: float = 0.0,
+                 trace_callback: Optional[Callable[[str], None]] = None):
         self.db_path = db_path
+        self.pool = ConnectionPool(db_path, pool_size, connect_timeout, health_check_interval, pragmas)
+        self.pool.trace_callback = trace_callback
         self.init_database()
+        # Mọi thao tác ghi đi qua một connection/thread duy nhất
+        self.writer = WriteQueue(self.pool._connect, write_batch_size, write_batch_wait)
+        # gọi sau mỗi add_message với (conversation_id, message_count), vd. cập nhật summary
+        self.message_listeners: List[Callable[[str, int], None]] = []
     
     def get_connection(self):
-        """Get database connection with proper settings"""
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row  # enable dict-like access
-        return conn
+        """Get pooled connection of the current thread"""
+        return self.pool.get()
+    
+    def execute_write(self, operation: Callable[[sqlite3.Connection], Any]) -> Any:
+        """Run a write operation on the serialized writer connection"""
+        return self.writer.submit(operation)
+    
+    def close(self):
+        """Flush pending writes and close all connections"""
+        self.writer.close()
+        self.pool.close_all()
     
     def init_database(self):
-        """Initialize database tables"""
+        """Initialize database schema through versioned migrations"""
         with self.get_connection() as conn:
-            # Users table
-            conn.execute("""
-                CREATE TABLE IF NOT EXISTS users (
-                    id TEXT PRIMARY KEY,
-                    session_id TEXT UNIQUE,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    last_active TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    preferences TEXT DEFAULT '{}',
-                    deadlines TEXT DEFAULT '{}',
-                    schedule TEXT DEFAULT '{}'
-                )
-            """)
-            
-            # Conversations table
-            conn.execute("""
-                CREATE TABLE IF NOT EXISTS conversations (
-                    id TEXT PRIMARY KEY,
-                    user_id TEXT,
-                    title TEXT NOT NULL,
-                    ai_mode TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    is_active BOOLEAN DEFAULT 0,
-                    message_count INTEGER DEFAULT 0,
-                    FOREIGN KEY (user_id) REFERENCES users (id)
-                )
-            """)
-            
-            # Messages table
-            conn.execute("""
-                CREATE TABLE IF NOT EXISTS messages (
-                    id TEXT PRIMARY KEY,
-                    conversation_id TEXT,
-                    user_id TEXT,
-                    question TEXT NOT NULL,
-                    answer TEXT NOT NULL,
-                    ai_mode TEXT,
-                    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    metadata TEXT DEFAULT '{}',
-                    FOREIGN KEY (conversation_id) REFERENCES conversations (id),
-                    FOREIGN KEY (user_id) REFERENCES users (id)
-                )
-            """)
-            
-            # đánh index để speed up truy vấn
-            conn.execute("CREATE INDEX IF NOT EXISTS idx_conversations_user_id ON conversations (user_id)")
-            conn.execute("CREATE INDEX IF NOT EXISTS idx_conversations_updated_at ON conversations (updated_at)")
-            conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_conversation_id ON messages (conversation_id)")
-            conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_timestamp ON messages (timestamp)")
-            
-            conn.commit()
+            # WAL: reader không bị writer block (persistent, chỉ cần set một lần)
+            conn.execute("PRAGMA journal_mode = WAL")
+        apply_migrations(self.get_connection())
+        
+        with self.get_connection() as conn:
+            self.fts_enabled = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'messages_fts'"
+            ).fetchone() is not None
     
     def get_or_create_user(self, session_id: str) -> str:
         """Get existing user or create new one based on session"""
-        with self.get_connection() as conn:
+        def _write(conn):
             # tìm kiếm user theo session_id
             user = conn.execute(
                 "SELECT id FROM users WHERE session_id = ?", 
@@ -96,38 +317,39 @@ class DatabaseManager:
                        VALUES (?, ?, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)""",
                     (user_id, session_id)
                 )
-                conn.commit()
                 return user_id
+        
+        return self.execute_write(_write)
     
     def create_conversation(self, user_id: str, title: str, ai_mode: str = None) -> Dict:
         """Create new conversation"""
-        conversation_id = str(uuid.uuid4())
+        conversation_id = uuid7()  # time-ordered: index id chỉ append, không chèn ngẫu nhiên
         
-        with self.get_connection() as conn:
+        def _write(conn):
             # xóa tất cả hội thoại cũ của người dùng
             conn.execute(
                 "UPDATE conversations SET is_active = 0 WHERE user_id = ?",
                 (user_id,)
             )
-              # tạo cuộc hội thoại mới
+            # tạo cuộc hội thoại mới
             conn.execute(
                 """INSERT INTO conversations 
                    (id, user_id, title, ai_mode, created_at, updated_at, is_active, message_count)
                    VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP, 1, 0)""",
                 (conversation_id, user_id, title, ai_mode)
             )
-            conn.commit()
-            
-            return {
-                'id': conversation_id,
-                'title': title,
-                'ai_mode': ai_mode,
-                'created_at': datetime.now().isoformat(),
-                'updated_at': datetime.now().isoformat(),
-                'is_active': True,
-                'message_count': 0,
-                'messages': []
-            }
+        
+        self.execute_write(_write)
+        return {
+            'id': conversation_id,
+            'title': title,
+            'ai_mode': ai_mode,
+            'created_at': datetime.now().isoformat(),
+            'updated_at': datetime.now().isoformat(),
+            'is_active': True,
+            'message_count': 0,
+            'messages': []
+        }
     
     def get_conversations(self, user_id: str, limit: int = 50) -> List[Dict]:
         """Get user's conversations, correctly marking the active one"""
@@ -206,11 +428,182 @@ class DatabaseManager:
                 'messages': message_list
             }
             
+    def get_recent_messages(self, conversation_id: str, n: int = 5) -> List[Dict]:
+        """Get the last n messages of a conversation (oldest first) without loading the rest"""
+        with self.get_connection() as conn:
+            messages = conn.execute(
+                """SELECT id, question, answer, ai_mode, timestamp, metadata FROM messages 
+                   WHERE conversation_id = ? 
+                   ORDER BY timestamp DESC, seq DESC 
+                   LIMIT ?""",
+                (conversation_id, n)
+            ).fetchall()
+        
+        return [{
+            'id': msg['id'],
+            'question': msg['question'],
+            'answer': msg['answer'],
+            'ai_mode': msg['ai_mode'],
+            'timestamp': msg['timestamp'],
+            'metadata': json.loads(msg['metadata']) if msg['metadata'] else {}
+        } for msg in reversed(messages)]
+    
+    def get_messages_range(self, conversation_id: str, offset: int, limit: int) -> List[Dict]:
+        """Tin nhắn thứ offset .. offset + limit - 1 của hội thoại (cũ trước)"""
+        with self.get_connection() as conn:
+            messages = conn.execute(
+                """SELECT question, answer FROM messages
+                   WHERE conversation_id = ?
+                   ORDER BY timestamp, seq
+                   LIMIT ? OFFSET ?""",
+                (conversation_id, limit, offset)
+            ).fetchall()
+        return [dict(msg) for msg in messages]
+    
+    def get_conversation_summary(self, conversation_id: str) -> Optional[Dict]:
+        """Summary của hội thoại, số tin nhắn đã được tóm tắt và tổng số tin nhắn"""
+        with self.get_connection() as conn:
+            row = conn.execute(
+                "SELECT summary, summarized_count, message_count FROM conversations WHERE id = ?",
+                (conversation_id,)
+            ).fetchone()
+        return dict(row) if row else None
+    
+    def update_conversation_summary(self, conversation_id: str, summary: str, summarized_count: int) -> bool:
+        """Lưu summary mới (bỏ qua nếu đã có summary bao phủ nhiều tin nhắn hơn)"""
+        def _write(conn):
+            result = conn.execute(
+                """UPDATE conversations SET summary = ?, summarized_count = ?
+                   WHERE id = ? AND summarized_count < ?""",
+                (summary, summarized_count, conversation_id, summarized_count)
+            )
+            return result.rowcount > 0
+        
+        return self.execute_write(_write)
+    
+    @staticmethod
+    def _build_fts_query(query: str) -> str:
+        """Chuyển input người dùng thành FTS5 query an toàn: các từ AND với nhau, từ cuối tìm theo prefix"""
+        terms = re.findall(r'\w+', query.lower())
+        if not terms:
+            return ''
+        groups = []
+        for i, term in enumerate(terms):
+            suffix = '*' if i == len(terms) - 1 else ''
+            # remove_diacritics không đổi "đ" thành "d", nên "dao" cũng phải thử "đao"
+            variants = [term] + ([term.replace('d', 'đ')] if 'd' in term else [])
+            alternatives = ' OR '.join(f'"{variant}"{suffix}' for variant in variants)
+            groups.append(f'({alternatives})' if len(variants) > 1 else alternatives)
+        return ' AND '.join(groups)
+    
+    def search_messages(self, user_id: str, query: str, limit: int = 20) -> List[Dict]:
+        """Full-text search over the user's messages, best matches first with highlighted snippets"""
+        with self.get_connection() as conn:
+            if self.fts_enabled:
+                fts_query = self._build_fts_query(query)
+                if not fts_query:
+                    return []
+                rows = conn.execute(
+                    """SELECT m.id, m.conversation_id, c.title AS conversation_title, m.ai_mode, m.timestamp,
+                              snippet(messages_fts, 0, '<mark>', '</mark>', '…', 16) AS question_snippet,
+                              snippet(messages_fts, 1, '<mark>', '</mark>', '…', 32) AS answer_snippet,
+                              messages_fts.rank AS score
+                       FROM messages_fts
+                       JOIN messages m ON m.seq = messages_fts.rowid
+                       JOIN conversations c ON c.id = m.conversation_id
+                       WHERE messages_fts MATCH ? AND c.user_id = ?
+                       ORDER BY messages_fts.rank
+                       LIMIT ?""",
+                    (fts_query, user_id, limit)
+                ).fetchall()
+            else:
+                # SQLite không có FTS5: tìm chuỗi con, không xếp hạng
+                pattern = f"%{query}%"
+                rows = conn.execute(
+                    """SELECT m.id, m.conversation_id, c.title AS conversation_title, m.ai_mode, m.timestamp,
+                              substr(m.question, 1, 120) AS question_snippet,
+                              substr(m.answer, 1, 240) AS answer_snippet,
+                              0 AS score
+                       FROM conversations c
+                       JOIN messages m ON m.conversation_id = c.id
+                       WHERE c.user_id = ? AND (m.question LIKE ? OR m.answer LIKE ?)
+                       LIMIT ?""",
+                    (user_id, pattern, pattern, limit)
+                ).fetchall()
+        
+        return [{
+            'message_id': row['id'],
+            'conversation_id': row['conversation_id'],
+            'conversation_title': row['conversation_title'],
+            'ai_mode': row['ai_mode'],
+            'timestamp': row['timestamp'],
+            'question_snippet': row['question_snippet'],
+            'answer_snippet': row['answer_snippet'],
+            'score': row['score']
+        } for row in rows]
+    
+    def get_rated_answers(self, min_rating: int) -> List[Dict]:
+        """Các câu trả lời có metadata.rating >= min_rating (nguồn cho vector index, chạy offline)"""
+        with self.get_connection() as conn:
+            rows = conn.execute(
+                """SELECT id, question, answer, ai_mode FROM messages
+                   WHERE CAST(json_extract(metadata, '$.rating') AS INTEGER) >= ?""",
+                (min_rating,)
+            ).fetchall()
+        return [dict(row) for row in rows]
+    
+    def get_conversations_with_messages(self, user_id: str, limit: int = 50) -> Dict[str, Dict]:
+        """Get user's recent conversations with all their messages in one batched query"""
+        with self.get_connection() as conn:
+            rows = conn.execute(
+                """SELECT c.id AS conv_id, c.title, c.ai_mode AS conv_ai_mode, c.created_at,
+                          c.updated_at, c.is_active, c.message_count,
+                          m.id AS msg_id, m.question, m.answer, m.ai_mode AS msg_ai_mode,
+                          m.timestamp, m.metadata
+                   FROM (SELECT * FROM conversations
+                         WHERE user_id = ?
+                         ORDER BY updated_at DESC
+                         LIMIT ?) AS c
+                   LEFT JOIN messages m ON m.conversation_id = c.id""",
+                (user_id, limit)
+            ).fetchall()
+        
+        conversations = {}
+        for row in rows:
+            conv = conversations.get(row['conv_id'])
+            if conv is None:
+                conv = conversations[row['conv_id']] = {
+                    'id': row['conv_id'],
+                    'title': row['title'],
+                    'ai_mode': row['conv_ai_mode'],
+                    'created_at': row['created_at'],
+                    'updated_at': row['updated_at'],
+                    'is_current': bool(row['is_active']),
+                    'is_active': bool(row['is_active']),  # Đồng bộ cả 2 trường
+                    'message_count': row['message_count'],
+                    'messages': []
+                }
+            if row['msg_id'] is not None:
+                conv['messages'].append({
+                    'id': row['msg_id'],
+                    'question': row['question'],
+                    'answer': row['answer'],
+                    'ai_mode': row['msg_ai_mode'],
+                    'timestamp': row['timestamp'],
+                    'metadata': json.loads(row['metadata']) if row['metadata'] else {}
+                })
+        
+        # sắp xếp ở Python để tránh temp B-tree cho ORDER BY trên cả hai bảng
+        ordered = sorted(conversations.values(), key=lambda c: c['updated_at'] or '', reverse=True)
+        for conv in ordered:
+            conv['messages'].sort(key=lambda m: m['timestamp'] or '')
+        return {conv['id']: conv for conv in ordered}
+    
     def switch_conversation(self, conversation_id: str, user_id: str) -> Optional[Dict]:
         """Switch to different conversation"""
         print(f"[DEBUG] Database switch_conversation: {conversation_id} for user {user_id}")
         
-        with self.get_connection() as conn:
+        def _write(conn):
             check = conn.execute(
                 "SELECT id FROM conversations WHERE id = ? AND user_id = ?",
                 (conversation_id, user_id)
@@ -218,7 +611,7 @@ class DatabaseManager:
             
             if not check:
                 print(f"[ERROR] Conversation {conversation_id} not found for user {user_id}")
-                return None
+                return 0
             
             # Deactivate all conversations
             conn.execute(
@@ -233,22 +626,22 @@ class DatabaseManager:
             )
             
             print(f"[DEBUG] Switch updated {result.rowcount} rows")
-            
-            if result.rowcount == 0:
-                return None
-            
-            conn.commit()
-            conversation = self.get_conversation(conversation_id, user_id)
-            print(f"[DEBUG] Retrieved conversation: {conversation}")
-            return conversation
+            return result.rowcount
+        
+        if self.execute_write(_write) == 0:
+            return None
+        
+        conversation = self.get_conversation(conversation_id, user_id)
+        print(f"[DEBUG] Retrieved conversation: {conversation}")
+        return conversation
     
     def add_message(self, conversation_id: str, user_id: str, question: str, 
                    answer: str, ai_mode: str = None, metadata: Dict = None) -> Dict:
         """Add message to conversation"""
-        message_id = str(uuid.uuid4())
+        message_id = uuid7()
         metadata_json = json.dumps(metadata) if metadata else '{}'
         
-        with self.get_connection() as conn:
+        def _write(conn):
             # Insert message
             conn.execute(
                 """INSERT INTO messages 
@@ -266,21 +659,27 @@ class DatabaseManager:
                    WHERE id = ?""",
                 (ai_mode, conversation_id)
             )
-            
-            conn.commit()
-            
-            return {
-                'id': message_id,
-                'question': question,
-                'answer': answer,
-                'ai_mode': ai_mode,
-                'timestamp': datetime.now().isoformat(),
-                'metadata': metadata or {}
-            }
+            row = conn.execute("SELECT message_count FROM conversations WHERE id = ?", (conversation_id,)).fetchone()
+            return row['message_count'] if row else 0
+        
+        message_count = self.execute_write(_write)
+        for listener in self.message_listeners:
+            try:
+                listener(conversation_id, message_count)
+            except Exception as e:
+                print(f"[WARNING] Message listener failed: {e}")
+        return {
+            'id': message_id,
+            'question': question,
+            'answer': answer,
+            'ai_mode': ai_mode,
+            'timestamp': datetime.now().isoformat(),
+            'metadata': metadata or {}
+        }
     
     def delete_conversation(self, conversation_id: str, user_id: str) -> bool:
         """Delete conversation and its messages"""
-        with self.get_connection() as conn:
+        def _write(conn):
             # Delete messages first
             conn.execute(
                 "DELETE FROM messages WHERE conversation_id = ?",
@@ -292,27 +691,40 @@ class DatabaseManager:
                 "DELETE FROM conversations WHERE id = ? AND user_id = ?",
                 (conversation_id, user_id)
             )
-            
-            conn.commit()
             return result.rowcount > 0
+        
+        return self.execute_write(_write)
     
-    def get_current_conversation(self, user_id: str) -> Optional[Dict]:
-        """Get currently active conversation"""
+    def get_current_conversation(self, user_id: str, include_messages: bool = True) -> Optional[Dict]:
+        """Get currently active conversation (metadata only when include_messages=False)"""
         with self.get_connection() as conn:
             conv = conn.execute(
-                """SELECT id FROM conversations 
+                """SELECT * FROM conversations 
                    WHERE user_id = ? AND is_active = 1 
                    ORDER BY updated_at DESC LIMIT 1""",
                 (user_id,)
             ).fetchone()
             
-            if conv:
+            if not conv:
+                return None
+            if include_messages:
                 return self.get_conversation(conv['id'], user_id)
-            return None
+            return {
+                'id': conv['id'],
+                'title': conv['title'],
+                'ai_mode': conv['ai_mode'],
+                'created_at': conv['created_at'],
+                'updated_at': conv['updated_at'],
+                'is_current': True,
+                'is_active': True,
+                'message_count': conv['message_count'],
+                'summary': conv['summary'],
+                'summarized_count': conv['summarized_count']
+            }
     
     def cleanup_old_conversations(self, user_id: str, keep_count: int = 50):
         """Keep only recent conversations"""
-        with self.get_connection() as conn:
+        def _write(conn):
             # Get conversations to delete
             old_conversations = conn.execute(
                 """SELECT id FROM conversations 
@@ -324,6 +736,72 @@ class DatabaseManager:
             
             for conv in old_conversations:
                 self.delete_conversation(conv['id'], user_id)
+        
+        self.execute_write(_write)
+    
+    def get_calendar_sync_state(self, user_id: str) -> Optional[Dict]:
+        """syncToken và thời điểm đồng bộ gần nhất của bản sao lịch, None nếu chưa đồng bộ lần nào"""
+        with self.get_connection() as conn:
+            row = conn.execute(
+                "SELECT sync_token, synced_at FROM calendar_sync_state WHERE user_id = ?",
+                (user_id,)
+            ).fetchone()
+        return dict(row) if row else None
+    
+    def apply_calendar_sync(self, user_id: str, rows: List[Dict], deleted_ids: List[str],
+                            sync_token: Optional[str], full: bool = False):
+        """Ghi kết quả một lượt đồng bộ (full=True: thay toàn bộ sự kiện của user) cùng syncToken mới"""
+        def _write(conn):
+            if full:
+                conn.execute("DELETE FROM calendar_events WHERE user_id = ?", (user_id,))
+            self._upsert_calendar_rows(conn, user_id, rows)
+            conn.executemany(
+                "DELETE FROM calendar_events WHERE user_id = ? AND event_id = ?",
+                [(user_id, event_id) for event_id in deleted_ids]
+            )
+            conn.execute(
+                """INSERT INTO calendar_sync_state (user_id, sync_token, synced_at) VALUES (?, ?, ?)
+                   ON CONFLICT (user_id) DO UPDATE SET sync_token = excluded.sync_token, synced_at = excluded.synced_at""",
+                (user_id, sync_token, time.time())
+            )
+        
+        self.execute_write(_write)
+    
+    def upsert_calendar_events(self, user_id: str, rows: List[Dict]):
+        """Thêm/cập nhật sự kiện vào bản sao lịch (vd. sự kiện vừa tạo), không đổi syncToken"""
+        self.execute_write(lambda conn: self._upsert_calendar_rows(conn, user_id, rows))
+    
+    @staticmethod
+    def _upsert_calendar_rows(conn: sqlite3.Connection, user_id: str, rows: List[Dict]):
+        conn.executemany(
+            """INSERT OR REPLACE INTO calendar_events
+               (user_id, event_id, summary, start_at, end_at, all_day, transparent, is_deadline, event)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+            [(user_id, row['event_id'], row['summary'], row['start_at'], row['end_at'],
+              row['all_day'], row['transparent'], row['is_deadline'], row['event']) for row in rows]
+        )
+    
+    def get_calendar_events(self, user_id: str, start_at: str, end_at: str, limit: int = 50,
+                            deadlines_only: bool = False) -> List[Dict]:
+        """Sự kiện (resource JSON của Calendar API) giao với [start_at, end_at), theo thứ tự thời gian bắt đầu"""
+        with self.get_connection() as conn:
+            rows = conn.execute(
+                """SELECT event FROM calendar_events
+                   WHERE user_id = ? AND start_at < ? AND end_at > ? AND (? = 0 OR is_deadline = 1)
+                   ORDER BY start_at LIMIT ?""",
+                (user_id, end_at, start_at, int(deadlines_only), limit)
+            ).fetchall()
+        return [json.loads(row['event']) for row in rows]
+    
+    def get_calendar_busy(self, user_id: str, start_at: str, end_at: str) -> List[tuple]:
+        """Các khoảng (start_at, end_at) của sự kiện chiếm thời gian giao với [start_at, end_at)"""
+        with self.get_connection() as conn:
+            rows = conn.execute(
+                """SELECT start_at, end_at FROM calendar_events
+                   WHERE user_id = ? AND start_at < ? AND end_at > ? AND transparent = 0""",
+                (user_id, end_at, start_at)
+            ).fetchall()
+        return [(row['start_at'], row['end_at']) for row in rows]
     
     def get_user_data(self, user_id: str) -> Dict:
         """Get user's preferences, deadlines, schedule"""
@@ -343,31 +821,29 @@ class DatabaseManager:
     
     def update_user_data(self, user_id: str, data: Dict):
         """Update user's preferences, deadlines, schedule"""
-        with self.get_connection() as conn:
-            updates = []
-            params = []
-            
-            if 'preferences' in data:
-                updates.append("preferences = ?")
-                params.append(json.dumps(data['preferences']))
-            
-            if 'deadlines' in data:
-                updates.append("deadlines = ?")
-                params.append(json.dumps(data['deadlines']))
-            
-            if 'schedule' in data:
-                updates.append("schedule = ?")
-                params.append(json.dumps(data['schedule']))
-            
-            if updates:
-                params.append(user_id)
-                conn.execute(
-                    f"UPDATE users SET {', '.join(updates)}, last_active = CURRENT_TIMESTAMP WHERE id = ?",
-                    params
-                )
-                conn.commit()
-                return True
-            return False
+        updates = []
+        params = []
+        
+        if 'preferences' in data:
+            updates.append("preferences = ?")
+            params.append(json.dumps(data['preferences']))
+        
+        if 'deadlines' in data:
+            updates.append("deadlines = ?")
+            params.append(json.dumps(data['deadlines']))
+        
+        if 'schedule' in data:
+            updates.append("schedule = ?")
+            params.append(json.dumps(data['schedule']))
+        
+        if updates:
+            params.append(user_id)
+            self.execute_write(lambda conn: conn.execute(
+                f"UPDATE users SET {', '.join(updates)}, last_active = CURRENT_TIMESTAMP WHERE id = ?",
+                params
+            ))
+            return True
+        return False
     
     def export_all_data(self, user_id: str) -> Dict:
         """Export all user data for debugging/backup"""
@@ -509,14 +985,147 @@ class DatabaseManager:
         return html_content
 
 
+def _exercise_queries(db: DatabaseManager):
+    """Gọi lần lượt mọi method của DatabaseManager để thu thập các câu SQL thực tế"""
+    user_id = db.get_or_create_user('plan-check-session')
+    db.get_or_create_user('plan-check-session')
+    first = db.create_conversation(user_id, 'Plan check 1', 'math')
+    second = db.create_conversation(user_id, 'Plan check 2')
+    for i in range(3):
+        db.add_message(first['id'], user_id, f'question {i}', f'answer {i}', 'math', {'i': i})
+        db.add_message(second['id'], user_id, f'question {i}', f'answer {i}')
+    db.get_conversations(user_id)
+    db.get_conversation(first['id'], user_id)
+    db.get_recent_messages(first['id'], 2)
+    db.get_messages_range(first['id'], 1, 2)
+    db.get_conversation_summary(first['id'])
+    db.update_conversation_summary(first['id'], 'summary', 2)
+    db.get_conversations_with_messages(user_id)
+    db.search_messages(user_id, 'question answ')
+    db.switch_conversation(first['id'], user_id)
+    db.get_current_conversation(user_id)
+    db.get_current_conversation(user_id, include_messages=False)
+    db.update_user_data(user_id, {'preferences': {}, 'deadlines': {}, 'schedule': {}})
+    db.get_user_data(user_id)
+    db.export_all_data(user_id)
+    db.cleanup_old_conversations(user_id, keep_count=1)
+    db.delete_conversation(first['id'], user_id)
+    event_row = {'event_id': 'e1', 'summary': 'Plan check', 'start_at': '2025-01-01T02:00:00',
+                 'end_at': '2025-01-01T03:00:00', 'all_day': 0, 'transparent': 0, 'is_deadline': 0, 'event': '{}'}
+    db.apply_calendar_sync(user_id, [event_row], [], 'token-1', full=True)
+    db.apply_calendar_sync(user_id, [], ['e1'], 'token-2')
+    db.upsert_calendar_events(user_id, [event_row])
+    db.get_calendar_sync_state(user_id)
+    db.get_calendar_events(user_id, '2025-01-01T00:00:00', '2025-01-08T00:00:00')
+    db.get_calendar_events(user_id, '2025-01-01T00:00:00', '2025-01-08T00:00:00', deadlines_only=True)
+    db.get_calendar_busy(user_id, '2025-01-01T00:00:00', '2025-01-02T00:00:00')
+
+
+def check_query_plans() -> List[str]:
+    """
+    Run EXPLAIN QUERY PLAN on every statement DatabaseManager executes against a scratch database.
+    Returns the violations: full table scans or temp B-trees used for sorting/grouping.
+    """
+    import tempfile
+    
+    statements = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # chạy migration trước để không trace các câu lệnh của migration
+        DatabaseManager(os.path.join(tmp_dir, 'plan_check.db')).close()
+        db = DatabaseManager(os.path.join(tmp_dir, 'plan_check.db'), trace_callback=statements.append)
+        try:
+            _exercise_queries(db)
+        finally:
+            db.close()
+        
+        skip = ('PRAGMA', 'BEGIN', 'COMMIT', 'ROLLBACK', 'SAVEPOINT', 'RELEASE',
+                'CREATE', 'DROP', 'SELECT 1', '--')
+        conn = sqlite3.connect(os.path.join(tmp_dir, 'plan_check.db'))
+        try:
+            tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+            violations = []
+            for sql in dict.fromkeys(s.strip() for s in statements):
+                if not sql or sql.upper().startswith(skip):
+                    continue
+                for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}"):
+                    detail = row[3]
+                    scan = re.match(r'SCAN (\w+)', detail)
+                    # virtual table có INDEX là FTS5 MATCH, không phải full scan
+                    full_scan = scan and scan.group(1) in tables and 'VIRTUAL TABLE INDEX' not in detail
+                    if full_scan or 'TEMP B-TREE' in detail:
+                        violations.append(f"{detail}\n    in: {' '.join(sql.split())}")
+            return violations
+        finally:
+            conn.close()
+
+
+class AsyncDatabaseManager:
+    """
+    Async facade cho DatabaseManager (dùng trong các view async): mỗi method chạy qua asyncio.to_thread,
+    nên event loop không bị block bởi I/O SQLite; connection pool và write queue hoạt động như bản sync
+    """
+    
+    def __init__(self, db: DatabaseManager):
+        self._db = db
+    
+    def __getattr__(self, name):
+        attr = getattr(self._db, name)
+        if not callable(attr):
+            return attr
+        
+        @functools.wraps(attr)
+        async def call(*args, **kwargs):
+            return await asyncio.to_thread(attr, *args, **kwargs)
+        return call
+
+
 # Global database instance
 db_manager = None
+_db_lock = threading.Lock()
 
 def get_db():
     """Get database manager instance"""
     global db_manager
     if db_manager is None:
-        db_path = os.path.join(os.path.dirname(__file__), '..', 'data', 'chatbot.db')
-        os.makedirs(os.path.dirname(db_path), exist_ok=True)
-        db_manager = DatabaseManager(db_path)
+        with _db_lock:
+            if db_manager is None:
+                from config import Config
+                settings = Config.DATABASE_SETTINGS
+                db_path = os.path.join(os.path.dirname(__file__), '..', 'data', 'chatbot.db')
+                os.makedirs(os.path.dirname(db_path), exist_ok=True)
+                db_manager = DatabaseManager(
+                    db_path,
+                    pool_size=settings['pool_size'],
+                    connect_timeout=settings['connect_timeout'],
+                    health_check_interval=settings['health_check_interval'],
+                    pragmas=settings['pragmas'],
+                    write_batch_size=settings['write_batch_size'],
+                    write_batch_wait=settings['write_batch_wait']
+                )
+                atexit.register(close_db)
     return db_manager
+
+
+def get_async_db() -> AsyncDatabaseManager:
+    """Async database manager (cùng instance với get_db)"""
+    return AsyncDatabaseManager(get_db())
+
+
+def close_db():
+    """Close the global database instance (clean shutdown)"""
+    global db_manager
+    with _db_lock:
+        if db_manager is not None:
+            db_manager.close()
+            db_manager = None
+
+
+if __name__ == "__main__":
+    # python database.py --check-plans: kiểm tra query plan, exit code 1 nếu có vi phạm
+    import sys
+    if '--check-plans' in sys.argv:
+        violations = check_query_plans()
+        for violation in violations:
+            print(f"[PLAN] {violation}")
+        print(f"{len(violations)} query plan violation(s)")
+        sys.exit(1 if violations else 0)
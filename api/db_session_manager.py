@@ -1,6 +1,7 @@
 from flask import session
 from database import get_db
-from typing import Dict, List, Optional
+from collections.abc import MutableMapping
+from typing import Dict, List, Optional, Any, Callable
 import uuid
 
 
@@ -12,35 +13,80 @@ def get_user_id():
 
 
 
-def get_user_data() -> Dict:
+class LazyUserData(MutableMapping):
+    """User data view - chỉ truy vấn database khi key tương ứng thực sự được đọc"""
+    
+    def __init__(self, loaders: Dict[str, Callable[[], Any]]):
+        self._loaders = loaders
+        self._values: Dict[str, Any] = {}
+    
+    def __getitem__(self, key):
+        if key not in self._values:
+            if key not in self._loaders:
+                raise KeyError(key)
+            self._values[key] = self._loaders[key]()
+        return self._values[key]
+    
+    def __setitem__(self, key, value):
+        self._values[key] = value
+    
+    def __delitem__(self, key):
+        if key not in self._values and key not in self._loaders:
+            raise KeyError(key)
+        self._values.pop(key, None)
+        self._loaders.pop(key, None)
+    
+    def __iter__(self):
+        yield from self._loaders
+        yield from (key for key in self._values if key not in self._loaders)
+    
+    def __len__(self):
+        return len(set(self._loaders) | set(self._values))
+    
+    def is_loaded(self, key: str) -> bool:
+        """Key đã được materialize chưa (dùng để debug/đo đạc)"""
+        return key in self._values
+    
+    def __repr__(self):
+        loaded = {key: self._values[key] for key in self._values}
+        return f"LazyUserData(loaded={loaded}, pending={[k for k in self._loaders if k not in self._values]})"
+
+
+def _memoize(loader: Callable[[], Any]) -> Callable[[], Any]:
+    """Gọi loader tối đa một lần, dùng chung kết quả cho nhiều key"""
+    cache = []
+    def wrapper():
+        if not cache:
+            cache.append(loader())
+        return cache[0]
+    return wrapper
+
+
+def get_user_data() -> LazyUserData:
     """Get user data (preferences, deadlines, schedule) - compatible with old interface"""
     db = get_db()
     user_id = get_user_id()
     
-    # đảm bảo user tồn tại trong database - use user_id as session_id for compatibility
-    actual_user_id = db.get_or_create_user(user_id)
-    
-    # get user data
-    user_data = db.get_user_data(actual_user_id)
-      # lấy current conversation info for compatibility
-    current_conv = db.get_current_conversation(actual_user_id)
-    conversations = db.get_conversations(actual_user_id)
+    @_memoize
+    def load_profile():
+        # đảm bảo user tồn tại trong database - use user_id as session_id for compatibility
+        actual_user_id = db.get_or_create_user(user_id)
+        return db.get_user_data(actual_user_id)
     
-    # chuyển đổi to old format for compatibility
-    conversations_dict = {}
-    for conv in conversations:
-        conv_detail = db.get_conversation(conv['id'], user_id)
-        if conv_detail:
-            conversations_dict[conv['id']] = conv_detail
+    @_memoize
+    def load_current_conversation():
+        # chỉ lấy metadata, không load tin nhắn
+        return db.get_current_conversation(user_id, include_messages=False) or {}
     
-    return {
-        'deadlines': user_data.get('deadlines', {}),
-        'schedule': user_data.get('schedule', {}),
-        'preferences': user_data.get('preferences', {}),
-        'current_ai_mode': current_conv.get('ai_mode') if current_conv else None,
-        'conversations': conversations_dict,
-        'current_conversation_id': current_conv.get('id') if current_conv else None
-    }
+    return LazyUserData({
+        'deadlines': lambda: load_profile().get('deadlines', {}),
+        'schedule': lambda: load_profile().get('schedule', {}),
+        'preferences': lambda: load_profile().get('preferences', {}),
+        'current_ai_mode': lambda: load_current_conversation().get('ai_mode'),
+        # một truy vấn batched duy nhất, chỉ chạy khi thực sự cần tới conversations
+        'conversations': lambda: db.get_conversations_with_messages(user_id),
+        'current_conversation_id': lambda: load_current_conversation().get('id')
+    })
 
 
 def save_user_data(preferences: Dict = None, deadlines: Dict = None, schedule: Dict = None):
@@ -82,8 +128,8 @@ def add_message_to_conversation(question: str, answer: str, ai_mode: str = None,
     db = get_db()
     user_id = get_user_id()
     
-    # lấy hoặc tạo current conversation
-    current_conv = db.get_current_conversation(user_id)
+    # lấy hoặc tạo current conversation (chỉ metadata)
+    current_conv = db.get_current_conversation(user_id, include_messages=False)
     if not current_conv:
         # tạo new conversation nếu ko tồn tại
         title = question[:50] + "..." if len(question) > 50 else question
@@ -0,0 +1,236 @@
+"""
+Embedding service: gộp các request embedding đồng thời thành một API call, cache vector trên đĩa
+
+- EmbeddingStore: record (SHA-256 của nội dung text + vector float16) append-only trên đĩa,
+  nên re-index faq.json hay lịch sử messages không embedding lại text không đổi
+- EmbeddingService: thread batcher (max batch size, max wait) giống WriteQueue của database.py;
+  text đã có trong store được trả về ngay, không vào hàng đợi
+- Chỉ text của corpus (FAQ, messages khi build index) được ghi vào store; câu hỏi lúc query (semantic cache,
+  retrieval) chỉ nằm trong LRU trong bộ nhớ có giới hạn, nên store không lớn dần theo traffic
+"""
+import hashlib
+import json
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+
+def content_hash(text: str) -> bytes:
+    """Key của text trong store (SHA-256, 32 bytes)"""
+    return hashlib.sha256(text.encode('utf-8')).digest()
+
+
+class EmbeddingStore:
+    """
+    Store float16 append-only cho một embedding model: <model>.emb gồm các record (hash 32 bytes + vector),
+    <model>.json lưu dimension. Mỗi lần ghi là một write() O_APPEND nên nhiều worker ghi chung file được.
+    """
+
+    def __init__(self, directory: str, model: str):
+        os.makedirs(directory, exist_ok=True)
+        base = os.path.join(directory, model.replace('/', '_'))
+        self._records_path = f"{base}.emb"
+        self._meta_path = f"{base}.json"
+        self._lock = threading.Lock()
+        self._rows: Dict[bytes, int] = {}
+        self._mapped = None
+        self._dtype = None
+        self.dimension: Optional[int] = None
+
+        if os.path.exists(self._meta_path):
+            with open(self._meta_path, 'r') as f:
+                self._set_dimension(json.load(f)['dimension'])
+            self._load_new_records()
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def _set_dimension(self, dimension: int):
+        self.dimension = dimension
+        self._dtype = np.dtype([('key', 'u1', (32,)), ('vector', '<f2', (dimension,))])
+
+    def _load_new_records(self):
+        """Map lại file và index các record mới (kể cả do worker khác ghi), gọi khi đang giữ lock"""
+        if not os.path.exists(self._records_path):
+            return
+        # bỏ qua record ghi dở ở cuối file
+        count = os.path.getsize(self._records_path) // self._dtype.itemsize
+        if not count:
+            return
+        self._mapped = np.memmap(self._records_path, dtype=self._dtype, mode='r', shape=(count,))
+        for row in range(len(self._rows), count):
+            self._rows.setdefault(self._mapped[row]['key'].tobytes(), row)
+
+    def get_many(self, keys: List[bytes]) -> List[Optional[np.ndarray]]:
+        """Vector float32 cho từng key, None nếu chưa có"""
+        with self._lock:
+            if self.dimension is None:
+                return [None] * len(keys)
+            if any(key not in self._rows for key in keys):
+                self._load_new_records()
+            return [
+                np.asarray(self._mapped[self._rows[key]]['vector'], dtype=np.float32) if key in self._rows else None
+                for key in keys
+            ]
+
+    def put_many(self, keys: List[bytes], vectors: List[List[float]]):
+        """Ghi thêm các vector mới (bỏ qua key đã có)"""
+        with self._lock:
+            new = [(key, vector) for key, vector in zip(keys, vectors) if key not in self._rows]
+            if not new:
+                return
+            if self.dimension is None:
+                self._set_dimension(len(new[0][1]))
+                with open(self._meta_path, 'w') as f:
+                    json.dump({'dimension': self.dimension}, f)
+
+            records = np.zeros(len(new), dtype=self._dtype)
+            for i, (key, vector) in enumerate(new):
+                records[i]['key'] = np.frombuffer(key, dtype=np.uint8)
+                records[i]['vector'] = vector
+            with open(self._records_path, 'ab') as f:
+                f.write(records.tobytes())
+            self._load_new_records()
+
+
+class EmbeddingService:
+    """Batcher cho embedding API: request từ nhiều thread được gộp thành một call"""
+
+    def __init__(self, embed_fn: Callable[[List[str]], List[List[float]]], store: EmbeddingStore,
+                 max_batch: int = 64, max_wait: float = 0.01, query_cache_size: int = 4096):
+        self._embed_fn = embed_fn
+        self.store = store
+        self.max_batch = max_batch
+        self.max_wait = max_wait  # thời gian chờ thêm request để gộp batch (giây)
+        self.query_cache_size = query_cache_size
+        self._queue: "queue.Queue" = queue.Queue()
+        self._recent: "OrderedDict[bytes, np.ndarray]" = OrderedDict()  # LRU cho vector không ghi vào store
+        self.stats = {'requests': 0, 'store_hits': 0, 'query_cache_hits': 0, 'api_calls': 0, 'embedded': 0, 'errors': 0}
+        self._stats_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name='embedding-batcher', daemon=True)
+        self._thread.start()
+
+    def embed(self, texts: List[str], persist: bool = True) -> List[np.ndarray]:
+        """
+        Vector float32 cho từng text (cùng thứ tự), raise nếu embedding API lỗi.
+        persist=False: vector mới chỉ giữ trong LRU trong bộ nhớ, không ghi vào store
+        """
+        keys = [content_hash(text) for text in texts]
+        vectors = self.store.get_many(keys)
+        store_hits = sum(vector is not None for vector in vectors)
+
+        cache_hits = 0
+        with self._stats_lock:
+            for i, key in enumerate(keys):
+                if vectors[i] is None and key in self._recent:
+                    self._recent.move_to_end(key)
+                    vectors[i] = self._recent[key]
+                    cache_hits += 1
+
+        pending = {}
+        for i, (key, vector) in enumerate(zip(keys, vectors)):
+            if vector is None and key not in pending:
+                future = Future()
+                self._queue.put((texts[i], key, future, persist))
+                pending[key] = future
+        with self._stats_lock:
+            self.stats['requests'] += len(texts)
+            self.stats['store_hits'] += store_hits
+            self.stats['query_cache_hits'] += cache_hits
+
+        for i, key in enumerate(keys):
+            if vectors[i] is None:
+                vectors[i] = pending[key].result()
+        return vectors
+
+    def embed_one(self, text: str) -> np.ndarray:
+        return self.embed([text])[0]
+
+    def embed_query(self, text: str) -> np.ndarray:
+        """Embedding câu hỏi lúc query (semantic cache, retrieval): không ghi vào store"""
+        return self.embed([text], persist=False)[0]
+
+    def _collect_batch(self, first) -> list:
+        """Gom các request đang chờ (tối đa max_batch, chờ thêm tối đa max_wait)"""
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _execute_batch(self, batch: list):
+        # nhiều thread có thể cùng chờ một text: chỉ embedding mỗi text một lần
+        futures: Dict[bytes, List[Future]] = {}
+        texts: Dict[bytes, str] = {}
+        persisted = set()
+        for text, key, future, persist in batch:
+            futures.setdefault(key, []).append(future)
+            texts[key] = text
+            if persist:
+                persisted.add(key)
+        keys = list(texts)
+
+        try:
+            vectors = self._embed_fn([texts[key] for key in keys])
+            stored = [(key, vector) for key, vector in zip(keys, vectors) if key in persisted]
+            if stored:
+                self.store.put_many([key for key, _ in stored], [vector for _, vector in stored])
+        except Exception as e:
+            print(f"[ERROR] Embedding batch of {len(keys)} failed: {e}")
+            with self._stats_lock:
+                self.stats['errors'] += len(keys)
+            for waiting in futures.values():
+                for future in waiting:
+                    future.set_exception(e)
+            return
+
+        results = [np.asarray(vector, dtype=np.float16).astype(np.float32) for vector in vectors]
+        with self._stats_lock:
+            self.stats['api_calls'] += 1
+            self.stats['embedded'] += len(keys)
+            for key, result in zip(keys, results):
+                if key not in persisted:
+                    self._recent[key] = result
+                    self._recent.move_to_end(key)
+            while len(self._recent) > self.query_cache_size:
+                self._recent.popitem(last=False)
+        for key, result in zip(keys, results):
+            for future in futures[key]:
+                future.set_result(result)
+
+    def _run(self):
+        while True:
+            self._execute_batch(self._collect_batch(self._queue.get()))
+
+
+_embedding_service = None
+_embedding_lock = threading.Lock()
+
+
+def get_embedding_service() -> EmbeddingService:
+    """Embedding service dùng chung cho embedding model đang cấu hình"""
+    global _embedding_service
+    if _embedding_service is None:
+        with _embedding_lock:
+            if _embedding_service is None:
+                from config import Config
+                from openai_manager import openai_manager
+                settings = Config.EMBEDDING_SETTINGS
+                _embedding_service = EmbeddingService(
+                    openai_manager.embed_texts,
+                    EmbeddingStore(settings['cache_dir'], openai_manager.embedding_model),
+                    max_batch=settings['max_batch_size'],
+                    max_wait=settings['max_wait'],
+                    query_cache_size=settings['query_cache_size']
+                )
+    return _embedding_service
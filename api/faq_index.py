@@ -0,0 +1,138 @@
+"""
+FAQ retrieval: trả lời trực tiếp từ data/faq.json khi câu hỏi khớp đủ chắc chắn, không cần gọi OpenAI
+
+Câu hỏi trong FAQ được tokenize (chuẩn hóa tiếng Việt, bỏ dấu, âm tiết + bigram) và index bằng BM25
+trong ma trận NumPy. Độ tin cậy là F1 giữa phần trọng số IDF của câu hỏi người dùng được FAQ bao phủ
+và phần của câu hỏi FAQ được câu hỏi người dùng bao phủ, nên câu hỏi ngắn/chung chung ("python")
+không khớp nhầm với một FAQ cụ thể.
+"""
+import json
+import os
+import re
+import threading
+import time
+import unicodedata
+from typing import Dict, List, Optional
+
+import numpy as np
+
+FAQ_PATH = os.path.join(os.path.dirname(__file__), '..', 'data', 'faq.json')
+
+# Hư từ không mang nội dung (sau khi bỏ dấu)
+STOPWORDS = {
+    'la', 'gi', 'cua', 'va', 'cho', 'minh', 'toi', 'ban', 'em', 'a', 'nhi', 'vay', 'ha',
+    'hay', 'oi', 'voi', 'nhung', 'cac', 'mot', 'thi', 'ma', 'nhe', 'giup', 'xin', 'hoi'
+}
+
+
+def normalize_vietnamese(text: str) -> str:
+    """Chữ thường, bỏ dấu tiếng Việt (kể cả đ -> d) để câu gõ không dấu vẫn khớp"""
+    text = unicodedata.normalize('NFD', text.lower())
+    text = ''.join(ch for ch in text if unicodedata.category(ch) != 'Mn')
+    return text.replace('đ', 'd')
+
+
+def tokenize(text: str) -> List[str]:
+    """Âm tiết (bỏ hư từ) + bigram âm tiết liền kề, vì từ tiếng Việt thường gồm nhiều âm tiết"""
+    syllables = [s for s in re.findall(r'\w+', normalize_vietnamese(text)) if s not in STOPWORDS]
+    return syllables + [f"{a}_{b}" for a, b in zip(syllables, syllables[1:])]
+
+
+class FAQIndex:
+    """BM25 index cho các câu hỏi FAQ"""
+
+    def __init__(self, entries: List[Dict[str, str]], k1: float = 1.2, b: float = 0.75):
+        self.entries = entries
+        docs = [tokenize(entry['question']) for entry in entries]
+
+        self.vocabulary: Dict[str, int] = {}
+        for tokens in docs:
+            for token in tokens:
+                self.vocabulary.setdefault(token, len(self.vocabulary))
+
+        term_freq = np.zeros((len(docs), len(self.vocabulary)), dtype=np.float32)
+        for i, tokens in enumerate(docs):
+            for token in tokens:
+                term_freq[i, self.vocabulary[token]] += 1
+
+        doc_freq = (term_freq > 0).sum(axis=0)
+        self.idf = np.log(1 + (len(docs) - doc_freq + 0.5) / (doc_freq + 0.5)).astype(np.float32)
+        doc_len = term_freq.sum(axis=1, keepdims=True)
+        length_norm = k1 * (1 - b + b * doc_len / max(doc_len.mean(), 1))
+        # trọng số BM25 của từng (FAQ, term): điểm của query = tổng các cột ứng với term của query
+        self.weights = self.idf * term_freq * (k1 + 1) / (term_freq + length_norm)
+        self.present = term_freq > 0
+        # tổng IDF của các term trong mỗi câu hỏi FAQ (mẫu số của độ bao phủ phía FAQ)
+        self.doc_idf_mass = (self.present * self.idf).sum(axis=1)
+
+    @classmethod
+    def load(cls, path: str = FAQ_PATH) -> 'FAQIndex':
+        """Đọc faq.json và build index"""
+        with open(path, 'r', encoding='utf-8') as f:
+            entries = [e for e in json.load(f) if e.get('question') and e.get('answer')]
+        return cls(entries)
+
+    def search(self, query: str, top_k: int = 3) -> List[Dict]:
+        """Top-k FAQ theo BM25, kèm độ tin cậy (0-1)"""
+        tokens = set(tokenize(query))
+        term_ids = [self.vocabulary[t] for t in tokens if t in self.vocabulary]
+        if not term_ids:
+            return []
+
+        scores = self.weights[:, term_ids].sum(axis=1)
+        top = np.argsort(-scores)[:top_k]
+
+        # term ngoài vocabulary tính như term hiếm nhất
+        max_idf = float(self.idf.max())
+        query_idf_mass = sum(float(self.idf[self.vocabulary[t]]) if t in self.vocabulary else max_idf for t in tokens)
+        term_idf = self.idf[term_ids]
+
+        results = []
+        for i in top:
+            if scores[i] <= 0:
+                break
+            matched = float((self.present[i, term_ids] * term_idf).sum())
+            query_coverage = matched / query_idf_mass
+            doc_coverage = matched / float(self.doc_idf_mass[i])
+            confidence = 2 * query_coverage * doc_coverage / (query_coverage + doc_coverage)
+            results.append({
+                'question': self.entries[i]['question'],
+                'answer': self.entries[i]['answer'],
+                'score': float(scores[i]),
+                'confidence': round(confidence, 4)
+            })
+        return results
+
+    def answer(self, query: str, threshold: float = 0.75) -> Optional[Dict]:
+        """Câu trả lời FAQ nếu kết quả tốt nhất đạt ngưỡng tin cậy, kèm các FAQ liên quan làm gợi ý"""
+        results = self.search(query)
+        if not results or results[0]['confidence'] < threshold:
+            return None
+        best = results[0]
+        return {
+            'answer': best['answer'],
+            'question': best['question'],
+            'confidence': best['confidence'],
+            'related': [r['question'] for r in results[1:]]
+        }
+
+
+_faq_index = None
+_faq_lock = threading.Lock()
+
+
+def get_faq_index() -> Optional[FAQIndex]:
+    """FAQ index dùng chung (build một lần), None nếu không đọc được faq.json"""
+    global _faq_index
+    if _faq_index is None:
+        with _faq_lock:
+            if _faq_index is None:
+                try:
+                    start = time.time()
+                    _faq_index = FAQIndex.load()
+                    print(f"[INFO] FAQ index built: {len(_faq_index.entries)} entries, "
+                          f"{len(_faq_index.vocabulary)} terms in {(time.time() - start) * 1000:.1f} ms")
+                except (OSError, ValueError) as e:
+                    print(f"[WARNING] FAQ index unavailable: {e}")
+                    return None
+    return _faq_index
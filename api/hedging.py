@@ -0,0 +1,108 @@
+"""
+Hedged request cho chat completion: model chính chưa trả lời sau ngưỡng p95 latency của nó
+-> gửi thêm request tới model kế tiếp trong FALLBACK_CHAIN, response về trước được dùng
+
+- LatencyStats: latency và tỉ lệ lỗi gần đây của từng model (chỉ thời gian gọi API, không tính thời gian
+  chờ rate limit), dùng cả cho routing trong get_model_for_task
+- HedgeBudget: giới hạn tỉ lệ request được hedge và chi phí của request thừa (bên thua) trong một giờ,
+  để giảm tail latency mà không nhân đôi chi phí khi cả model đều chậm
+- Chỉ dùng ở đường async (OpenAIModelManager._acreate_hedged), nơi request thua bị huỷ thật; request sync
+  không huỷ được và stream chưa được hedge
+"""
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, Optional, Tuple
+
+
+class LatencyStats:
+    """Cửa sổ window latency (giây) và kết quả (thành công/lỗi) gần nhất của từng model"""
+
+    def __init__(self, window: int = 200):
+        self.window = window
+        self._lock = threading.Lock()
+        self._samples: Dict[str, Deque[float]] = {}
+        self._outcomes: Dict[str, Deque[bool]] = {}
+
+    def record(self, model: str, seconds: float):
+        with self._lock:
+            self._samples.setdefault(model, deque(maxlen=self.window)).append(seconds)
+            self._outcomes.setdefault(model, deque(maxlen=self.window)).append(True)
+
+    def record_error(self, model: str):
+        with self._lock:
+            self._outcomes.setdefault(model, deque(maxlen=self.window)).append(False)
+
+    def error_rate(self, model: str) -> float:
+        """Tỉ lệ request lỗi trong cửa sổ gần nhất (0 nếu chưa có request)"""
+        with self._lock:
+            outcomes = self._outcomes.get(model)
+            return outcomes.count(False) / len(outcomes) if outcomes else 0.0
+
+    def percentile(self, model: str, q: float, min_samples: int = 1) -> Optional[float]:
+        """Phân vị q (0..1) của latency, None nếu chưa đủ min_samples mẫu"""
+        with self._lock:
+            samples = sorted(self._samples.get(model, ()))
+        if len(samples) < max(1, min_samples):
+            return None
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+    def get_stats(self) -> Dict[str, Dict]:
+        with self._lock:
+            models = {model: sorted(samples) for model, samples in self._samples.items()}
+        return {
+            model: {
+                'samples': len(samples),
+                'p50': round(samples[len(samples) // 2], 3),
+                'p95': round(samples[min(len(samples) - 1, int(0.95 * len(samples)))], 3),
+                'error_rate': round(self.error_rate(model), 3)
+            }
+            for model, samples in models.items() if samples
+        }
+
+
+class HedgeBudget:
+    """Cho phép hedge khi tỉ lệ request đã hedge < max_ratio và chi phí thừa trong giờ qua < cost_cap_per_hour"""
+
+    def __init__(self, max_ratio: float = 0.1, cost_cap_per_hour: float = 0.5):
+        self.max_ratio = max_ratio
+        self.cost_cap_per_hour = cost_cap_per_hour
+        self._lock = threading.Lock()
+        self._costs: Deque[Tuple[float, float]] = deque()  # (thời điểm, chi phí bên thua)
+        self.stats = {'requests': 0, 'hedged': 0, 'hedge_wins': 0, 'denied': 0, 'wasted_cost': 0.0}
+
+    def _spent(self, now: float) -> float:
+        while self._costs and now - self._costs[0][0] > 3600:
+            self._costs.popleft()
+        return sum(cost for _, cost in self._costs)
+
+    def record_request(self):
+        with self._lock:
+            self.stats['requests'] += 1
+
+    def try_acquire(self) -> bool:
+        """Xin phép gửi một request hedge"""
+        with self._lock:
+            allowed = (
+                self.stats['hedged'] < self.max_ratio * self.stats['requests']
+                and self._spent(time.time()) < self.cost_cap_per_hour
+            )
+            self.stats['hedged' if allowed else 'denied'] += 1
+            return allowed
+
+    def record_win(self):
+        with self._lock:
+            self.stats['hedge_wins'] += 1
+
+    def charge(self, cost: float):
+        """Ghi chi phí của request thua (bị huỷ hoặc bỏ kết quả)"""
+        if cost <= 0:
+            return
+        with self._lock:
+            self._costs.append((time.time(), cost))
+            self.stats['wasted_cost'] += cost
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            return dict(self.stats, wasted_cost=round(self.stats['wasted_cost'], 6),
+                        cost_last_hour=round(self._spent(time.time()), 6))
@@ -0,0 +1,257 @@
+"""
+Intent classifier cục bộ: multinomial naive Bayes (NumPy) trên n-gram ký tự của câu đã bỏ dấu
+
+Phân loại tin nhắn thành greeting / calendar / deadline / question trong vài chục micro giây. Chat handler
+dùng nó để bỏ qua CalendarAIParser (một lượt gọi gpt-4o-mini) cho các câu chỉ tình cờ chứa từ khóa lịch
+("lịch sử", "kế hoạch ôn thi"...); các trường hợp không chắc chắn vẫn chuyển cho LLM như trước.
+Lời chào và môn học vẫn do intent_router định tuyến bằng từ khóa (không tốn lượt gọi LLM nào).
+
+Dữ liệu train: SEED_EXAMPLES + câu hỏi FAQ (question) + (tuỳ chọn) messages đã log, gán nhãn theo ai_mode
+của câu trả lời. Train và lưu model (trong thư mục api):
+    python intent_classifier.py --train [--include-messages]
+    python intent_classifier.py --evaluate [--include-messages]
+Nếu chưa có models/intent_classifier.npz, model được train lúc khởi động từ seed + FAQ.
+"""
+import json
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from faq_index import FAQ_PATH, normalize_vietnamese
+
+MODELS_DIR = os.path.join(os.path.dirname(__file__), '..', 'models')
+MODEL_PATH = os.path.join(MODELS_DIR, 'intent_classifier.npz')
+
+LABELS = ['greeting', 'calendar', 'deadline', 'question']
+
+# Ví dụ có nhãn, gồm cả các câu hỏi học tập chứa từ khóa lịch để model học được ranh giới
+SEED_EXAMPLES: List[Tuple[str, str]] = [
+    ('xin chào', 'greeting'), ('chào bạn', 'greeting'), ('hello', 'greeting'), ('hi', 'greeting'),
+    ('chào buổi sáng', 'greeting'), ('hello bot', 'greeting'), ('hi bạn ơi', 'greeting'),
+    ('xin chào trợ lý', 'greeting'), ('chào', 'greeting'), ('alo', 'greeting'),
+
+    ('tạo lịch học toán lúc 9h sáng mai', 'calendar'),
+    ('đặt lịch họp nhóm thứ 5 lúc 14h', 'calendar'),
+    ('thêm lịch học lý thầy trinh 8h ngày 03/06/2025', 'calendar'),
+    ('lên lịch ôn thi tiếng anh tối nay 20h', 'calendar'),
+    ('xem lịch hôm nay', 'calendar'), ('lịch tuần này của tôi', 'calendar'),
+    ('hiện các sự kiện ngày mai', 'calendar'), ('xóa lịch họp chiều nay', 'calendar'),
+    ('hủy cuộc hẹn với thầy lúc 3h', 'calendar'), ('nhắc nhở tôi họp lúc 10h', 'calendar'),
+    ('schedule a meeting tomorrow at 9am', 'calendar'), ('create an event on friday', 'calendar'),
+    ('tôi muốn đặt lịch học toán vào tối t7 20h', 'calendar'),
+    ('đổi lịch học hóa sang thứ 6', 'calendar'), ('có cuộc họp nào ngày mai không', 'calendar'),
+    ('ngày mai tôi có lịch gì', 'calendar'), ('hiện lịch học tuần sau', 'calendar'),
+    ('đặt hẹn gặp thầy hướng dẫn chiều thứ 3', 'calendar'), ('tạo sự kiện sinh nhật lớp ngày 12/10', 'calendar'),
+    ('show my events this week', 'calendar'), ('add a meeting with team at 3pm', 'calendar'),
+    ('book an appointment next monday 10am', 'calendar'), ('cancel the meeting tomorrow', 'calendar'),
+    ('nhắc tôi đi học lúc 7h sáng', 'calendar'), ('dời cuộc họp sang 16h', 'calendar'),
+
+    ('thêm deadline báo cáo ngày 15/12', 'deadline'), ('deadline đồ án môn AI thứ 6', 'deadline'),
+    ('đặt deadline nộp bài tập toán ngày mai', 'deadline'), ('xóa deadline môn lý', 'deadline'),
+    ('deadline', 'deadline'), ('hạn nộp tiểu luận là ngày 20/11', 'deadline'),
+    ('tạo deadline luận văn cuối tháng', 'deadline'), ('nhắc tôi hạn chót nộp bài 23h59', 'deadline'),
+    ('add deadline for project report', 'deadline'), ('còn bao nhiêu deadline', 'deadline'),
+    ('deadline bài tập lớn cơ sở dữ liệu tuần sau', 'deadline'), ('hạn nộp báo cáo thực tập ngày 30', 'deadline'),
+
+    ('lịch sử việt nam thời nguyễn', 'question'), ('giải thích lịch sử chiến tranh thế giới', 'question'),
+    ('làm sao lập kế hoạch ôn thi hiệu quả', 'question'), ('cách quản lý thời gian khi học', 'question'),
+    ('mẹo học tập hiệu quả', 'question'), ('giải thích đạo hàm', 'question'),
+    ('công thức tính vận tốc', 'question'), ('decision tree là gì', 'question'),
+    ('viết code python đệ quy', 'question'), ('tôi muốn biết về tiểu sử hồ chí minh', 'question'),
+    ('kỹ thuật pomodoro là gì', 'question'), ('lịch âm và lịch dương khác nhau thế nào', 'question'),
+    ('sự kiện lịch sử năm 1945', 'question'), ('event loop trong javascript là gì', 'question'),
+    ('chi tiết hơn đi', 'question'), ('ví dụ thử một công thức', 'question'),
+    ('schedule của thuật toán round robin', 'question'), ('nhắc lại định lý pythagore', 'question'),
+    # câu hỏi học tập có từ khóa lịch / kế hoạch / thời gian: không phải yêu cầu tạo hay xem lịch
+    ('kế hoạch ôn thi lịch sử', 'question'), ('lập kế hoạch ôn thi môn toán', 'question'),
+    ('kế hoạch học tiếng anh trong 3 tháng', 'question'), ('gợi ý lịch học hợp lý cho sinh viên', 'question'),
+    ('ôn tập lịch sử lớp 12 thế nào', 'question'), ('lịch sử đảng cộng sản việt nam', 'question'),
+    ('nên học lịch sử theo cách nào để nhớ lâu', 'question'), ('sự kiện lịch sử quan trọng năm 1975', 'question'),
+    ('thời gian biểu học tập hiệu quả', 'question'), ('làm sao để không trễ deadline', 'question'),
+    ('cách chia thời gian ôn thi cuối kỳ', 'question'), ('lịch sử hình thành của internet', 'question'),
+]
+
+
+def _ngrams(text: str, sizes: Tuple[int, ...] = (2, 3, 4)) -> List[str]:
+    """N-gram ký tự của câu đã chuẩn hóa (bỏ dấu, thêm khoảng trắng hai đầu để có n-gram đầu/cuối từ)"""
+    text = f" {' '.join(normalize_vietnamese(text).split())} "
+    return [text[i:i + n] for n in sizes for i in range(len(text) - n + 1)]
+
+
+class IntentClassifier:
+    """
+    Multinomial naive Bayes trên n-gram ký tự, các nhãn có trọng số cân bằng (FAQ chiếm đa số dữ liệu)
+
+    Log-likelihood được lấy trung bình theo số n-gram rồi nhân với sharpness: NB cộng dồn hàng trăm
+    n-gram không độc lập nên xác suất thô gần như luôn là 0/1, không dùng làm ngưỡng tin cậy được.
+    """
+
+    def __init__(self, vocabulary: Dict[str, int], log_likelihood, labels: List[str] = LABELS,
+                 sharpness: float = 8.0):
+        self.vocabulary = vocabulary
+        self.log_likelihood = log_likelihood    # (n_features, n_labels)
+        self.labels = labels
+        self.sharpness = sharpness
+
+    @classmethod
+    def train(cls, examples: List[Tuple[str, str]], alpha: float = 0.5) -> 'IntentClassifier':
+        """Train từ các cặp (câu, nhãn), alpha là Laplace smoothing"""
+        vocabulary: Dict[str, int] = {}
+        docs = []
+        for text, _ in examples:
+            docs.append([vocabulary.setdefault(gram, len(vocabulary)) for gram in _ngrams(text)])
+
+        label_ids = np.array([LABELS.index(label) for _, label in examples])
+        class_counts = np.bincount(label_ids, minlength=len(LABELS)).astype(np.float64)
+        # mỗi nhãn có tổng trọng số như nhau, nên prior là đều
+        weights = len(examples) / (len(LABELS) * np.maximum(class_counts, 1))
+
+        counts = np.zeros((len(vocabulary), len(LABELS)), dtype=np.float64)
+        for doc, label in zip(docs, label_ids):
+            np.add.at(counts[:, label], doc, weights[label])
+
+        smoothed = counts + alpha
+        log_likelihood = np.log(smoothed / smoothed.sum(axis=0))
+        return cls(vocabulary, log_likelihood.astype(np.float32))
+
+    def predict_proba(self, text: str) -> np.ndarray:
+        """Xác suất của từng nhãn (n-gram chưa gặp khi train bị bỏ qua)"""
+        ids = [self.vocabulary[gram] for gram in _ngrams(text) if gram in self.vocabulary]
+        if not ids:
+            return np.full(len(self.labels), 1 / len(self.labels))
+        scores = self.log_likelihood[ids].mean(axis=0) * self.sharpness
+        scores = np.exp(scores - scores.max())
+        return scores / scores.sum()
+
+    def predict(self, text: str) -> Tuple[str, float]:
+        """(nhãn, độ tin cậy)"""
+        proba = self.predict_proba(text)
+        best = int(np.argmax(proba))
+        return self.labels[best], float(proba[best])
+
+    def save(self, path: str = MODEL_PATH):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        grams = sorted(self.vocabulary, key=self.vocabulary.get)
+        np.savez(path, grams=np.array(grams), log_likelihood=self.log_likelihood,
+                 labels=np.array(self.labels), sharpness=self.sharpness)
+
+    @classmethod
+    def load(cls, path: str = MODEL_PATH) -> 'IntentClassifier':
+        with np.load(path) as data:
+            vocabulary = {str(gram): i for i, gram in enumerate(data['grams'])}
+            return cls(vocabulary, data['log_likelihood'], [str(l) for l in data['labels']], float(data['sharpness']))
+
+
+def _label_from_log(question: str, ai_mode: Optional[str]) -> Optional[str]:
+    """Nhãn của một message đã log, suy từ ai_mode của câu trả lời (None nếu không suy được)"""
+    from intent_router import route
+
+    routed = route(question)
+    if ai_mode is None:
+        # route_command không ghi ai_mode: lời chào và các lệnh deadline/lịch
+        return {'greeting': 'greeting', 'deadline_command': 'deadline',
+                'calendar_command': 'calendar'}.get(routed.intent)
+    if ai_mode.startswith('calendar'):
+        return 'deadline' if 'deadline' in routed.tags else 'calendar'
+    return 'question'
+
+
+def training_examples(include_messages: bool = False) -> List[Tuple[str, str]]:
+    """Seed + câu hỏi FAQ, và (tuỳ chọn) messages đã log có nhãn suy được"""
+    examples = list(SEED_EXAMPLES)
+    if os.path.exists(FAQ_PATH):
+        with open(FAQ_PATH, 'r', encoding='utf-8') as f:
+            examples.extend((e['question'], 'question') for e in json.load(f) if e.get('question'))
+
+    if include_messages:
+        from database import get_db
+        rows = get_db().get_connection().execute("SELECT question, ai_mode FROM messages").fetchall()
+        for question, ai_mode in rows:
+            label = _label_from_log(question, ai_mode)
+            if label is not None:
+                examples.append((question, label))
+    return examples
+
+
+_classifier = None
+_classifier_lock = threading.Lock()
+
+
+def get_intent_classifier() -> Optional[IntentClassifier]:
+    """Classifier dùng chung: models/intent_classifier.npz nếu có, không thì train từ seed + FAQ"""
+    global _classifier
+    if _classifier is None:
+        with _classifier_lock:
+            if _classifier is None:
+                start = time.time()
+                try:
+                    if os.path.exists(MODEL_PATH):
+                        _classifier = IntentClassifier.load()
+                    else:
+                        _classifier = IntentClassifier.train(training_examples())
+                except (OSError, ValueError, KeyError) as e:
+                    print(f"[WARNING] Intent classifier unavailable: {e}")
+                    return None
+                print(f"[INFO] Intent classifier ready: {len(_classifier.vocabulary)} features "
+                      f"in {(time.time() - start) * 1000:.1f} ms")
+    return _classifier
+
+
+def classify_intent(text: str) -> Optional[Tuple[str, float]]:
+    """(nhãn, độ tin cậy) của tin nhắn, None nếu classifier bị tắt hoặc không dùng được"""
+    from config import Config
+
+    if not Config.INTENT_CLASSIFIER_SETTINGS['enabled']:
+        return None
+    classifier = get_intent_classifier()
+    return classifier.predict(text) if classifier else None
+
+
+def evaluate(examples: List[Tuple[str, str]], folds: int = 5):
+    """Cross-validation k-fold: accuracy, confusion và thời gian predict"""
+    rng = np.random.default_rng(0)
+    order = rng.permutation(len(examples))
+    confusion = np.zeros((len(LABELS), len(LABELS)), dtype=int)
+    predict_time, predictions = 0.0, 0
+
+    for fold in range(folds):
+        test_ids = set(order[fold::folds].tolist())
+        model = IntentClassifier.train([e for i, e in enumerate(examples) if i not in test_ids])
+        for i in test_ids:
+            text, label = examples[i]
+            start = time.perf_counter()
+            predicted, _ = model.predict(text)
+            predict_time += time.perf_counter() - start
+            predictions += 1
+            confusion[LABELS.index(label), LABELS.index(predicted)] += 1
+
+    print(f"[INFO] {len(examples)} examples, {folds}-fold accuracy: {np.trace(confusion) / confusion.sum():.3f}")
+    print(f"[INFO] Predict: {predict_time / predictions * 1e6:.1f} µs/message")
+    print("       " + " ".join(f"{label[:8]:>8}" for label in LABELS))
+    for label, row in zip(LABELS, confusion):
+        print(f"{label[:8]:>8} " + " ".join(f"{count:>8}" for count in row))
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Train/đánh giá models/intent_classifier.npz")
+    parser.add_argument('--train', action='store_true', help="train và lưu model")
+    parser.add_argument('--evaluate', action='store_true', help="cross-validation trên dữ liệu train")
+    parser.add_argument('--include-messages', action='store_true', help="thêm messages đã log (nhãn theo ai_mode)")
+    parser.add_argument('text', nargs='*', help="tin nhắn cần phân loại")
+    args = parser.parse_args()
+
+    if args.evaluate:
+        evaluate(training_examples(args.include_messages))
+    if args.train:
+        examples = training_examples(args.include_messages)
+        IntentClassifier.train(examples).save()
+        print(f"[INFO] Trained on {len(examples)} examples, saved to {os.path.abspath(MODEL_PATH)}")
+    if args.text:
+        print(get_intent_classifier().predict(' '.join(args.text)))
+    if not (args.train or args.evaluate or args.text):
+        parser.print_help()
@@ -0,0 +1,306 @@
+"""
+Intent router: mọi bảng từ khóa (lệnh, lịch, môn học, task type) được biên dịch thành một regex lúc import
+
+Trước đây route_command, handle_ai_question, _handle_calendar_in_chat, _get_task_type_from_subject và
+CalendarAIParser mỗi nơi tự quét câu hỏi bằng any(keyword in q for keyword in [...]), khoảng chục lượt
+cho một tin nhắn. Router quét câu hỏi một lần và trả về intent, môn học và tập tag; ngữ nghĩa vẫn là
+"keyword là substring của câu hỏi" như các cascade cũ (kể cả khi keyword chồng nhau, vd. "thuật toán"/"toán").
+
+Benchmark so với cascade cũ (trong thư mục api):
+    python intent_router.py --benchmark
+"""
+import re
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Dict, FrozenSet, List, Set, Tuple
+
+# tag -> keyword, khớp ở bất kỳ vị trí nào trong câu hỏi
+KEYWORD_TABLES: Dict[str, List[str]] = {
+    # lệnh (route_command)
+    'deadline_command': ['thêm deadline', 'xóa deadline'],
+    'calendar_command': ['lịch hôm nay', 'lịch tuần', 'thêm lịch', 'calendar', 'lịch học'],
+
+    # yêu cầu lịch (ai_handlers, calendar_ai_parser)
+    'calendar': [
+        'lịch', 'deadline', 'hẹn', 'cuộc họp', 'sự kiện', 'nhắc nhở',
+        'meeting', 'event', 'reminder', 'schedule', 'appointment',
+        'tạo lịch', 'đặt lịch', 'thêm lịch', 'lên lịch'
+    ],
+    'calendar_create': ['tạo', 'đặt', 'thêm', 'lên lịch', 'create', 'add'],
+    'calendar_list': ['xem', 'hiện', 'list', 'show'],
+    'calendar_delete': ['xóa', 'hủy', 'delete', 'cancel'],
+    'deadline': ['deadline'],
+    'planning': ['lịch', 'deadline', 'kế hoạch', 'thời gian'],
+    'time_management_hint': [
+        'thời gian', 'lịch trình', 'deadline', 'kế hoạch', 'nhắc nhở',
+        'tổ chức', 'quản lý', 'ưu tiên'
+    ],
+
+    # môn học (handle_ai_question)
+    'subject:programming': [
+        'lập trình', 'programming', 'code', 'python', 'javascript', 'thuật toán', 'algorithm',
+        'decision tree', 'machine learning', 'ai'
+    ],
+    'subject:math': ['toán', 'math', 'công thức', 'tính', 'phương trình'],
+    'subject:physics': ['vật lý', 'physics', 'lực', 'năng lượng', 'tốc độ'],
+    'subject:chemistry': ['hóa học', 'chemistry', 'phản ứng', 'nguyên tố'],
+    'subject:history': ['lịch sử', 'history', 'việt nam', 'thế giới'],
+    'subject:english': ['tiếng anh', 'english', 'grammar', 'vocabulary'],
+    'subject:study': ['học', 'ôn thi', 'thi cử', 'kiểm tra', 'mẹo', 'phương pháp'],
+    'subject:time_management': ['thời gian', 'kế hoạch', 'lịch trình', 'quản lý'],
+    'subject:linear_algebra': [
+        'đại số tuyến tính', 'linear algebra', 'ma trận', 'matrix', 'vector', 'không gian vector',
+        'hệ phương trình tuyến tính'
+    ],
+    'subject:probability_statistics': [
+        'xác suất thống kê', 'probability', 'statistics', 'phân phối', 'distribution',
+        'kiểm định giả thuyết', 'hypothesis testing', 'hồi quy'
+    ],
+    'subject:calculus': [
+        'giải tích', 'calculus', 'vi phân', 'differential', 'tích phân', 'integral', 'đạo hàm',
+        'derivative', 'giới hạn', 'limit'
+    ],
+    'not_math': ['thuật toán', 'algorithm'],
+
+    # task type để chọn model (_get_task_type_from_subject)
+    'task:programming': ['programming', 'lập trình', 'code', 'thuật toán', 'algorithm'],
+    'task:math': ['math', 'toán', 'calculus', 'algebra', 'geometry'],
+    'task:document_analysis': ['document', 'tài liệu', 'analysis', 'phân tích'],
+}
+
+# tag -> keyword, chỉ tính khi câu hỏi bắt đầu bằng keyword
+PREFIX_TABLES: Dict[str, List[str]] = {
+    'greeting': ['xin chào', 'chào bạn', 'hello ', 'hi '],
+    'deadline_command': ['deadline'],
+    'search_command': ['tìm tài liệu', 'search'],
+}
+
+EXACT_GREETINGS = frozenset({'xin chào', 'chào', 'hello', 'hi', 'xin chào!', 'chào!', 'hello!', 'hi!'})
+
+# thứ tự ưu tiên giống cascade cũ: programming trước math vì "thuật toán" chứa "toán"
+SUBJECT_PRIORITY = [
+    'programming', 'math', 'physics', 'chemistry', 'history', 'english', 'study',
+    'time_management', 'linear_algebra', 'probability_statistics', 'calculus'
+]
+TASK_TYPE_PRIORITY = ['programming', 'math', 'document_analysis']
+COMMAND_PRIORITY = ['greeting', 'deadline_command', 'calendar_command', 'search_command']
+
+
+def _trie_pattern(words: List[str]) -> str:
+    """Regex dạng trie cho tập keyword (tiền tố chung chỉ so một lần, luôn ưu tiên keyword dài nhất)"""
+    trie: Dict = {}
+    for word in words:
+        node = trie
+        for ch in word:
+            node = node.setdefault(ch, {})
+        node[''] = True
+
+    def build(node: Dict) -> str:
+        is_end = '' in node
+        branches = [re.escape(ch) + build(child) for ch, child in sorted(node.items()) if ch]
+        if not branches:
+            return ''
+        body = branches[0] if len(branches) == 1 else f"(?:{'|'.join(branches)})"
+        if is_end:
+            # greedy: thử nhánh dài hơn trước, không khớp thì dừng ở keyword hiện tại
+            return f"(?:{body})?" if len(branches) > 1 or len(body) > 1 else f"{body}?"
+        return body
+
+    return build(trie)
+
+
+def _compile() -> Tuple["re.Pattern", Dict[str, Tuple[FrozenSet[str], FrozenSet[str]]]]:
+    """Regex quét mọi vị trí + tag (thường, prefix) của keyword dài nhất khớp tại vị trí đó"""
+    entries: Dict[str, Set[Tuple[str, bool]]] = {}
+    for tables, prefix_only in ((KEYWORD_TABLES, False), (PREFIX_TABLES, True)):
+        for tag, keywords in tables.items():
+            for keyword in keywords:
+                entries.setdefault(keyword, set()).add((tag, prefix_only))
+
+    # Regex chỉ trả về keyword dài nhất tại mỗi vị trí, nên keyword đó mang luôn tag của mọi keyword
+    # nằm bên trong nó (tag prefix chỉ khi keyword con cũng là tiền tố) -> giữ đúng ngữ nghĩa substring
+    tags_for = {}
+    for keyword in entries:
+        tags, prefix_tags = set(), set()
+        for other, other_tags in entries.items():
+            if other not in keyword:
+                continue
+            for tag, prefix_only in other_tags:
+                if not prefix_only:
+                    tags.add(tag)
+                elif keyword.startswith(other):
+                    prefix_tags.add(tag)
+        tags_for[keyword] = (frozenset(tags), frozenset(prefix_tags))
+
+    # lookahead để finditer xét mọi vị trí, kể cả các keyword chồng lên nhau
+    return re.compile(f"(?=({_trie_pattern(list(entries))}))"), tags_for
+
+
+_PATTERN, _TAGS_FOR = _compile()
+
+
+@dataclass(frozen=True)
+class RoutedIntent:
+    """Kết quả route một câu hỏi"""
+    intent: str          # greeting | deadline_command | calendar_command | search_command | calendar | question
+    subject: str         # môn học cho handle_ai_question, 'general' nếu không rõ
+    task_type: str       # programming | math | document_analysis | general
+    tags: FrozenSet[str]
+
+    @property
+    def calendar_action(self) -> str:
+        """Action lịch đoán từ động từ trong câu (dùng khi AI parser không xác định được)"""
+        if 'calendar_create' in self.tags:
+            return 'create_deadline' if 'deadline' in self.tags else 'create_event'
+        if 'calendar_list' in self.tags:
+            return 'list_events'
+        if 'calendar_delete' in self.tags:
+            return 'delete_event'
+        return 'none'
+
+
+def match_tags(text: str) -> FrozenSet[str]:
+    """Tập tag của mọi keyword xuất hiện trong text (một lượt quét)"""
+    q = text.lower().strip()
+    tags = set()
+    for match in _PATTERN.finditer(q):
+        keyword_tags, prefix_tags = _TAGS_FOR[match.group(1)]
+        tags |= keyword_tags
+        if match.start() == 0:
+            tags |= prefix_tags
+    if q in EXACT_GREETINGS:
+        tags.add('greeting')
+    return frozenset(tags)
+
+
+def _route(text: str) -> RoutedIntent:
+    tags = match_tags(text)
+
+    intent = next((tag for tag in COMMAND_PRIORITY if tag in tags), None)
+    if intent is None:
+        intent = 'calendar' if 'calendar' in tags else 'question'
+
+    subject = next((
+        name for name in SUBJECT_PRIORITY
+        if f'subject:{name}' in tags and not (name == 'math' and 'not_math' in tags)
+    ), 'general')
+    task_type = next((name for name in TASK_TYPE_PRIORITY if f'task:{name}' in tags), 'general')
+    return RoutedIntent(intent, subject, task_type, tags)
+
+
+@lru_cache(maxsize=4096)
+def route(text: str) -> RoutedIntent:
+    """Intent, môn học và task type của câu hỏi; kết quả được cache vì một tin nhắn đi qua nhiều tầng"""
+    return _route(text)
+
+
+def _legacy_route(question: str) -> RoutedIntent:
+    """Cascade any(keyword in q ...) cũ, chỉ dùng để benchmark và kiểm tra kết quả trùng khớp"""
+    q = question.lower().strip()
+    tags = set()
+
+    if (q in ['xin chào', 'chào', 'hello', 'hi', 'xin chào!', 'chào!', 'hello!', 'hi!']
+            or q.startswith('xin chào') or q.startswith('chào bạn')
+            or q.startswith('hello ') or q.startswith('hi ')):
+        intent = 'greeting'
+    elif q.startswith('deadline') or 'thêm deadline' in q or 'xóa deadline' in q:
+        intent = 'deadline_command'
+    elif any(phrase in q for phrase in ['lịch hôm nay', 'lịch tuần', 'thêm lịch', 'calendar', 'lịch học']):
+        intent = 'calendar_command'
+    elif q.startswith('tìm tài liệu') or q.startswith('search'):
+        intent = 'search_command'
+    elif any(keyword in q for keyword in KEYWORD_TABLES['calendar']):
+        intent = 'calendar'
+    else:
+        intent = 'question'
+
+    subject = 'general'
+    for name in SUBJECT_PRIORITY:
+        if any(keyword in q for keyword in KEYWORD_TABLES[f'subject:{name}']):
+            if name == 'math' and ('thuật toán' in q or 'algorithm' in q):
+                continue
+            subject = name
+            break
+
+    task_type = 'general'
+    for name in TASK_TYPE_PRIORITY:
+        if any(keyword in q for keyword in KEYWORD_TABLES[f'task:{name}']):
+            task_type = name
+            break
+
+    # các lượt quét còn lại của CalendarAIParser và gợi ý context-aware
+    for tag in ('calendar_create', 'calendar_list', 'calendar_delete', 'deadline', 'planning', 'time_management_hint'):
+        if any(keyword in q for keyword in KEYWORD_TABLES[tag]):
+            tags.add(tag)
+    return RoutedIntent(intent, subject, task_type, frozenset(tags))
+
+
+def _benchmark_corpus() -> List[str]:
+    """Câu hỏi thật: messages trong data/chatbot.db (mở read-only) + câu hỏi FAQ"""
+    import json
+    import os
+    import sqlite3
+
+    data_dir = os.path.join(os.path.dirname(__file__), '..', 'data')
+    corpus = []
+    db_path = os.path.abspath(os.path.join(data_dir, 'chatbot.db'))
+    if os.path.exists(db_path):
+        conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+        try:
+            corpus.extend(row[0] for row in conn.execute("SELECT question FROM messages") if row[0])
+        finally:
+            conn.close()
+    faq_path = os.path.join(data_dir, 'faq.json')
+    if os.path.exists(faq_path):
+        with open(faq_path, 'r', encoding='utf-8') as f:
+            corpus.extend(e['question'] for e in json.load(f) if e.get('question'))
+    return corpus
+
+
+def benchmark(repeat: int = 200):
+    """So sánh thời gian và kết quả của router với cascade cũ trên corpus thật"""
+    import time
+
+    corpus = _benchmark_corpus()
+    if not corpus:
+        print("[WARNING] Benchmark corpus is empty")
+        return
+
+    mismatches = []
+    for question in corpus:
+        new, old = _route(question), _legacy_route(question)
+        if (new.intent, new.subject, new.task_type) != (old.intent, old.subject, old.task_type) \
+                or not old.tags <= new.tags:
+            mismatches.append((question, old, new))
+
+    timings = {}
+    for name, fn in (('cascade', _legacy_route), ('router', _route)):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for question in corpus:
+                fn(question)
+        timings[name] = (time.perf_counter() - start) / (repeat * len(corpus)) * 1e6
+
+    print(f"[INFO] Corpus: {len(corpus)} messages, {repeat} rounds")
+    print(f"[INFO] Cascade: {timings['cascade']:.2f} µs/message")
+    print(f"[INFO] Router:  {timings['router']:.2f} µs/message ({timings['cascade'] / timings['router']:.1f}x)")
+    print(f"[INFO] Mismatches: {len(mismatches)}")
+    for question, old, new in mismatches[:10]:
+        print(f"  {question!r}: {old} != {new}")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Intent router")
+    parser.add_argument('--benchmark', action='store_true', help="so sánh với cascade keyword cũ")
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('text', nargs='*', help="câu hỏi cần route")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark(args.repeat)
+    elif args.text:
+        print(route(' '.join(args.text)))
+    else:
+        parser.print_help()
@@ -1,14 +1,19 @@
-from flask import Flask, request, jsonify, session, send_from_directory, send_file
+from flask import Flask, request, jsonify, session, send_from_directory, send_file, Response, stream_with_context
 from flask_cors import CORS
 import os
+import asyncio
 from datetime import datetime
 import json
 
 from config import Config
-from database import get_db
-from ai_handlers import handle_ai_question_with_context
+from database import get_db, get_async_db
+from ai_handlers import handle_ai_question_with_context, ahandle_ai_question_with_context, stream_ai_question_with_context
 from utils import handle_deadline_commands, handle_calendar_commands, handle_document_search
 from db_session_manager import export_to_html, get_user_id, get_user_data, save_user_data
+from faq_index import get_faq_index
+from intent_classifier import get_intent_classifier
+from conversation_summary import context_messages as conversation_context_messages, get_summarizer
+from intent_router import route
 
 
 
@@ -52,8 +57,8 @@ def add_message_to_conversation(question, answer, ai_mode=None, metadata=None):
     """Add message to current conversation"""
     db = get_db()
     user_id = get_user_id()
-    # Lấy đúng hội thoại active
-    current_conv = db.get_current_conversation(user_id)
+    # Lấy đúng hội thoại active (chỉ metadata, không load tin nhắn)
+    current_conv = db.get_current_conversation(user_id, include_messages=False)
     if not current_conv:
         title = question[:50] + "..." if len(question) > 50 else question
         current_conv = db.create_conversation(user_id, title, ai_mode)
@@ -67,6 +72,14 @@ app = Flask(__name__)
 CORS(app)
 app.secret_key = Config.SECRET_KEY
 
+# Build FAQ index một lần lúc khởi động
+if Config.FAQ_SETTINGS['enabled']:
+    get_faq_index()
+if Config.INTENT_CLASSIFIER_SETTINGS['enabled']:
+    get_intent_classifier()
+# Đăng ký cập nhật summary sau add_message
+get_summarizer()
+
 
 @app.route("/")
 def index():
@@ -105,7 +118,7 @@ def health_check():
 
 
 @app.route("/chat", methods=["POST"])
-def chat():
+async def chat():
     """Main chat endpoint với improved error handling và context preservation"""
     try:
         data = request.json
@@ -120,27 +133,18 @@ def chat():
         print(f"[DEBUG] Processing question: {question[:100]}...")
         
         # LẤY CONTEXT từ cuộc hội thoại hiện tại
-        current_conversation = get_current_conversation()
-        context_messages = []
-        
-        if current_conversation and current_conversation.get('messages'):
-            # Lấy 5 tin nhắn gần nhất để làm context
-            recent_messages = current_conversation['messages'][-5:]
-            for msg in recent_messages:
-                context_messages.extend([
-                    {"role": "user", "content": msg.get('question', '')},
-                    {"role": "assistant", "content": msg.get('answer', '')}
-                ])
+        context_messages = await asyncio.to_thread(load_context_messages)
         
         # Xử lý câu hỏi với context
-        response = process_question_with_context(question, context_messages)
+        response = await aprocess_question_with_context(question, context_messages)
         
         if not response or not isinstance(response, dict):
             return jsonify({"error": "Có lỗi xử lý câu hỏi"}), 500
         
         # Lưu vào cuộc hội thoại hiện tại với error handling
         try:
-            message = add_message_to_conversation(
+            message = await asyncio.to_thread(
+                add_message_to_conversation,
                 question, 
                 response.get("answer", "Không có phản hồi"), 
                 response.get("ai_mode")
@@ -168,13 +172,74 @@ def chat():
         return jsonify({"error": "Có lỗi xảy ra khi xử lý yêu cầu. Vui lòng thử lại."}), 500
 
 
+def _sse_event(event, data):
+    """Format một Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@app.route("/chat/stream", methods=["POST"])
+def chat_stream():
+    """Chat endpoint dạng Server-Sent Events: gửi từng đoạn câu trả lời ngay khi model sinh ra"""
+    data = request.json
+    if not data:
+        return jsonify({"error": "Không có dữ liệu được gửi"}), 400
+    
+    question = data.get("question", "").strip()
+    if not question:
+        return jsonify({"error": "Bạn chưa nhập câu hỏi!"}), 400
+    
+    print(f"[DEBUG] Streaming question: {question[:100]}...")
+    
+    # Đọc context (và tạo session user) trước khi gửi header, vì sau đó không set cookie được nữa
+    context_messages = load_context_messages()
+    
+    def generate():
+        try:
+            for event in stream_question_with_context(question, context_messages):
+                if not event.get("done"):
+                    yield _sse_event("delta", {"content": event["content"]})
+                    continue
+                
+                response = event["response"]
+                # Lưu câu trả lời hoàn chỉnh khi stream kết thúc
+                try:
+                    message = add_message_to_conversation(
+                        question,
+                        response.get("answer", "Không có phản hồi"),
+                        response.get("ai_mode")
+                    )
+                    if message:
+                        print(f"[DEBUG] Message saved successfully: {message['id']}")
+                except Exception as save_error:
+                    print(f"[ERROR] Failed to save message: {save_error}")
+                
+                yield _sse_event("done", {
+                    "answer": response.get("answer", "Có lỗi xảy ra"),
+                    "suggestions": response.get("suggestions", []),
+                    "calendar_events": response.get("calendar_events", []),
+                    "ai_mode": response.get("ai_mode", None),
+                    "timestamp": datetime.now().isoformat()
+                })
+        except Exception as e:
+            print(f"Error in chat stream: {e}")
+            import traceback
+            traceback.print_exc()
+            yield _sse_event("error", {"error": "Có lỗi xảy ra khi xử lý yêu cầu. Vui lòng thử lại."})
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
 @app.route('/conversations', methods=['GET'])
-def get_conversations():
+async def get_conversations():
     """Lấy danh sách tất cả cuộc hội thoại"""
     try:
-        db = get_db()
+        db = get_async_db()
         user_id = get_user_id()
-        conversations = db.get_conversations(user_id)
+        conversations = await db.get_conversations(user_id)
         return jsonify({
             'conversations': conversations,
             'timestamp': datetime.now().isoformat()
@@ -183,17 +248,17 @@ def get_conversations():
         return jsonify({'error': str(e)}), 500
 
 @app.route('/conversations/new', methods=['POST'])
-def create_conversation():
+async def create_conversation():
     """Tạo cuộc hội thoại mới và chuyển active"""
     try:
-        db = get_db()
+        db = get_async_db()
         user_id = get_user_id()
         # Tạo tiêu đề mặc định dựa trên thời gian
         title = f"Hội thoại {datetime.now().strftime('%d/%m %H:%M')}"
         # Tạo hội thoại mới và chuyển active
-        conversation = db.create_conversation(user_id, title)
-        db.switch_conversation(conversation['id'], user_id)
-        conversations = db.get_conversations(user_id)
+        conversation = await db.create_conversation(user_id, title)
+        await db.switch_conversation(conversation['id'], user_id)
+        conversations = await db.get_conversations(user_id)
         return jsonify({
             'conversation': conversation,
             'conversations': conversations,
@@ -204,13 +269,33 @@ def create_conversation():
         traceback.print_exc()  # In ra lỗi chi tiết
         return jsonify({'error': str(e)}), 500
 
+@app.route('/conversations/search', methods=['GET'])
+async def search_conversations():
+    """Tìm kiếm full-text trong lịch sử hội thoại, kết quả xếp theo độ liên quan"""
+    try:
+        query = request.args.get('q', '').strip()
+        if not query:
+            return jsonify({'error': 'Thiếu từ khóa tìm kiếm (q)'}), 400
+        limit = min(max(request.args.get('limit', 20, type=int), 1), 100)
+        db = get_async_db()
+        user_id = get_user_id()
+        results = await db.search_messages(user_id, query, limit)
+        return jsonify({
+            'query': query,
+            'results': results,
+            'total': len(results),
+            'timestamp': datetime.now().isoformat()
+        })
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/conversations/<conversation_id>', methods=['GET'])
-def get_conversation(conversation_id):
+async def get_conversation(conversation_id):
     """Lấy cuộc hội thoại cụ thể với tin nhắn"""
     try:
-        db = get_db()
+        db = get_async_db()
         user_id = get_user_id()
-        conversation = db.get_conversation(conversation_id, user_id)
+        conversation = await db.get_conversation(conversation_id, user_id)
         if conversation:
             return jsonify({
                 'conversation': conversation,
@@ -222,13 +307,13 @@ def get_conversation(conversation_id):
         return jsonify({'error': str(e)}), 500
 
 @app.route('/conversations/<conversation_id>/switch', methods=['POST'])
-def switch_to_conversation(conversation_id):
+async def switch_to_conversation(conversation_id):
     """Chuyển sang cuộc hội thoại khác"""
     try:
-        db = get_db()
+        db = get_async_db()
         user_id = get_user_id()
-        conversation = db.switch_conversation(conversation_id, user_id)
-        conversations = db.get_conversations(user_id)
+        conversation = await db.switch_conversation(conversation_id, user_id)
+        conversations = await db.get_conversations(user_id)
         if conversation:
             return jsonify({
                 'conversation': conversation,
@@ -241,13 +326,13 @@ def switch_to_conversation(conversation_id):
         return jsonify({'error': str(e)}), 500
 
 @app.route('/conversations/<conversation_id>', methods=['DELETE'])
-def delete_conversation(conversation_id):
+async def delete_conversation(conversation_id):
     """Xóa một cuộc hội thoại"""
     try:
-        db = get_db()
+        db = get_async_db()
         user_id = get_user_id()
-        db.delete_conversation(conversation_id, user_id)
-        conversations = db.get_conversations(user_id)
+        await db.delete_conversation(conversation_id, user_id)
+        conversations = await db.get_conversations(user_id)
         return jsonify({
             'success': True,
             'conversations': conversations,
@@ -289,48 +374,104 @@ def export_chat_history():
         }), 500
 
 
+def load_context_messages():
+    """
+    Context cho AI: summary của hội thoại (nếu có) + các cặp hỏi/đáp chưa được tóm tắt gần nhất
+    (ai_handlers cắt theo ngân sách token)
+    """
+    db = get_db()
+    current_conversation = db.get_current_conversation(get_user_id(), include_messages=False)
+    # Đọc tối đa CONTEXT_MAX_TURNS lượt gần nhất, số lượt thực sự gửi đi phụ thuộc số token
+    return conversation_context_messages(db, current_conversation, Config.CONTEXT_SETTINGS['max_turns'])
+
+
 # phần xử lý logic chính với context
 def process_question_with_context(question, context_messages=None):
     """Xử lý câu hỏi từ người dùng với context từ lịch sử cuộc trò chuyện"""
-    q = question.lower().strip()
-    user_data = get_user_data()
-    
     print(f"[DEBUG] process_question_with_context called with: {question}")
     print(f"[DEBUG] Context messages count: {len(context_messages) if context_messages else 0}")
     
-    # Ưu tiên các lệnh chào hỏi TRƯỚC TIÊN
-    greeting_patterns = [
-        q == 'xin chào', q == 'chào', q == 'hello', q == 'hi',
-        q.startswith('xin chào'), q.startswith('chào bạn'), 
-        q.startswith('hello '), q.startswith('hi '),
-        q in ['xin chào!', 'chào!', 'hello!', 'hi!']
-    ]
+    response = route_command(question) or answer_from_faq(question)
+    if response:
+        return response
+    
+    # Còn lại tất cả đều là câu hỏi học tập - chuyển cho AI handler với context
+    print("[DEBUG] Routing to AI handler with context")
+    return handle_ai_question_with_context(question, context_messages)
+
+
+async def aprocess_question_with_context(question, context_messages=None):
+    """Bản async của process_question_with_context: gọi OpenAI không block thread"""
+    print(f"[DEBUG] aprocess_question_with_context called with: {question}")
+    
+    # các lệnh (deadline, lịch, tài liệu) dùng API sync nên chạy trong thread pool
+    response = await asyncio.to_thread(route_command, question) or answer_from_faq(question)
+    if response:
+        return response
+    
+    print("[DEBUG] Routing to async AI handler with context")
+    return await ahandle_ai_question_with_context(question, context_messages)
+
+
+def stream_question_with_context(question, context_messages=None):
+    """Như process_question_with_context nhưng stream câu trả lời AI (xem stream_ai_question_with_context)"""
+    response = route_command(question) or answer_from_faq(question)
+    if response:
+        yield {"done": True, "response": response}
+        return
+    
+    print("[DEBUG] Streaming AI handler with context")
+    yield from stream_ai_question_with_context(question, context_messages)
+
+
+def answer_from_faq(question):
+    """Trả lời từ FAQ nếu câu hỏi khớp đủ chắc chắn, None nếu cần hỏi AI"""
+    settings = Config.FAQ_SETTINGS
+    faq_index = get_faq_index() if settings['enabled'] else None
+    if not faq_index:
+        return None
+    
+    match = faq_index.answer(question, settings['confidence_threshold'])
+    if not match:
+        return None
+    
+    print(f"[DEBUG] Answered from FAQ (confidence {match['confidence']}): {match['question']}")
+    return {
+        "answer": match['answer'],
+        "suggestions": match['related'] + ["Giải thích chi tiết hơn"],
+        "ai_mode": "faq"
+    }
+
+
+def route_command(question):
+    """Xử lý lời chào và các lệnh (deadline, lịch, tìm tài liệu); trả về None nếu là câu hỏi cho AI"""
+    intent = route(question).intent
+    user_data = get_user_data()
     
-    if any(greeting_patterns):
-        print(f"[DEBUG] Detected greeting")
+    # Ưu tiên các lệnh chào hỏi TRƯỚC TIÊN
+    if intent == 'greeting':
+        print("[DEBUG] Detected greeting")
         return {
             "answer": "👋 Xin chào! Tôi là trợ lý học tập thông minh. Tôi có thể giúp bạn:<br>• 📅 Quản lý lịch học và deadline<br>• 📚 Tìm tài liệu và giải thích kiến thức<br>• 🤖 Trả lời các câu hỏi học tập<br>• 💡 Đưa ra lời khuyên và gợi ý học tập",
             "suggestions": ["Giải thích về Python", "Công thức Toán", "Lịch sử Việt Nam", "Mẹo học tập"]
         }
     
     # Các lệnh deadline
-    if q.startswith('deadline') or 'thêm deadline' in q or 'xóa deadline' in q:
+    if intent == 'deadline_command':
         print(f"[DEBUG] Detected deadline command")
-        return handle_deadline_commands(question, user_data)
+        return handle_deadline_commands(question, user_data, get_user_id())
     
     # Lệnh quản lý lịch
-    if any(phrase in q for phrase in ['lịch hôm nay', 'lịch tuần', 'thêm lịch', 'calendar', 'lịch học']):
+    if intent == 'calendar_command':
         print(f"[DEBUG] Detected calendar command")
         return handle_calendar_commands(question, user_data)
     
     # Tìm kiếm tài liệu
-    if q.startswith('tìm tài liệu') or q.startswith('search'):
+    if intent == 'search_command':
         print(f"[DEBUG] Detected document search")
         return handle_document_search(question, user_data)
     
-    # Còn lại tất cả đều là câu hỏi học tập - chuyển cho AI handler với context
-    print(f"[DEBUG] Routing to AI handler with context")
-    return handle_ai_question_with_context(question, context_messages)
+    return None
 
 
 
@@ -538,7 +679,7 @@ def calendar_auth_callback():
         }), 500
 
 @app.route('/calendar/process', methods=['POST'])
-def process_calendar_request():
+async def process_calendar_request():
     """Process natural language calendar requests"""
     try:
         from calendar_integration import CalendarIntegration
@@ -560,7 +701,8 @@ def process_calendar_request():
         user_message = data.get('message') or data.get('question')
         
         calendar_integration = CalendarIntegration()
-        result = calendar_integration.process_calendar_request(user_id, user_message)
+        # Google API client là sync: chạy trong thread pool để không block event loop
+        result = await asyncio.to_thread(calendar_integration.process_calendar_request, user_id, user_message)
         
         return jsonify(result)
         
@@ -574,7 +716,7 @@ def process_calendar_request():
         }), 500
 
 @app.route('/calendar/events', methods=['GET'])
-def get_calendar_events():
+async def get_calendar_events():
     """Get upcoming calendar events"""
     try:
         from calendar_integration import CalendarIntegration
@@ -585,12 +727,12 @@ def get_calendar_events():
         calendar_integration = CalendarIntegration()
         
         # Check authentication first
-        auth_status = calendar_integration.get_auth_status(user_id)
+        auth_status = await asyncio.to_thread(calendar_integration.get_auth_status, user_id)
         if not auth_status.get('success'):
             return jsonify(auth_status)
         
         # Get events
-        result = calendar_integration.calendar_manager.get_upcoming_events(user_id, days_ahead)
+        result = await asyncio.to_thread(calendar_integration.calendar_manager.get_upcoming_events, user_id, days_ahead)
         
         if result['success']:
             return jsonify({
@@ -606,7 +748,7 @@ def get_calendar_events():
         else:
             return jsonify({
                 'success': False,
-                'message': f"Không thể lấy sự kiện: {result['error']}",
+                'message': f"Không thể lấy sự kiện: {result.get('message', 'Lỗi không xác định')}",
                 'data': None,
                 'action': 'get_events_failed'
             })
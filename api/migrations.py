@@ -0,0 +1,215 @@
+"""
+Versioned schema migrations for chatbot.db
+
+Mỗi migration là (version, mô tả, các bước). Một bước là câu SQL hoặc một hàm nhận connection.
+Version đã áp dụng được lưu trong PRAGMA user_version. Chỉ thêm migration mới vào cuối list,
+không sửa migration đã phát hành.
+"""
+import sqlite3
+from typing import Callable, List, Tuple, Union
+
+MigrationStep = Union[str, Callable[[sqlite3.Connection], None]]
+
+
+# Schema gốc (giữ nguyên như bản cũ của init_database để database có sẵn không bị thay đổi)
+_BASELINE_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS users (
+        id TEXT PRIMARY KEY,
+        session_id TEXT UNIQUE,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        last_active TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        preferences TEXT DEFAULT '{}',
+        deadlines TEXT DEFAULT '{}',
+        schedule TEXT DEFAULT '{}'
+    )""",
+    """CREATE TABLE IF NOT EXISTS conversations (
+        id TEXT PRIMARY KEY,
+        user_id TEXT,
+        title TEXT NOT NULL,
+        ai_mode TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        is_active BOOLEAN DEFAULT 0,
+        message_count INTEGER DEFAULT 0,
+        FOREIGN KEY (user_id) REFERENCES users (id)
+    )""",
+    """CREATE TABLE IF NOT EXISTS messages (
+        id TEXT PRIMARY KEY,
+        conversation_id TEXT,
+        user_id TEXT,
+        question TEXT NOT NULL,
+        answer TEXT NOT NULL,
+        ai_mode TEXT,
+        timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        metadata TEXT DEFAULT '{}',
+        FOREIGN KEY (conversation_id) REFERENCES conversations (id),
+        FOREIGN KEY (user_id) REFERENCES users (id)
+    )"""
+]
+
+_CONVERSATION_INDEXES = [
+    # get_current_conversation / get_conversations: user_id AND is_active, ORDER BY updated_at
+    "CREATE INDEX IF NOT EXISTS idx_conversations_user_active_updated ON conversations (user_id, is_active, updated_at)",
+    # danh sách hội thoại, cleanup, export: user_id ORDER BY updated_at
+    "CREATE INDEX IF NOT EXISTS idx_conversations_user_updated ON conversations (user_id, updated_at)"
+]
+
+_MESSAGE_INDEXES = [
+    # tin nhắn theo hội thoại ORDER BY timestamp (cả đọc toàn bộ lẫn phần đuôi)
+    "CREATE INDEX IF NOT EXISTS idx_messages_conversation_timestamp ON messages (conversation_id, timestamp)"
+]
+
+
+# Bảng có INTEGER PRIMARY KEY tường minh: row được cluster theo thứ tự insert (append cuối B-tree),
+# rowid ổn định qua VACUUM; id TEXT vẫn là ID public mà API trả về
+_ROWID_TABLES = [
+    """CREATE TABLE conversations_new (
+        seq INTEGER PRIMARY KEY,
+        id TEXT NOT NULL UNIQUE,
+        user_id TEXT,
+        title TEXT NOT NULL,
+        ai_mode TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        is_active BOOLEAN DEFAULT 0,
+        message_count INTEGER DEFAULT 0,
+        FOREIGN KEY (user_id) REFERENCES users (id)
+    )""",
+    """INSERT INTO conversations_new
+           (id, user_id, title, ai_mode, created_at, updated_at, is_active, message_count)
+       SELECT id, user_id, title, ai_mode, created_at, updated_at, is_active, message_count
+       FROM conversations ORDER BY created_at, rowid""",
+    "DROP TABLE conversations",
+    "ALTER TABLE conversations_new RENAME TO conversations",
+    """CREATE TABLE messages_new (
+        seq INTEGER PRIMARY KEY,
+        id TEXT NOT NULL UNIQUE,
+        conversation_id TEXT,
+        user_id TEXT,
+        question TEXT NOT NULL,
+        answer TEXT NOT NULL,
+        ai_mode TEXT,
+        timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        metadata TEXT DEFAULT '{}',
+        FOREIGN KEY (conversation_id) REFERENCES conversations (id),
+        FOREIGN KEY (user_id) REFERENCES users (id)
+    )""",
+    """INSERT INTO messages_new
+           (id, conversation_id, user_id, question, answer, ai_mode, timestamp, metadata)
+       SELECT id, conversation_id, user_id, question, answer, ai_mode, timestamp, metadata
+       FROM messages ORDER BY timestamp, rowid""",
+    "DROP TABLE messages",
+    "ALTER TABLE messages_new RENAME TO messages"
+]
+
+
+def fts5_available(conn: sqlite3.Connection) -> bool:
+    """SQLite build hiện tại có hỗ trợ FTS5 không"""
+    try:
+        conn.execute("CREATE VIRTUAL TABLE temp.fts5_probe USING fts5(x)")
+        conn.execute("DROP TABLE temp.fts5_probe")
+        return True
+    except sqlite3.OperationalError:
+        return False
+
+
+def _create_message_fts(conn: sqlite3.Connection):
+    """FTS5 index (external content) cho messages.question/answer, đồng bộ bằng trigger"""
+    if not fts5_available(conn):
+        print("[WARNING] SQLite build has no FTS5, conversation search will fall back to LIKE")
+        return
+    # remove_diacritics 2: gõ không dấu vẫn tìm được ("dao ham" khớp "đạo hàm")
+    conn.execute("""CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+        question, answer,
+        content='messages', content_rowid='seq',
+        tokenize='unicode61 remove_diacritics 2'
+    )""")
+    conn.execute("""CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+        INSERT INTO messages_fts (rowid, question, answer) VALUES (new.seq, new.question, new.answer);
+    END""")
+    conn.execute("""CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN
+        INSERT INTO messages_fts (messages_fts, rowid, question, answer)
+        VALUES ('delete', old.seq, old.question, old.answer);
+    END""")
+    conn.execute("""CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF question, answer ON messages BEGIN
+        INSERT INTO messages_fts (messages_fts, rowid, question, answer)
+        VALUES ('delete', old.seq, old.question, old.answer);
+        INSERT INTO messages_fts (rowid, question, answer) VALUES (new.seq, new.question, new.answer);
+    END""")
+    # index các tin nhắn đã có
+    conn.execute("INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')")
+
+
+# Bản sao cục bộ lịch Google của từng user, đồng bộ tăng dần bằng syncToken (calendar_sync.py).
+# start_at/end_at là giờ UTC dạng 'YYYY-MM-DDTHH:MM:SS' nên so sánh chuỗi đúng thứ tự thời gian
+_CALENDAR_MIRROR = [
+    """CREATE TABLE IF NOT EXISTS calendar_events (
+        user_id TEXT NOT NULL,
+        event_id TEXT NOT NULL,
+        summary TEXT,
+        start_at TEXT NOT NULL,
+        end_at TEXT NOT NULL,
+        all_day BOOLEAN DEFAULT 0,
+        transparent BOOLEAN DEFAULT 0,
+        is_deadline BOOLEAN DEFAULT 0,
+        event TEXT NOT NULL,
+        PRIMARY KEY (user_id, event_id)
+    )""",
+    # danh sách sự kiện, kiểm tra trùng lịch, deadline sắp tới: user_id AND start_at trong khoảng
+    "CREATE INDEX IF NOT EXISTS idx_calendar_events_user_start ON calendar_events (user_id, start_at)",
+    """CREATE TABLE IF NOT EXISTS calendar_sync_state (
+        user_id TEXT PRIMARY KEY,
+        sync_token TEXT,
+        synced_at REAL NOT NULL
+    )"""
+]
+
+
+MIGRATIONS: List[Tuple[int, str, List[MigrationStep]]] = [
+    (1, "baseline schema with composite indexes for hot queries", _BASELINE_SCHEMA + _CONVERSATION_INDEXES + _MESSAGE_INDEXES + [
+        # index một cột cũ đã bị các index trên bao phủ
+        "DROP INDEX IF EXISTS idx_conversations_user_id",
+        "DROP INDEX IF EXISTS idx_conversations_updated_at",
+        "DROP INDEX IF EXISTS idx_messages_conversation_id",
+        "DROP INDEX IF EXISTS idx_messages_timestamp"
+    ]),
+    (2, "integer rowid clustering for conversations and messages", _ROWID_TABLES + _CONVERSATION_INDEXES + _MESSAGE_INDEXES),
+    (3, "full-text search over message history", [_create_message_fts]),
+    (4, "local mirror of Google Calendar events", _CALENDAR_MIRROR),
+    (5, "rolling conversation summaries", [
+        # summary tóm tắt summarized_count tin nhắn đầu tiên của hội thoại (conversation_summary.py)
+        "ALTER TABLE conversations ADD COLUMN summary TEXT DEFAULT ''",
+        "ALTER TABLE conversations ADD COLUMN summarized_count INTEGER DEFAULT 0"
+    ])
+]
+
+
+def get_schema_version(conn: sqlite3.Connection) -> int:
+    """Version schema hiện tại của database"""
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def apply_migrations(conn: sqlite3.Connection, migrations: List[Tuple[int, str, List[MigrationStep]]] = None) -> int:
+    """Apply pending migrations in one transaction, returns the resulting schema version"""
+    migrations = MIGRATIONS if migrations is None else migrations
+
+    # BEGIN IMMEDIATE để nhiều worker khởi động cùng lúc không chạy trùng migration
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        current_version = get_schema_version(conn)
+        for version, description, steps in sorted(migrations, key=lambda m: m[0]):
+            if version <= current_version:
+                continue
+            print(f"[INFO] Applying database migration {version}: {description}")
+            for step in steps:
+                if callable(step):
+                    step(conn)
+                else:
+                    conn.execute(step)
+            conn.execute(f"PRAGMA user_version = {version}")
+            current_version = version
+        conn.commit()
+        return current_version
+    except Exception:
+        conn.rollback()
+        raise
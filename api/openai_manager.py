@@ -1,9 +1,16 @@
+import math
 import openai
 import time
-from typing import Dict, List, Optional, Any
+import asyncio
+import threading
+from typing import Dict, List, Optional, Any, Iterator
 from dataclasses import dataclass
 from enum import Enum
 from config import Config
+from context_builder import count_prompt_tokens, count_tokens
+from hedging import HedgeBudget, LatencyStats
+from rate_limiter import AdmissionController, AdmissionTimeout, retry_after_seconds
+from response_cache import ResponseCache
 
 # Khởi tạo OpenAI API key
 openai.api_key = Config.OPENAI_API_KEY
@@ -26,6 +33,9 @@ class ModelConfig:
     context_window: int
     best_for: List[str]
     temperature_default: float = 0.7
+    # giới hạn của tài khoản OpenAI (mặc định theo usage tier 1), ghi đè bằng OPENAI_RATE_LIMITS
+    requests_per_minute: int = 500
+    tokens_per_minute: int = 200000
 
 
 class OpenAIModelManager:
@@ -40,7 +50,8 @@ class OpenAIModelManager:
             cost_per_1k_tokens=0.0015,
             context_window=16385,
             best_for=["chatbot", "basic_qa", "summarization", "translation"],
-            temperature_default=0.7
+            temperature_default=0.7,
+            requests_per_minute=3500
         ),
         "gpt-3.5-turbo-16k": ModelConfig(
             name="gpt-3.5-turbo-16k",
@@ -49,7 +60,8 @@ class OpenAIModelManager:
             cost_per_1k_tokens=0.003,
             context_window=16385,
             best_for=["long_documents", "detailed_analysis"],
-            temperature_default=0.7
+            temperature_default=0.7,
+            requests_per_minute=3500
         ),
         "gpt-4": ModelConfig(
             name="gpt-4",
@@ -58,7 +70,8 @@ class OpenAIModelManager:
             cost_per_1k_tokens=0.03,
             context_window=8192,
             best_for=["complex_reasoning", "coding", "creative_writing"],
-            temperature_default=0.7
+            temperature_default=0.7,
+            tokens_per_minute=10000
         ),
         "gpt-4-turbo": ModelConfig(
             name="gpt-4-turbo",
@@ -67,7 +80,8 @@ class OpenAIModelManager:
             cost_per_1k_tokens=0.01,
             context_window=128000,
             best_for=["large_documents", "complex_analysis", "study_tools"],
-            temperature_default=0.7
+            temperature_default=0.7,
+            tokens_per_minute=30000
         ),
         "gpt-4o": ModelConfig(
             name="gpt-4o",
@@ -76,7 +90,8 @@ class OpenAIModelManager:
             cost_per_1k_tokens=0.005,
             context_window=128000,
             best_for=["multimodal", "image_analysis", "advanced_reasoning"],
-            temperature_default=0.7
+            temperature_default=0.7,
+            tokens_per_minute=30000
         ),
         "gpt-4o-mini": ModelConfig(
             name="gpt-4o-mini",
@@ -90,6 +105,17 @@ class OpenAIModelManager:
     }
     DEFAULT_MODEL = "gpt-4o-mini" 
     
+    # tag trong best_for ứng với từng task_type (model khớp được ưu tiên trong cùng tier)
+    TASK_TAGS = {
+        "general": ["simple_tasks", "fast_responses", "basic_qa", "chatbot"],
+        "summarization": ["summarization"],
+        "math": ["complex_reasoning", "advanced_reasoning"],
+        "programming": ["coding", "complex_reasoning"]
+    }
+    # chỉ các task này được lên tier cao hơn khi câu hỏi khó
+    ESCALATING_TASKS = {"math", "programming"}
+    HARD_TASK_TIERS = [ModelTier.ADVANCED, ModelTier.PREMIUM]
+    
     FALLBACK_CHAIN = [
         "gpt-4o-mini",
         "gpt-3.5-turbo",
@@ -98,36 +124,328 @@ class OpenAIModelManager:
     
     def __init__(self):
         self.current_model = self.DEFAULT_MODEL
+        self.router_settings = Config.ROUTER_SETTINGS
+        # manager là singleton dùng chung giữa các request thread
+        self._lock = threading.Lock()
         self.failed_models = set()  # Track các model đã fail
-        self.rate_limit_tracker = {}  # Track rate limiting
+        
+        # Token bucket RPM/TPM theo model: request chờ phía client thay vì nhận 429
+        limit_settings = Config.RATE_LIMIT_SETTINGS
+        self.max_retries = limit_settings['max_retries']
+        self.admission = AdmissionController(
+            self._rate_limits(limit_settings['limits']),
+            burst_seconds=limit_settings['burst_seconds'],
+            queue_timeout=limit_settings['queue_timeout'],
+            backoff_base=limit_settings['backoff_base'],
+            backoff_max=limit_settings['backoff_max'],
+            enforce_limits=limit_settings['enabled']
+        )
+        
+        # Latency từng model (ngưỡng hedge) và ngân sách cho request hedge
+        self.hedge_settings = Config.HEDGE_SETTINGS
+        self.latency = LatencyStats()
+        self.hedge_budget = HedgeBudget(
+            max_ratio=self.hedge_settings['max_ratio'],
+            cost_cap_per_hour=self.hedge_settings['cost_cap_per_hour']
+        ) if self.hedge_settings['enabled'] else None
+        
+        # Cache response cho câu hỏi không có context (exact + semantic)
+        cache_settings = Config.RESPONSE_CACHE_SETTINGS
+        self.embedding_model = Config.EMBEDDING_SETTINGS['model']
+        self.response_cache = ResponseCache(
+            max_entries=cache_settings['max_entries'],
+            ttl=cache_settings['ttl'],
+            semantic_threshold=cache_settings['semantic_threshold'],
+            embed=self.embed_text if cache_settings['semantic_enabled'] else None
+        ) if cache_settings['enabled'] else None
+    
+    @classmethod
+    def _rate_limits(cls, overrides: str) -> Dict[str, tuple]:
+        """(requests/phút, tokens/phút) của từng model, ghi đè bởi chuỗi "model=rpm:tpm,..." """
+        limits = {
+            name: (config.requests_per_minute, config.tokens_per_minute)
+            for name, config in cls.AVAILABLE_MODELS.items()
+        }
+        for item in filter(None, (part.strip() for part in overrides.split(','))):
+            try:
+                name, values = item.split('=')
+                rpm, tpm = values.split(':')
+                limits[name.strip()] = (int(rpm), int(tpm))
+            except ValueError:
+                print(f"[WARNING] Invalid OPENAI_RATE_LIMITS entry: {item}")
+        return limits
     
     @property
     def default_model(self):
         """Trả về model mặc định hiện tại"""
         return self.DEFAULT_MODEL
     
-    def get_model_for_task(self, task_type: str) -> str:
-        """Lấy model phù hợp nhất cho task cụ thể - sử dụng model mặc định"""
-        return self.DEFAULT_MODEL
+    def _is_hard_question(self, task_type: str, question: str) -> bool:
+        """Câu hỏi toán/lập trình khó (dài, nhiều dòng hoặc có code) mới cần model tier cao"""
+        if task_type not in self.ESCALATING_TASKS:
+            return False
+        return (
+            count_tokens(question, self.DEFAULT_MODEL) >= self.router_settings['hard_question_tokens']
+            or '```' in question
+            or question.count('\n') >= 3
+        )
+    
+    def _route_cost(self, model: str, prompt_tokens: int, max_tokens: Optional[int] = None) -> Optional[float]:
+        """
+        Chi phí tối đa (USD) của request với model: prompt + max_tokens thực sự được gửi (mặc định như chat_completion,
+        cắt theo context window như _response_token_limit). None nếu context window còn lại không đủ
+        expected_completion_tokens, vượt ngân sách hoặc model không khả dụng
+        """
+        settings = self.router_settings
+        config = self.AVAILABLE_MODELS[model]
+        requested = max_tokens if max_tokens is not None else min(config.max_tokens, 4096)
+        remaining = config.context_window - prompt_tokens
+        if remaining < min(settings['expected_completion_tokens'], requested) or not self._is_model_available(model):
+            return None
+        completion_tokens = min(requested, config.max_tokens, remaining)
+        cost = (prompt_tokens + completion_tokens) / 1000 * config.cost_per_1k_tokens
+        return cost if cost <= settings['max_cost_per_request'] else None
+    
+    def _route_score(self, model: str, cost: float, cheapest: float, tags: List[str]) -> float:
+        """Điểm của model (thấp hơn = tốt hơn): chi phí so với model rẻ nhất, latency p50, tỉ lệ lỗi, best_for"""
+        latency = self.latency.percentile(model, 0.5)
+        latency_score = latency / self.router_settings['latency_target'] if latency is not None else 0.5
+        # đắt gấp đôi ~ chậm hơn 1/4 latency_target; best_for chỉ phân định các model có chi phí/latency gần nhau
+        cost_score = 0.25 * math.log2(cost / cheapest) if cheapest > 0 else 0.0
+        match_bonus = 0.05 if any(tag in self.AVAILABLE_MODELS[model].best_for for tag in tags) else 0.0
+        return cost_score + latency_score + 4 * self.latency.error_rate(model) - match_bonus
+    
+    def get_model_for_task(self, task_type: str, messages: Optional[List[Dict[str, str]]] = None,
+                           max_tokens: Optional[int] = None) -> str:
+        """
+        Model cho request: tier theo task (chỉ toán/lập trình khó mới lên ADVANCED/PREMIUM), trong tier chọn model
+        vừa context window và ngân sách có điểm tốt nhất theo chi phí ước tính, latency p50, tỉ lệ lỗi và best_for
+        """
+        if not self.router_settings['enabled']:
+            return self.DEFAULT_MODEL
+        
+        messages = messages or []
+        question = next((m.get('content') or '' for m in reversed(messages) if m.get('role') == 'user'), '')
+        prompt_tokens = count_prompt_tokens(messages, self.DEFAULT_MODEL) if messages else 0
+        tiers = self.HARD_TASK_TIERS if self._is_hard_question(task_type, question) else [ModelTier.BASIC]
+        tags = self.TASK_TAGS.get(task_type, self.TASK_TAGS['general'])
+        
+        costs = {}
+        for name, config in self.AVAILABLE_MODELS.items():
+            if config.tier in tiers:
+                cost = self._route_cost(name, prompt_tokens, max_tokens)
+                if cost is not None:
+                    costs[name] = cost
+        if not costs:
+            # không model nào trong tier phù hợp: đi theo fallback chain
+            return self._get_fallback_model()
+        cheapest = min(costs.values())
+        return min(costs, key=lambda name: self._route_score(name, costs[name], cheapest, tags))
+    
+    def embed_texts(self, texts: List[str]) -> List[List[float]]:
+        """Gọi thẳng embedding API cho nhiều đoạn text (cùng thứ tự với input), không qua cache"""
+        response = openai.Embedding.create(model=self.embedding_model, input=texts)
+        return [item["embedding"] for item in sorted(response["data"], key=lambda item: item["index"])]
+    
+    def embed_text(self, text: str):
+        """Embedding câu hỏi lúc query qua embedding service (gộp batch, cache LRU trong bộ nhớ, không ghi đĩa)"""
+        from embedding_service import get_embedding_service
+        return get_embedding_service().embed_query(text)
+    
+    def _cache_hit_result(self, cached_response, model: str) -> Dict[str, Any]:
+        """Kết quả chat_completion cho response lấy từ cache"""
+        print(f"[DEBUG] Response cache hit for model: {model}")
+        return {
+            "response": cached_response,
+            "model_used": model,
+            "cost_estimate": 0,
+            "success": True,
+            "cache_hit": True
+        }
     
     def _is_model_available(self, model_name: str) -> bool:
         """Kiểm tra xem model có khả dụng không"""
         # Kiểm tra model có trong danh sách failed
-        if model_name in self.failed_models:
-            return False
-        
-        # Kiểm tra rate limiting
-        if model_name in self.rate_limit_tracker:
-            last_limit_time = self.rate_limit_tracker[model_name]
-            if time.time() - last_limit_time < 60:  # chờ 1 phút sau khi rate limit
+        with self._lock:
+            if model_name in self.failed_models:
                 return False
         
+        # Kiểm tra rate limiting (model đang bị chặn sau 429)
+        if self.admission.is_blocked(model_name):
+            return False
+        
         return model_name in self.AVAILABLE_MODELS
     
-    def _get_fallback_model(self) -> str:
-        """Tìm model fallback khả dụng"""
+    def _mark_failed(self, model: str):
+        with self._lock:
+            self.failed_models.add(model)
+    
+    def _mark_recovered(self, model: str):
+        with self._lock:
+            self.failed_models.discard(model)
+    
+    def _failed_list(self) -> List[str]:
+        with self._lock:
+            return list(self.failed_models)
+    
+    @staticmethod
+    def _used_tokens(response) -> Optional[int]:
+        try:
+            return response.usage.total_tokens
+        except AttributeError:
+            return None
+    
+    def _create(self, model: str, messages: List[Dict[str, str]], temperature: float, max_tokens: int,
+                deadline: Optional[float] = None, **kwargs):
+        """
+        openai.ChatCompletion.create qua admission control: chờ tới lượt trong bucket của model,
+        gặp 429 thì chờ theo retry-after/backoff rồi thử lại (tối đa max_retries, không quá deadline)
+        """
+        deadline = deadline or self.admission.deadline()
+        reserved = count_prompt_tokens(messages, model) + max_tokens
+        for attempt in range(self.max_retries + 1):
+            self.admission.acquire(model, reserved, deadline)
+            started = time.monotonic()
+            try:
+                response = openai.ChatCompletion.create(
+                    model=model,
+                    messages=messages,
+                    temperature=temperature,
+                    max_tokens=max_tokens,
+                    **kwargs
+                )
+            except openai.error.RateLimitError as e:
+                # request bị từ chối không tính vào quota: trả lại chỗ đã đặt trước khi đặt lại ở lần thử sau
+                self.admission.release(model, reserved)
+                self.latency.record_error(model)
+                delay = self.admission.on_rate_limit(model, retry_after_seconds(e))
+                print(f"[WARNING] Rate limit hit for {model}, backing off {delay:.1f}s: {e}")
+                if attempt == self.max_retries:
+                    raise
+                continue
+            except openai.error.OpenAIError:
+                self.admission.release(model, reserved)
+                self.latency.record_error(model)
+                raise
+            self.admission.on_success(model)
+            if not kwargs.get('stream'):
+                self.latency.record(model, time.monotonic() - started)
+                self.admission.settle(model, reserved, self._used_tokens(response) or reserved)
+            return response
+    
+    async def _acreate(self, model: str, messages: List[Dict[str, str]], temperature: float, max_tokens: int,
+                       deadline: Optional[float] = None, **kwargs):
+        """Bản async của _create (openai.ChatCompletion.acreate, chờ bucket bằng asyncio.sleep)"""
+        deadline = deadline or self.admission.deadline()
+        reserved = count_prompt_tokens(messages, model) + max_tokens
+        for attempt in range(self.max_retries + 1):
+            await self.admission.aacquire(model, reserved, deadline)
+            started = time.monotonic()
+            try:
+                response = await openai.ChatCompletion.acreate(
+                    model=model,
+                    messages=messages,
+                    temperature=temperature,
+                    max_tokens=max_tokens,
+                    **kwargs
+                )
+            except openai.error.RateLimitError as e:
+                # request bị từ chối không tính vào quota: trả lại chỗ đã đặt trước khi đặt lại ở lần thử sau
+                self.admission.release(model, reserved)
+                self.latency.record_error(model)
+                delay = self.admission.on_rate_limit(model, retry_after_seconds(e))
+                print(f"[WARNING] Rate limit hit for {model}, backing off {delay:.1f}s: {e}")
+                if attempt == self.max_retries:
+                    raise
+                continue
+            except openai.error.OpenAIError:
+                self.admission.release(model, reserved)
+                self.latency.record_error(model)
+                raise
+            except asyncio.CancelledError:
+                # bên thua của hedge: thời gian đã chờ là cận dưới latency thật, vẫn ghi lại để model luôn thua
+                # không giữ p95 thấp giả tạo (ngưỡng hedge và routing đều đọc LatencyStats)
+                self.latency.record(model, time.monotonic() - started)
+                raise
+            self.admission.on_success(model)
+            self.latency.record(model, time.monotonic() - started)
+            self.admission.settle(model, reserved, self._used_tokens(response) or reserved)
+            return response
+    
+    def _hedge_delay(self, model: str) -> float:
+        """Thời gian chờ model chính trước khi hedge: phân vị latency (p95) của model, mặc định khi chưa đủ mẫu"""
+        settings = self.hedge_settings
+        delay = self.latency.percentile(model, settings['percentile'], settings['min_samples'])
+        return max(settings['min_delay'], delay if delay is not None else settings['default_delay'])
+    
+    def _hedge_model(self, model: str) -> Optional[str]:
+        """Model kế tiếp còn khả dụng sau model chính trong FALLBACK_CHAIN"""
+        start = self.FALLBACK_CHAIN.index(model) + 1 if model in self.FALLBACK_CHAIN else 0
+        for candidate in self.FALLBACK_CHAIN[start:] + self.FALLBACK_CHAIN[:start]:
+            if candidate != model and self._is_model_available(candidate):
+                return candidate
+        return None
+    
+    def _estimated_cost(self, model: str, messages: List[Dict[str, str]]) -> float:
+        """Chi phí tối thiểu của request bị huỷ giữa chừng (chỉ tính prompt)"""
+        return count_prompt_tokens(messages, model) / 1000 * self.AVAILABLE_MODELS[model].cost_per_1k_tokens
+    
+    async def _acreate_hedged(self, model: str, messages: List[Dict[str, str]], temperature: float, max_tokens: int, **kwargs):
+        """
+        _acreate với hedging: model chính chưa xong sau _hedge_delay -> gửi thêm tới model kế tiếp (nếu ngân sách cho phép),
+        trả về (response, model) của request thành công đầu tiên; request thua bị huỷ thật (đóng kết nối).
+        Chỉ có ở đường async: request HTTP sync không huỷ được, bên thua sẽ chạy hết và vượt ngân sách hedge
+        """
+        primary_tokens = self._response_token_limit(model, messages, max_tokens)
+        if self.hedge_budget is None or kwargs:
+            return await self._acreate(model, messages, temperature, primary_tokens, **kwargs), model
+        
+        self.hedge_budget.record_request()
+        primary = asyncio.ensure_future(self._acreate(model, messages, temperature, primary_tokens))
+        done, _ = await asyncio.wait({primary}, timeout=self._hedge_delay(model))
+        if done:
+            return primary.result(), model
+        
+        hedge_model = self._hedge_model(model)
+        if hedge_model is None or not self.hedge_budget.try_acquire():
+            return await primary, model
+        
+        print(f"[DEBUG] {model} slower than hedge threshold, hedging with {hedge_model}")
+        tasks = {
+            primary: model,
+            asyncio.ensure_future(self._acreate(hedge_model, messages, temperature,
+                                                self._response_token_limit(hedge_model, messages, max_tokens))): hedge_model
+        }
+        pending, error = set(tasks), None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is not None:
+                    error = task.exception()
+                    continue
+                for loser in pending:
+                    loser.cancel()
+                    self.hedge_budget.charge(self._estimated_cost(tasks[loser], messages))
+                if tasks[task] == hedge_model:
+                    self.hedge_budget.record_win()
+                return task.result(), tasks[task]
+        raise error
+    
+    @staticmethod
+    def _is_context_length_error(error) -> bool:
+        """Prompt/max_tokens vượt context window: lỗi của request chứ không phải của model, không đánh dấu model lỗi"""
+        return getattr(error, 'code', None) == 'context_length_exceeded' or 'maximum context length' in str(error)
+    
+    def _response_token_limit(self, model: str, messages: List[Dict[str, str]], max_tokens: int) -> int:
+        """max_tokens vừa với model: không vượt max_tokens của model và phần context_window còn lại sau prompt"""
+        model_config = self.AVAILABLE_MODELS[model]
+        remaining = model_config.context_window - count_prompt_tokens(messages, model)
+        return max(1, min(max_tokens, model_config.max_tokens, remaining))
+    
+    def _get_fallback_model(self, exclude: Optional[str] = None) -> str:
+        """Tìm model fallback khả dụng (khác exclude: model vừa lỗi)"""
         for model in self.FALLBACK_CHAIN:
-            if self._is_model_available(model):
+            if model != exclude and self._is_model_available(model):
                 return model
         
         # Nếu tất cả fail, dùng model đầu tiên trong fallback chain
@@ -139,12 +457,16 @@ class OpenAIModelManager:
         task_type: str = "general",
         temperature: Optional[float] = None,
         max_tokens: Optional[int] = None,
+        model: Optional[str] = None,
+        use_cache: bool = True,
         **kwargs
     ) -> Dict[str, Any]:
         """
         Tạo chat completion với automatic model selection và fallback
+        (model: model caller đã route trước khi dựng prompt, None thì tự chọn theo task;
+        use_cache=False cho request không phải câu hỏi của người dùng, vd. tóm tắt hội thoại)
         """
-        model = self.get_model_for_task(task_type)
+        model = model or self.get_model_for_task(task_type, messages, max_tokens)
         model_config = self.AVAILABLE_MODELS[model]
         
         # Sử dụng temperature mặc định của model nếu không được chỉ định
@@ -155,38 +477,44 @@ class OpenAIModelManager:
         if max_tokens is None:
             max_tokens = min(model_config.max_tokens, 4096)
         
+        # Câu hỏi không có context (và không có tham số đặc biệt) có thể dùng response đã cache
+        cache = self.response_cache if use_cache and not kwargs else None
+        if cache:
+            cached = cache.get(messages, model)
+            if cached is not None:
+                return self._cache_hit_result(cached, model)
+        
         # Thử gọi API với model đã chọn
         try:
             print(f"[DEBUG] Using model: {model} for task: {task_type}")
             
-            response = openai.ChatCompletion.create(
-                model=model,
-                messages=messages,
-                temperature=temperature,
-                max_tokens=max_tokens,
-                **kwargs
-            )
+            # không hedge ở đường sync (xem _acreate_hedged)
+            response = self._create(model, messages, temperature,
+                                    self._response_token_limit(model, messages, max_tokens), **kwargs)
+            model_used = model
             
             # Reset failed status nếu thành công
-            if model in self.failed_models:
-                self.failed_models.remove(model)
+            self._mark_recovered(model_used)
+            
+            if cache:
+                cache.put(messages, model, response)
             
             return {
                 "response": response,
-                "model_used": model,
-                "cost_estimate": self._calculate_cost(response, model_config),
+                "model_used": model_used,
+                "cost_estimate": self._calculate_cost(response, self.AVAILABLE_MODELS[model_used]),
                 "success": True
             }
             
-        except openai.error.RateLimitError as e:
-            print(f"[WARNING] Rate limit hit for {model}: {e}")
-            self.rate_limit_tracker[model] = time.time()
+        except (openai.error.RateLimitError, AdmissionTimeout) as e:
+            print(f"[WARNING] Rate limit for {model}, trying fallback: {e}")
             return self._try_fallback(messages, task_type, temperature, max_tokens, **kwargs)
         
         except openai.error.InvalidRequestError as e:
             print(f"[ERROR] Invalid request for {model}: {e}")
-            self.failed_models.add(model)
-            return self._try_fallback(messages, task_type, temperature, max_tokens, **kwargs)
+            if not self._is_context_length_error(e):
+                self._mark_failed(model)
+            return self._try_fallback(messages, task_type, temperature, max_tokens, exclude=model, **kwargs)
         
         except Exception as e:
             print(f"[ERROR] Unexpected error with {model}: {e}")
@@ -204,20 +532,129 @@ class OpenAIModelManager:
         task_type: str,
         temperature: float,
         max_tokens: int,
+        exclude: Optional[str] = None,
         **kwargs
     ) -> Dict[str, Any]:
         """Thử sử dụng model fallback"""
-        fallback_model = self._get_fallback_model()
+        fallback_model = self._get_fallback_model(exclude)
+        fallback_config = self.AVAILABLE_MODELS[fallback_model]
+        
+        try:
+            print(f"[DEBUG] Falling back to model: {fallback_model}")
+            
+            response = self._create(
+                fallback_model,
+                messages,
+                temperature,
+                self._response_token_limit(fallback_model, messages, max_tokens),
+                **kwargs
+            )
+            
+            return {
+                "response": response,
+                "model_used": fallback_model,
+                "cost_estimate": self._calculate_cost(response, fallback_config),
+                "success": True,
+                "fallback_used": True
+            }
+            
+        except Exception as e:
+            print(f"[ERROR] Fallback model {fallback_model} also failed: {e}")
+            return {
+                "response": None,
+                "model_used": fallback_model,
+                "cost_estimate": 0,
+                "success": False,
+                "error": f"All models failed. Last error: {str(e)}"
+            }
+    
+    async def achat_completion(
+        self,
+        messages: List[Dict[str, str]],
+        task_type: str = "general",
+        temperature: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+        model: Optional[str] = None,
+        use_cache: bool = True,
+        **kwargs
+    ) -> Dict[str, Any]:
+        """
+        Bản async của chat_completion (openai.ChatCompletion.acreate): request đang chờ model
+        không giữ thread nào, cùng kết quả và cơ chế fallback như bản sync
+        """
+        model = model or self.get_model_for_task(task_type, messages, max_tokens)
+        model_config = self.AVAILABLE_MODELS[model]
+        
+        if temperature is None:
+            temperature = model_config.temperature_default
+        if max_tokens is None:
+            max_tokens = min(model_config.max_tokens, 4096)
+        
+        # cache lookup có thể gọi API embedding (sync) nên chạy trong thread pool
+        cache = self.response_cache if use_cache and not kwargs else None
+        if cache:
+            cached = await asyncio.to_thread(cache.get, messages, model)
+            if cached is not None:
+                return self._cache_hit_result(cached, model)
+        
+        try:
+            print(f"[DEBUG] Using model (async): {model} for task: {task_type}")
+            
+            response, model_used = await self._acreate_hedged(model, messages, temperature, max_tokens, **kwargs)
+            
+            self._mark_recovered(model_used)
+            
+            if cache:
+                await asyncio.to_thread(cache.put, messages, model, response)
+            
+            return {
+                "response": response,
+                "model_used": model_used,
+                "cost_estimate": self._calculate_cost(response, self.AVAILABLE_MODELS[model_used]),
+                "success": True
+            }
+            
+        except (openai.error.RateLimitError, AdmissionTimeout) as e:
+            print(f"[WARNING] Rate limit for {model}, trying fallback: {e}")
+            return await self._atry_fallback(messages, task_type, temperature, max_tokens, **kwargs)
+        
+        except openai.error.InvalidRequestError as e:
+            print(f"[ERROR] Invalid request for {model}: {e}")
+            if not self._is_context_length_error(e):
+                self._mark_failed(model)
+            return await self._atry_fallback(messages, task_type, temperature, max_tokens, exclude=model, **kwargs)
+        
+        except Exception as e:
+            print(f"[ERROR] Unexpected error with {model}: {e}")
+            return {
+                "response": None,
+                "model_used": model,
+                "cost_estimate": 0,
+                "success": False,
+                "error": str(e)
+            }
+    
+    async def _atry_fallback(
+        self,
+        messages: List[Dict[str, str]],
+        task_type: str,
+        temperature: float,
+        max_tokens: int,
+        exclude: Optional[str] = None,
+        **kwargs
+    ) -> Dict[str, Any]:
+        """Bản async của _try_fallback"""
+        fallback_model = self._get_fallback_model(exclude)
         fallback_config = self.AVAILABLE_MODELS[fallback_model]
         
         try:
             print(f"[DEBUG] Falling back to model: {fallback_model}")
             
-            response = openai.ChatCompletion.create(
-                model=fallback_model,
-                messages=messages,
-                temperature=temperature,
-                max_tokens=min(max_tokens, fallback_config.max_tokens),
+            response = await self._acreate(
+                fallback_model,
+                messages,
+                temperature,
+                self._response_token_limit(fallback_model, messages, max_tokens),
                 **kwargs
             )
             
@@ -239,6 +676,82 @@ class OpenAIModelManager:
                 "error": f"All models failed. Last error: {str(e)}"
             }
     
+    def chat_completion_stream(
+        self,
+        messages: List[Dict[str, str]],
+        task_type: str = "general",
+        temperature: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+        model: Optional[str] = None,
+        use_cache: bool = True,
+        **kwargs
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Chat completion dạng stream: yield {"content": ...} cho từng đoạn text, cuối cùng
+        yield {"done": True, "model_used": ...}. Fallback chỉ áp dụng khi lỗi xảy ra trước chunk đầu tiên.
+        """
+        model = model or self.get_model_for_task(task_type, messages, max_tokens)
+        model_config = self.AVAILABLE_MODELS[model]
+        
+        if temperature is None:
+            temperature = model_config.temperature_default
+        if max_tokens is None:
+            max_tokens = min(model_config.max_tokens, 4096)
+        
+        cache = self.response_cache if use_cache and not kwargs else None
+        if cache:
+            cached = cache.get(messages, model)
+            if cached is not None:
+                print(f"[DEBUG] Response cache hit for model: {model}")
+                yield {"content": cached.choices[0].message.content}
+                yield {"done": True, "model_used": model}
+                return
+        
+        try:
+            print(f"[DEBUG] Streaming with model: {model} for task: {task_type}")
+            stream = self._create_stream(model, messages, temperature, max_tokens, **kwargs)
+        except (openai.error.RateLimitError, openai.error.InvalidRequestError, AdmissionTimeout) as e:
+            print(f"[WARNING] Streaming request failed for {model}: {e}")
+            if isinstance(e, openai.error.InvalidRequestError) and not self._is_context_length_error(e):
+                self._mark_failed(model)
+            model = self._get_fallback_model(exclude=model)
+            print(f"[DEBUG] Falling back to model: {model}")
+            stream = self._create_stream(model, messages, temperature, max_tokens, **kwargs)
+        
+        chunks = []
+        for chunk in stream:
+            if not chunk.choices:
+                continue
+            content = chunk.choices[0].delta.get("content")
+            if content:
+                chunks.append(content)
+                yield {"content": content}
+        
+        if cache and chunks:
+            # lưu dưới dạng response object giống bản không stream để hai đường dùng chung cache
+            cache.put(messages, model, openai.openai_object.OpenAIObject.construct_from({
+                "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(chunks)}, "finish_reason": "stop"}]
+            }))
+        
+        # stream không trả usage: trả lại phần token đặt dư theo số token thực sự nhận được
+        reserved = count_prompt_tokens(messages, model) + self._response_token_limit(model, messages, max_tokens)
+        self.admission.settle(model, reserved, count_prompt_tokens(messages, model) + count_tokens("".join(chunks), model))
+        
+        self._mark_recovered(model)
+        yield {"done": True, "model_used": model}
+    
+    def _create_stream(self, model: str, messages: List[Dict[str, str]], temperature: float, max_tokens: int, **kwargs):
+        """Mở request stream=True tới model (qua admission control)"""
+        return self._create(
+            model,
+            messages,
+            temperature,
+            self._response_token_limit(model, messages, max_tokens),
+            stream=True,
+            **kwargs
+        )
+    
     def _calculate_cost(self, response, model_config: ModelConfig) -> float:
         """Tính toán chi phí ước tính của request"""
         try:
@@ -276,17 +789,22 @@ class OpenAIModelManager:
     
     def reset_failed_models(self):
         """Reset danh sách các model đã fail - dùng khi muốn thử lại"""
-        self.failed_models.clear()
+        with self._lock:
+            self.failed_models.clear()
         print("[INFO] Reset failed models list")
     
     def get_status(self) -> Dict[str, Any]:
         """Lấy status hiện tại của manager"""
         return {
             "current_model": self.current_model,
-            "failed_models": list(self.failed_models),
-            "rate_limited_models": list(self.rate_limit_tracker.keys()),
+            "failed_models": self._failed_list(),
+            "rate_limited_models": self.admission.blocked_models(),
+            "rate_limiter": self.admission.get_stats(),
+            "latency": self.latency.get_stats(),
+            "hedging": self.hedge_budget.get_stats() if self.hedge_budget else None,
             "available_models": self.list_available_models(),
-            "total_models": len(self.AVAILABLE_MODELS)
+            "total_models": len(self.AVAILABLE_MODELS),
+            "response_cache": self.response_cache.get_stats() if self.response_cache else None
         }
 
 
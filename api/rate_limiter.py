@@ -0,0 +1,203 @@
+"""
+Admission control cho OpenAI API: token bucket theo model cho requests/phút và tokens/phút
+
+- Mỗi request đặt trước 1 request + (prompt token + max_tokens) trong bucket của model; bucket cho phép
+  "nợ", request chờ phía client tới khi phần nợ được nạp lại -> hàng đợi FIFO, không bắn 429 khi tải dồn
+- Request phải chờ lâu hơn deadline bị từ chối ngay (AdmissionTimeout) để caller fallback sang model khác
+- Sau khi có response, phần token đặt dư được trả lại theo usage thật
+- Khi vẫn bị 429: chặn model theo retry-after của server (hoặc exponential backoff có jitter nếu không có);
+  chỗ đã đặt của request bị từ chối được trả lại
+- RATE_LIMIT_ENABLED=false: không giới hạn phía client, chỉ còn backoff sau 429
+"""
+import asyncio
+import random
+import re
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+
+class AdmissionTimeout(Exception):
+    """Request không thể được gửi trước deadline (bucket hết hoặc model đang bị chặn sau 429)"""
+
+
+class TokenBucket:
+    """Token bucket nạp liên tục rate_per_minute/60 mỗi giây, dung lượng burst_seconds giây"""
+
+    def __init__(self, rate_per_minute: float, burst_seconds: float = 10):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = max(1.0, self.rate * burst_seconds)
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount: float, now: float) -> float:
+        """Trừ amount (có thể xuống âm), trả về số giây phải chờ tới khi trả hết nợ"""
+        self._refill(now)
+        self.level -= amount
+        return max(0.0, -self.level / self.rate)
+
+    def refund(self, amount: float, now: float):
+        self._refill(now)
+        self.level = min(self.capacity, self.level + amount)
+
+
+class _ModelState:
+    def __init__(self, requests_per_minute: int, tokens_per_minute: int, burst_seconds: float):
+        self.requests = TokenBucket(requests_per_minute, burst_seconds)
+        self.tokens = TokenBucket(tokens_per_minute, burst_seconds)
+        self.blocked_until = 0.0  # monotonic, sau 429
+        self.failures = 0  # số 429 liên tiếp (cho backoff)
+
+
+def _parse_duration(value: str) -> Optional[float]:
+    """'20', '1.5s', '250ms', '6m0s' -> giây"""
+    value = value.strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = re.findall(r'(\d+(?:\.\d+)?)(ms|h|m|s)', value)
+    if not parts:
+        return None
+    units = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}
+    return sum(float(number) * units[unit] for number, unit in parts)
+
+
+def retry_after_seconds(error) -> Optional[float]:
+    """Thời gian chờ server yêu cầu trong headers của RateLimitError, None nếu không có"""
+    headers = getattr(error, 'headers', None) or {}
+    if 'retry-after-ms' in headers:
+        try:
+            return float(headers['retry-after-ms']) / 1000
+        except ValueError:
+            pass
+    for name in ('retry-after', 'x-ratelimit-reset-requests', 'x-ratelimit-reset-tokens'):
+        if name in headers:
+            seconds = _parse_duration(str(headers[name]))
+            if seconds is not None:
+                return seconds
+    return None
+
+
+class AdmissionController:
+    """Token bucket RPM/TPM và trạng thái 429 của từng model, dùng chung giữa các thread và event loop"""
+
+    def __init__(self, limits: Dict[str, Tuple[int, int]], burst_seconds: float = 10,
+                 queue_timeout: float = 20, backoff_base: float = 1, backoff_max: float = 60,
+                 enforce_limits: bool = True):
+        self.burst_seconds = burst_seconds
+        self.enforce_limits = enforce_limits
+        self.queue_timeout = queue_timeout
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._lock = threading.Lock()
+        self._models = {
+            model: _ModelState(rpm, tpm, burst_seconds)
+            for model, (rpm, tpm) in limits.items()
+        }
+        self.stats = {'admitted': 0, 'queued': 0, 'rejected': 0, 'rate_limited': 0, 'wait_seconds': 0.0}
+
+    def deadline(self) -> float:
+        """Deadline mặc định (monotonic) cho một request mới"""
+        return time.monotonic() + self.queue_timeout
+
+    def reserve(self, model: str, tokens: int, deadline: float) -> float:
+        """
+        Đặt chỗ cho một request: trả về số giây phải chờ trước khi gửi,
+        AdmissionTimeout nếu không kịp trước deadline (không đặt gì)
+        """
+        with self._lock:
+            state = self._models.get(model)
+            if state is None:
+                return 0.0
+            now = time.monotonic()
+            if not self.enforce_limits:
+                wait = max(0.0, state.blocked_until - now)
+            else:
+                wait = max(
+                    state.blocked_until - now,
+                    state.requests.reserve(1, now),
+                    state.tokens.reserve(tokens, now)
+                )
+            if now + wait > deadline:
+                if self.enforce_limits:
+                    state.requests.refund(1, now)
+                    state.tokens.refund(tokens, now)
+                self.stats['rejected'] += 1
+                raise AdmissionTimeout(f"{model}: cần chờ {wait:.1f}s, vượt deadline")
+            self.stats['admitted'] += 1
+            if wait > 0:
+                self.stats['queued'] += 1
+                self.stats['wait_seconds'] += wait
+            return wait
+
+    def acquire(self, model: str, tokens: int, deadline: Optional[float] = None):
+        """Chờ (blocking) tới lượt gửi request"""
+        wait = self.reserve(model, tokens, deadline or self.deadline())
+        if wait > 0:
+            time.sleep(wait)
+
+    async def aacquire(self, model: str, tokens: int, deadline: Optional[float] = None):
+        """Bản async của acquire: chờ không giữ thread"""
+        wait = self.reserve(model, tokens, deadline or self.deadline())
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def settle(self, model: str, reserved_tokens: int, used_tokens: int):
+        """Trả lại phần token đặt dư khi usage thật nhỏ hơn ước lượng"""
+        with self._lock:
+            state = self._models.get(model)
+            if self.enforce_limits and state is not None and used_tokens < reserved_tokens:
+                state.tokens.refund(reserved_tokens - used_tokens, time.monotonic())
+
+    def release(self, model: str, reserved_tokens: int):
+        """Trả lại toàn bộ chỗ đã đặt (1 request + token) của request bị server từ chối"""
+        with self._lock:
+            state = self._models.get(model)
+            if self.enforce_limits and state is not None:
+                now = time.monotonic()
+                state.requests.refund(1, now)
+                state.tokens.refund(reserved_tokens, now)
+
+    def on_success(self, model: str):
+        with self._lock:
+            state = self._models.get(model)
+            if state is not None:
+                state.failures = 0
+
+    def on_rate_limit(self, model: str, retry_after: Optional[float] = None) -> float:
+        """Chặn model sau 429: theo retry-after nếu có, không thì exponential backoff có jitter"""
+        with self._lock:
+            state = self._models.get(model)
+            if state is None:
+                return 0.0
+            state.failures += 1
+            backoff = min(self.backoff_max, self.backoff_base * 2 ** (state.failures - 1))
+            # jitter để các request cùng bị 429 không quay lại cùng lúc; không bao giờ sớm hơn retry-after
+            delay = max(retry_after or 0.0, random.uniform(backoff / 2, backoff))
+            state.blocked_until = max(state.blocked_until, time.monotonic() + delay)
+            self.stats['rate_limited'] += 1
+            return delay
+
+    def is_blocked(self, model: str) -> bool:
+        with self._lock:
+            state = self._models.get(model)
+            return state is not None and state.blocked_until > time.monotonic()
+
+    def blocked_models(self) -> Dict[str, float]:
+        """Model đang bị chặn sau 429 -> số giây còn lại"""
+        now = time.monotonic()
+        with self._lock:
+            return {
+                model: round(state.blocked_until - now, 1)
+                for model, state in self._models.items()
+                if state.blocked_until > now
+            }
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            return dict(self.stats, wait_seconds=round(self.stats['wait_seconds'], 2))
@@ -0,0 +1,252 @@
+"""
+Response cache cho các câu hỏi không phụ thuộc context
+
+Hai tầng:
+- exact: key = câu hỏi đã chuẩn hóa + toàn bộ system messages + model
+- semantic: cosine similarity giữa embedding của câu hỏi, chỉ so với các entry cùng scope
+  (model + system prompt đầu tiên, không gồm grounding passages thay đổi theo từng câu hỏi)
+
+Cả hai tầng dùng chung một LRU có TTL. Các lượt hỏi có lịch sử hội thoại (context, kể cả summary
+của hội thoại) luôn bypass cache.
+"""
+import hashlib
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+# system message mở đầu bằng tiền tố này là summary của hội thoại (conversation_summary.py) -> request có context
+SUMMARY_PREFIX = "Tóm tắt cuộc hội thoại trước đó:"
+
+
+def normalize_prompt(text: str) -> str:
+    """Chuẩn hóa câu hỏi để các biến thể viết hoa/khoảng trắng/dấu câu cuối dùng chung key"""
+    text = unicodedata.normalize('NFC', text).lower()
+    text = re.sub(r'\s+', ' ', text).strip()
+    return text.rstrip('?!.… ')
+
+
+@dataclass
+class _CacheEntry:
+    value: Any
+    expires_at: float
+    slot: Optional[int] = None
+
+
+class ResponseCache:
+    """LRU + TTL cache cho response của OpenAI, có tầng semantic dựa trên embedding"""
+
+    def __init__(
+        self,
+        max_entries: int = 2048,
+        ttl: int = 86400,
+        semantic_threshold: float = 0.95,
+        embed: Optional[Callable[[str], Optional[List[float]]]] = None
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.semantic_threshold = semantic_threshold
+        # semantic tier cần numpy và một hàm embedding
+        self._embed = embed if np is not None else None
+        if embed is not None and np is None:
+            print("[WARNING] numpy not installed, semantic response cache disabled")
+
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, _CacheEntry]" = OrderedDict()
+
+        # Semantic tier: mỗi entry có embedding chiếm một slot (một hàng của ma trận)
+        self._vectors = None                                    # (max_entries, dim), L2-normalized
+        self._slot_keys: List[Optional[str]] = [None] * max_entries
+        self._slot_scopes = np.full(max_entries, -1, dtype=np.int64) if self._embed else None
+        # scope -> id và số slot đang dùng id đó; scope hết slot thì bị xóa để dict không lớn dần
+        self._scope_ids: Dict[str, int] = {}
+        self._scope_refs: Dict[int, int] = {}
+        self._scope_names: Dict[int, str] = {}
+        self._next_scope_id = 0
+        self._free_slots = list(range(max_entries - 1, -1, -1))
+
+        self.stats = {
+            'exact_hits': 0,
+            'semantic_hits': 0,
+            'misses': 0,
+            'bypassed': 0,
+            'evictions': 0,
+            'expirations': 0
+        }
+
+    @staticmethod
+    def _split_messages(messages: List[Dict[str, str]], model: str) -> Optional[Tuple[str, str, str]]:
+        """(câu hỏi đã chuẩn hóa, scope exact, scope semantic) hoặc None nếu lượt hỏi phụ thuộc context"""
+        system_parts = [m.get('content', '') for m in messages if m.get('role') == 'system']
+        user_parts = [m.get('content', '') for m in messages if m.get('role') == 'user']
+        if len(user_parts) != 1 or len(system_parts) + 1 != len(messages):
+            return None
+        if any(part.startswith(SUMMARY_PREFIX) for part in system_parts):
+            return None
+        question = normalize_prompt(user_parts[0])
+        if not question:
+            return None
+        semantic_scope = hashlib.sha256(
+            (model + '\x00' + (system_parts[0] if system_parts else '')).encode('utf-8')
+        ).hexdigest()
+        return question, model + '\x00' + '\x00'.join(system_parts), semantic_scope
+
+    @staticmethod
+    def _key(question: str, scope: str) -> str:
+        return hashlib.sha256(f"{scope}\x00{question}".encode('utf-8')).hexdigest()
+
+    def _embedding(self, question: str):
+        """Embedding đã chuẩn hóa L2 của câu hỏi (None nếu không tính được)"""
+        # embedding service cache vector theo nội dung, put() sau get() không gọi lại API
+        try:
+            raw = self._embed(question)
+        except Exception as e:
+            print(f"[WARNING] Embedding for response cache failed: {e}")
+            return None
+        if raw is None:
+            return None
+
+        vector = np.asarray(raw, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        if not norm:
+            return None
+        return vector / norm
+
+    def _remove(self, key: str):
+        """Xóa entry và giải phóng slot semantic (gọi khi đang giữ lock)"""
+        entry = self._entries.pop(key)
+        if entry.slot is not None:
+            self._release_scope(int(self._slot_scopes[entry.slot]))
+            self._slot_keys[entry.slot] = None
+            self._slot_scopes[entry.slot] = -1
+            self._free_slots.append(entry.slot)
+
+    def _acquire_scope(self, scope: str) -> int:
+        """Id của scope cho một slot mới (gọi khi đang giữ lock)"""
+        scope_id = self._scope_ids.get(scope)
+        if scope_id is None:
+            scope_id = self._next_scope_id
+            self._next_scope_id += 1
+            self._scope_ids[scope] = scope_id
+            self._scope_names[scope_id] = scope
+            self._scope_refs[scope_id] = 0
+        self._scope_refs[scope_id] += 1
+        return scope_id
+
+    def _release_scope(self, scope_id: int):
+        """Bỏ một slot khỏi scope, xóa scope khi không còn slot nào (gọi khi đang giữ lock)"""
+        self._scope_refs[scope_id] -= 1
+        if self._scope_refs[scope_id] == 0:
+            del self._scope_refs[scope_id]
+            del self._scope_ids[self._scope_names.pop(scope_id)]
+
+    def _valid_entry(self, key: str, now: float) -> Optional[_CacheEntry]:
+        """Entry còn hạn (đánh dấu mới dùng cho LRU), xóa nếu đã hết hạn"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires_at <= now:
+            self._remove(key)
+            self.stats['expirations'] += 1
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def get(self, messages: List[Dict[str, str]], model: str) -> Optional[Any]:
+        """Response đã cache cho request này, None nếu miss hoặc bypass"""
+        split = self._split_messages(messages, model)
+        if split is None:
+            with self._lock:
+                self.stats['bypassed'] += 1
+            return None
+        question, scope, semantic_scope = split
+        key = self._key(question, scope)
+        now = time.time()
+
+        with self._lock:
+            entry = self._valid_entry(key, now)
+            if entry is not None:
+                self.stats['exact_hits'] += 1
+                return entry.value
+            has_vectors = self._vectors is not None
+
+        if self._embed is not None and has_vectors:
+            vector = self._embedding(question)
+            if vector is not None:
+                with self._lock:
+                    match = self._semantic_match(vector, semantic_scope, now)
+                    if match is not None:
+                        self.stats['semantic_hits'] += 1
+                        return match.value
+
+        with self._lock:
+            self.stats['misses'] += 1
+        return None
+
+    def _semantic_match(self, vector, scope: str, now: float) -> Optional[_CacheEntry]:
+        """Entry cùng scope có cosine similarity cao nhất vượt ngưỡng (gọi khi đang giữ lock)"""
+        if vector.shape[0] != self._vectors.shape[1]:
+            return None
+        scope_id = self._scope_ids.get(scope)
+        if scope_id is None:
+            return None
+        similarities = np.where(self._slot_scopes == scope_id, self._vectors @ vector, -1.0)
+        best = int(np.argmax(similarities))
+        if similarities[best] < self.semantic_threshold:
+            return None
+        return self._valid_entry(self._slot_keys[best], now)
+
+    def put(self, messages: List[Dict[str, str]], model: str, value: Any):
+        """Lưu response (bỏ qua nếu request phụ thuộc context)"""
+        split = self._split_messages(messages, model)
+        if split is None:
+            return
+        question, scope, semantic_scope = split
+        key = self._key(question, scope)
+        vector = self._embedding(question) if self._embed is not None else None
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            while len(self._entries) >= self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.stats['evictions'] += 1
+
+            entry = _CacheEntry(value=value, expires_at=time.time() + self.ttl)
+            if vector is not None:
+                if self._vectors is None:
+                    self._vectors = np.zeros((self.max_entries, vector.shape[0]), dtype=np.float32)
+                if vector.shape[0] == self._vectors.shape[1]:
+                    slot = self._free_slots.pop()
+                    self._vectors[slot] = vector
+                    self._slot_keys[slot] = key
+                    self._slot_scopes[slot] = self._acquire_scope(semantic_scope)
+                    entry.slot = slot
+            self._entries[key] = entry
+
+    def clear(self):
+        """Xóa toàn bộ cache (giữ metrics)"""
+        with self._lock:
+            for key in list(self._entries):
+                self._remove(key)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Hit/miss metrics của cache"""
+        with self._lock:
+            stats = dict(self.stats)
+            stats['entries'] = len(self._entries)
+            stats['scopes'] = len(self._scope_ids)
+        hits = stats['exact_hits'] + stats['semantic_hits']
+        lookups = hits + stats['misses']
+        stats['hit_rate'] = round(hits / lookups, 4) if lookups else 0.0
+        stats['semantic_enabled'] = self._embed is not None
+        return stats
@@ -5,26 +5,55 @@ from config import Config
 from db_session_manager import get_user_data, save_user_data
 
 
-def handle_deadline_commands(question, user_data):
-    """Xử lý các lệnh liên quan đến deadline"""
+def upcoming_calendar_deadlines(user_id, days_ahead=7):
+    """
+    Deadline trên Google Calendar trong days_ahead ngày tới dạng [(tiêu đề, 'YYYY-MM-DD')],
+    đọc từ bản sao lịch cục bộ; rỗng nếu user chưa kết nối Google Calendar hoặc có lỗi
+    """
+    if not user_id:
+        return []
+    from calendar_manager import calendar_manager
+    result = calendar_manager.get_upcoming_deadlines(user_id, days_ahead)
+    if not result['success']:
+        return []
+    deadlines = []
+    for event in result['events']:
+        start = event.get('start', {})
+        date = start.get('date') or (start.get('dateTime') or '')[:10]
+        if date:
+            deadlines.append((event.get('summary', 'Không có tiêu đề'), date))
+    return deadlines
+
+
+def handle_deadline_commands(question, user_data, user_id=None):
+    """Xử lý các lệnh liên quan đến deadline (user_id: để kèm deadline sắp tới trên Google Calendar)"""
     q = question.strip()
     deadlines = user_data.get('deadlines', {})
     
     #xem tất cả deadline
     if re.match(r'^deadline$|xem deadline', q, re.I):
-        if not deadlines:
+        calendar_deadlines = upcoming_calendar_deadlines(user_id)
+        if not deadlines and not calendar_deadlines:
             return {"answer": "Chưa có deadline nào được lưu."}
         
         # sắp xếp theo ngày
         sorted_deadlines = sorted(deadlines.items(), key=lambda x: x[1])
         
-        result = "<strong>Danh sách deadline:</strong><br>"
+        result = "<strong>Danh sách deadline:</strong><br>" if deadlines else ""
         for subject, date in sorted_deadlines:
             days_left = calculate_days_left(date)
             urgency = get_urgency_icon(days_left)
             status = f"{days_left} ngày nữa" if days_left > 0 else "Đã hết hạn"
             result += f"{urgency} <strong>{subject}</strong>: {date} ({status})<br>"
         
+        if calendar_deadlines:
+            result += "<strong>Deadline trên Google Calendar (7 ngày tới):</strong><br>"
+            today = datetime.now().date()
+            for title, date in calendar_deadlines:
+                days_left = (datetime.strptime(date, '%Y-%m-%d').date() - today).days
+                status = f"{days_left} ngày nữa" if days_left > 0 else "Hôm nay"
+                result += f"{get_urgency_icon(days_left)} <strong>{title}</strong>: {date} ({status})<br>"
+        
         return {
             "answer": result,
             "suggestions": ["Thêm deadline mới", "Xóa deadline", "Lịch tuần này"]
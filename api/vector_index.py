@@ -0,0 +1,203 @@
+"""
+Vector index cho retrieval: embedding của FAQ (và các câu trả lời được đánh giá cao) dùng làm grounding cho AI
+
+Build offline (trong thư mục api):
+    python vector_index.py --build [--include-messages] [--min-rating 4]
+
+File sinh ra trong models/:
+- vector_index.faiss     FAISS IndexFlatIP (nếu cài faiss)
+- vector_index.npy       ma trận embedding float32 đã chuẩn hóa L2 (fallback NumPy)
+- vector_index.meta.json nội dung các passage, theo đúng thứ tự hàng của index
+
+Lúc chạy, index được memory-map (FAISS IO_FLAG_MMAP hoặc np.load(mmap_mode='r')) nên nhiều worker
+dùng chung page cache của OS thay vì mỗi process giữ một bản copy.
+"""
+import json
+import os
+import threading
+from typing import Dict, List, Optional
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import faiss
+except ImportError:
+    faiss = None
+
+MODELS_DIR = os.path.join(os.path.dirname(__file__), '..', 'models')
+FAISS_PATH = os.path.join(MODELS_DIR, 'vector_index.faiss')
+VECTORS_PATH = os.path.join(MODELS_DIR, 'vector_index.npy')
+META_PATH = os.path.join(MODELS_DIR, 'vector_index.meta.json')
+
+
+class VectorIndex:
+    """Index read-only các passage đã embedding, tìm theo cosine similarity"""
+
+    def __init__(self, passages: List[Dict], vectors=None, faiss_index=None, embedding_model: str = None):
+        self.passages = passages
+        self.vectors = vectors
+        self.faiss_index = faiss_index
+        self.embedding_model = embedding_model
+
+    @classmethod
+    def load(cls) -> Optional['VectorIndex']:
+        """Memory-map index đã build, None nếu chưa build"""
+        if np is None or not os.path.exists(META_PATH):
+            return None
+        with open(META_PATH, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+
+        faiss_index = None
+        if faiss is not None and os.path.exists(FAISS_PATH) and os.path.getsize(FAISS_PATH) > 0:
+            try:
+                faiss_index = faiss.read_index(FAISS_PATH, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+            except RuntimeError:
+                faiss_index = faiss.read_index(FAISS_PATH)
+
+        vectors = None
+        if faiss_index is None:
+            if not os.path.exists(VECTORS_PATH):
+                return None
+            vectors = np.load(VECTORS_PATH, mmap_mode='r')
+
+        index = cls(meta['passages'], vectors, faiss_index, meta.get('embedding_model'))
+        if index.size != len(index.passages):
+            print(f"[WARNING] Vector index has {index.size} vectors but {len(index.passages)} passages, ignoring it")
+            return None
+        return index
+
+    @property
+    def size(self) -> int:
+        return self.faiss_index.ntotal if self.faiss_index is not None else self.vectors.shape[0]
+
+    @property
+    def dimension(self) -> int:
+        return self.faiss_index.d if self.faiss_index is not None else self.vectors.shape[1]
+
+    def search(self, query_vector, top_k: int = 3) -> List[Dict]:
+        """Top-k passage theo cosine similarity với query vector"""
+        query = np.asarray(query_vector, dtype=np.float32).reshape(1, -1)
+        norm = np.linalg.norm(query)
+        if not norm or query.shape[1] != self.dimension:
+            return []
+        query /= norm
+        top_k = min(top_k, self.size)
+
+        if self.faiss_index is not None:
+            scores, ids = self.faiss_index.search(query, top_k)
+            hits = zip(ids[0], scores[0])
+        else:
+            similarities = self.vectors @ query[0]
+            ids = np.argpartition(-similarities, top_k - 1)[:top_k]
+            ids = ids[np.argsort(-similarities[ids])]
+            hits = zip(ids, similarities[ids])
+
+        return [dict(self.passages[int(i)], score=float(score)) for i, score in hits if i >= 0]
+
+
+def collect_passages(include_messages: bool = False, min_rating: int = 4) -> List[Dict]:
+    """Passage để index: toàn bộ FAQ, và (tuỳ chọn) các câu trả lời có rating >= min_rating"""
+    from faq_index import FAQ_PATH
+
+    with open(FAQ_PATH, 'r', encoding='utf-8') as f:
+        passages = [
+            {'source': 'faq', 'question': e['question'], 'answer': e['answer']}
+            for e in json.load(f) if e.get('question') and e.get('answer')
+        ]
+
+    if include_messages:
+        from database import get_db
+        passages.extend(
+            {'source': f"message:{m['id']}", 'question': m['question'], 'answer': m['answer']}
+            for m in get_db().get_rated_answers(min_rating)
+        )
+    return passages
+
+
+def build_index(include_messages: bool = False, min_rating: int = 4) -> int:
+    """Embedding các passage và ghi index ra models/, trả về số passage"""
+    from embedding_service import get_embedding_service
+    from openai_manager import openai_manager
+
+    passages = collect_passages(include_messages, min_rating)
+    service = get_embedding_service()
+    # passage không đổi lấy lại từ embedding store, chỉ text mới/đã sửa gọi API
+    embeddings = service.embed([f"{p['question']}\n{p['answer']}" for p in passages])
+    print(f"[INFO] Embedding stats: {service.stats}")
+
+    vectors = np.asarray(embeddings, dtype=np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    os.makedirs(MODELS_DIR, exist_ok=True)
+    np.save(VECTORS_PATH, vectors)
+    if faiss is not None:
+        faiss_index = faiss.IndexFlatIP(vectors.shape[1])
+        faiss_index.add(vectors)
+        faiss.write_index(faiss_index, FAISS_PATH)
+    with open(META_PATH, 'w', encoding='utf-8') as f:
+        json.dump({'embedding_model': openai_manager.embedding_model, 'passages': passages}, f, ensure_ascii=False)
+    return len(passages)
+
+
+class Retriever:
+    """Tìm passage liên quan tới câu hỏi để đưa vào prompt làm grounding"""
+
+    def __init__(self, index: VectorIndex, top_k: int = 3, min_score: float = 0.45):
+        self.index = index
+        self.top_k = top_k
+        self.min_score = min_score
+
+    def retrieve(self, question: str) -> List[Dict]:
+        """Các passage có similarity >= min_score (rỗng nếu không tính được embedding)"""
+        from openai_manager import openai_manager
+
+        if self.index.embedding_model and self.index.embedding_model != openai_manager.embedding_model:
+            return []
+        try:
+            query_vector = openai_manager.embed_text(question)
+        except Exception as e:
+            print(f"[WARNING] Retrieval embedding failed: {e}")
+            return []
+        return [p for p in self.index.search(query_vector, self.top_k) if p['score'] >= self.min_score]
+
+
+_retriever = None
+_retriever_loaded = False
+_retriever_lock = threading.Lock()
+
+
+def get_retriever() -> Optional[Retriever]:
+    """Retriever dùng chung, None nếu tắt hoặc index chưa được build"""
+    global _retriever, _retriever_loaded
+    if not _retriever_loaded:
+        with _retriever_lock:
+            if not _retriever_loaded:
+                from config import Config
+                settings = Config.VECTOR_INDEX_SETTINGS
+                if settings['enabled']:
+                    index = VectorIndex.load()
+                    if index is not None:
+                        _retriever = Retriever(index, settings['top_k'], settings['min_score'])
+                        print(f"[INFO] Vector index loaded: {index.size} passages "
+                              f"({'faiss' if index.faiss_index is not None else 'numpy mmap'})")
+                _retriever_loaded = True
+    return _retriever
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Build models/vector_index.* từ faq.json (và messages)")
+    parser.add_argument('--build', action='store_true', help="embedding và ghi index")
+    parser.add_argument('--include-messages', action='store_true', help="thêm câu trả lời có metadata.rating cao")
+    parser.add_argument('--min-rating', type=int, default=4)
+    args = parser.parse_args()
+
+    if args.build:
+        count = build_index(args.include_messages, args.min_rating)
+        print(f"[INFO] Indexed {count} passages into {os.path.abspath(MODELS_DIR)}")
+    else:
+        parser.print_help()
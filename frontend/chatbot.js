@@ -326,6 +326,7 @@ function getAIModeDisplay(mode) {
         'history': 'Lịch sử',
         'english': 'Tiếng Anh',
         'study': 'Học tập',
+        'faq': 'FAQ',
         'general': 'Chung'
     };
     return modes[mode] || mode;
@@ -506,7 +507,7 @@ async function sendQuestion() {
       try {
         // Check if this is a calendar request and calendar is available
         const isCalendarRequest = hasCalendarIntent(question);
-        let endpoint = '/chat';
+        let endpoint = '/chat/stream';
           if (isCalendarRequest && calendarStatus.authenticated && calendarStatus.status === 'ready') {
             console.log('[DEBUG] Detected calendar request, using calendar endpoint');
             endpoint = '/calendar/process';
@@ -522,7 +523,19 @@ async function sendQuestion() {
             credentials: 'same-origin'
         });
         
-        const data = await response.json();
+        let data;
+        let responseOk = response.ok;
+        if (response.ok && (response.headers.get('Content-Type') || '').startsWith('text/event-stream')) {
+            // Hiển thị từng đoạn câu trả lời ngay khi server gửi về
+            data = await readChatStream(response, (partialAnswer) => {
+                if (pendingMessages.has(messageId)) {
+                    replaceMessage(botMessageId, partialAnswer, 'bot');
+                }
+            });
+            responseOk = !data.error;
+        } else {
+            data = await response.json();
+        }
         
         // Kiểm tra xem tin nhắn này có còn pending không (tránh race condition)
         if (!pendingMessages.has(messageId)) {
@@ -532,7 +545,7 @@ async function sendQuestion() {
         
         // Remove từ pending
         pendingMessages.delete(messageId);
-          if (response.ok) {
+          if (responseOk) {
             // Replace typing indicator với response thực tế
             replaceMessage(botMessageId, data.answer || data.response || data.message, 'bot');
             
@@ -608,6 +621,46 @@ async function sendQuestion() {
     }
 }
 
+// Đọc response Server-Sent Events của /chat/stream, gọi onDelta với phần câu trả lời đã nhận,
+// trả về payload của event "done" (hoặc {error} nếu server gửi event "error")
+async function readChatStream(response, onDelta) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    let answer = '';
+    let result = null;
+    
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        
+        let boundary;
+        while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+            const rawEvent = buffer.slice(0, boundary);
+            buffer = buffer.slice(boundary + 2);
+            
+            let eventName = 'message';
+            let eventData = '';
+            rawEvent.split('\n').forEach(line => {
+                if (line.startsWith('event:')) eventName = line.slice(6).trim();
+                else if (line.startsWith('data:')) eventData += line.slice(5).trim();
+            });
+            if (!eventData) continue;
+            
+            const payload = JSON.parse(eventData);
+            if (eventName === 'delta') {
+                answer += payload.content;
+                onDelta(answer);
+            } else {
+                result = payload;
+            }
+        }
+    }
+    
+    return result || { error: 'Kết nối bị gián đoạn' };
+}
+
 function addMessage(message, sender, isTyping = false, customId = null) {
     const chatBox = document.getElementById('chatBox');
     const messageId = customId || `${sender}-${Date.now()}-${Math.random().toString(36).substr(2, 9)}`;